@@ -0,0 +1,47 @@
+"""refresh token hash
+
+Store refresh tokens as SHA-256 digests instead of full JWTs.
+Downgrade restores the column empty, issued refresh tokens can't be restored from digests.
+
+Revision ID: 5b1e7f3c9a2d
+Revises: 0422eea0c42d
+Create Date: 2024-01-15 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b1e7f3c9a2d'
+down_revision: Union[str, None] = '0422eea0c42d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('refresh_tokens', sa.Column('token_hash', sa.LargeBinary(length=32), nullable=True),
+                  schema='content')
+    # Identical tokens issued within the same second could never be looked up, keep one of each.
+    op.execute("DELETE FROM content.refresh_tokens a USING content.refresh_tokens b "
+               "WHERE a.jwt_token = b.jwt_token AND a.ctid < b.ctid")
+    op.execute("UPDATE content.refresh_tokens SET token_hash = sha256(convert_to(jwt_token, 'UTF8')) "
+               "WHERE jwt_token IS NOT NULL")
+    op.create_index(op.f('ix_content_refresh_tokens_token_hash'), 'refresh_tokens', ['token_hash'], unique=True,
+                    schema='content')
+    op.drop_index('idx_refresh_tokens_token', table_name='refresh_tokens', schema='content')
+    op.drop_index('ix_content_refresh_tokens_jwt_token', table_name='refresh_tokens', schema='content')
+    op.drop_column('refresh_tokens', 'jwt_token', schema='content')
+
+
+def downgrade() -> None:
+    op.add_column('refresh_tokens', sa.Column('jwt_token', sa.TEXT(), autoincrement=False, nullable=True),
+                  schema='content')
+    op.create_index('ix_content_refresh_tokens_jwt_token', 'refresh_tokens', ['jwt_token'], unique=False,
+                    schema='content')
+    op.create_index('idx_refresh_tokens_token', 'refresh_tokens', ['jwt_token', 'user_agent'], unique=False,
+                    schema='content')
+    op.drop_index(op.f('ix_content_refresh_tokens_token_hash'), table_name='refresh_tokens', schema='content')
+    op.drop_column('refresh_tokens', 'token_hash', schema='content')
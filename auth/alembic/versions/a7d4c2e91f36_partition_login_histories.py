@@ -0,0 +1,86 @@
+"""partition login histories
+
+Range-partition login_histories by month of created_at, with a (user_id, created_at DESC, id DESC) index.
+Partitions are created for the months of existing rows and two months ahead, later ones are created
+by the retention job.
+
+Revision ID: a7d4c2e91f36
+Revises: 5b1e7f3c9a2d
+Create Date: 2024-01-22 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a7d4c2e91f36'
+down_revision: Union[str, None] = '5b1e7f3c9a2d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.rename_table('login_histories', 'login_histories_old', schema='content')
+    op.execute("ALTER TABLE content.login_histories_old RENAME CONSTRAINT login_histories_pkey "
+               "TO login_histories_old_pkey")
+    op.execute("""
+        CREATE TABLE content.login_histories (
+            id UUID NOT NULL,
+            user_id UUID REFERENCES content.users (id) ON DELETE CASCADE,
+            user_agent VARCHAR,
+            ip_address VARCHAR,
+            created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at)
+    """)
+    op.execute("""
+        DO $$
+        DECLARE
+            month DATE := date_trunc('month', coalesce(
+                (SELECT min(created_at) FROM content.login_histories_old), now() AT TIME ZONE 'utc'))::date;
+            last_month DATE := (date_trunc('month', now() AT TIME ZONE 'utc') + interval '2 months')::date;
+        BEGIN
+            WHILE month <= last_month LOOP
+                EXECUTE format(
+                    'CREATE TABLE content.%I PARTITION OF content.login_histories FOR VALUES FROM (%L) TO (%L)',
+                    'login_histories_y' || to_char(month, 'YYYY') || 'm' || to_char(month, 'MM'),
+                    month, (month + interval '1 month')::date
+                );
+                month := (month + interval '1 month')::date;
+            END LOOP;
+        END $$
+    """)
+    op.execute("""
+        INSERT INTO content.login_histories (id, user_id, user_agent, ip_address, created_at)
+        SELECT id, user_id, user_agent, ip_address, coalesce(created_at, now() AT TIME ZONE 'utc')
+        FROM content.login_histories_old
+    """)
+    op.create_index('ix_content_login_histories_user_id_created_at', 'login_histories',
+                    ['user_id', sa.text('created_at DESC'), sa.text('id DESC')], unique=False, schema='content')
+    op.drop_table('login_histories_old', schema='content')
+
+
+def downgrade() -> None:
+    op.create_table('login_histories_old',
+    sa.Column('id', sa.UUID(), nullable=False),
+    sa.Column('user_id', sa.UUID(), nullable=True),
+    sa.Column('user_agent', sa.String(), nullable=True),
+    sa.Column('ip_address', sa.String(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['content.users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id', name='login_histories_old_pkey'),
+    schema='content'
+    )
+    op.execute("""
+        INSERT INTO content.login_histories_old (id, user_id, user_agent, ip_address, created_at)
+        SELECT id, user_id, user_agent, ip_address, created_at FROM content.login_histories
+    """)
+    op.drop_table('login_histories', schema='content')
+    op.rename_table('login_histories_old', 'login_histories', schema='content')
+    op.execute("ALTER TABLE content.login_histories RENAME CONSTRAINT login_histories_old_pkey "
+               "TO login_histories_pkey")
+    op.create_index(op.f('ix_content_login_histories_id'), 'login_histories', ['id'], unique=False,
+                    schema='content')
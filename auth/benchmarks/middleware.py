@@ -0,0 +1,114 @@
+"""
+Compares per-request overhead of the middleware stack: `@app.middleware('http')` with a global `SessionMiddleware`
+against the pure ASGI middlewares. Requests are sent straight to the ASGI app, without a server or a client,
+so the difference is the middleware cost.
+
+Run from the `auth` directory:
+
+    python -m benchmarks.middleware --requests 20000
+"""
+import asyncio
+import time
+from http import HTTPStatus
+
+import typer
+from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
+from starlette.middleware.sessions import SessionMiddleware
+from starlette.requests import Request
+
+from src.core.middleware import PathPrefixMiddleware, RequestIdMiddleware
+
+app = typer.Typer()
+
+
+def base_http_app() -> FastAPI:
+    """
+    The stack as it was: request id check in `@app.middleware('http')`, sessions on every route.
+    """
+    fastapi_app = FastAPI(default_response_class=ORJSONResponse)
+    fastapi_app.add_middleware(SessionMiddleware, secret_key='secret')
+
+    @fastapi_app.middleware('http')
+    async def before_request(request: Request, call_next):
+        if not request.headers.get('X-Request-Id'):
+            return ORJSONResponse(status_code=HTTPStatus.BAD_REQUEST, content={'detail': 'X-Request-Id is required'})
+        return await call_next(request)
+
+    @fastapi_app.get('/health')
+    async def health():
+        return {'status': 'ok'}
+
+    return fastapi_app
+
+
+def pure_asgi_app() -> FastAPI:
+    """
+    The current stack: pure ASGI request id middleware, sessions on OAuth routes only.
+    """
+    fastapi_app = FastAPI(default_response_class=ORJSONResponse)
+    fastapi_app.add_middleware(PathPrefixMiddleware, middleware_class=SessionMiddleware,
+                               prefixes=['/api/v1/user/login/'], secret_key='secret')
+    fastapi_app.add_middleware(RequestIdMiddleware)
+
+    @fastapi_app.get('/health')
+    async def health():
+        return {'status': 'ok'}
+
+    return fastapi_app
+
+
+async def call(asgi_app, scope: dict):
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        pass
+
+    await asgi_app(dict(scope), receive, send)
+
+
+async def measure(asgi_app, requests: int) -> float:
+    """
+    Sends `requests` GET /health requests.
+
+    :return: Mean time per request, in microseconds.
+    """
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+        'path': '/health', 'raw_path': b'/health', 'root_path': '', 'query_string': b'',
+        'headers': [(b'host', b'localhost'), (b'x-request-id', b'benchmark'), (b'cookie', b'session=')],
+        'client': ('127.0.0.1', 1234), 'server': ('127.0.0.1', 8000),
+    }
+    # Warm-up builds the middleware stack.
+    for _ in range(100):
+        await call(asgi_app, scope)
+    started_at = time.perf_counter()
+    for _ in range(requests):
+        await call(asgi_app, scope)
+    return (time.perf_counter() - started_at) / requests * 1_000_000
+
+
+async def run(requests: int):
+    results = {
+        'base_http': await measure(base_http_app(), requests),
+        'pure_asgi': await measure(pure_asgi_app(), requests),
+    }
+    print(f'{"stack":<12}{"latency, us":>14}')
+    for name, latency in results.items():
+        print(f'{name:<12}{latency:>14.1f}')
+    print(f'saved per request, us: {results["base_http"] - results["pure_asgi"]:.1f}')
+
+
+@app.command()
+def main(requests: int = 20000):
+    """
+    Measures per-request overhead of both middleware stacks.
+
+    :param requests: Number of requests per stack.
+    """
+    asyncio.run(run(requests))
+
+
+if __name__ == '__main__':
+    app()
@@ -0,0 +1,89 @@
+"""
+Compares rate limiting engines: Redis commands per check, check latency and memory per key.
+
+Run from the `auth` directory against a disposable Redis instance:
+
+    python -m benchmarks.rate_limit --requests 2000 --keys 100
+"""
+import asyncio
+import time
+
+import typer
+from redis.asyncio import Redis
+
+from src.core.config import RateLimitConfig, RedisConf
+from src.services.rate_limit import RateLimitEngineFactory
+
+app = typer.Typer()
+
+ENGINES = ('sliding_window', 'token_bucket', 'gcra', 'hybrid')
+
+
+async def total_calls(redis: Redis) -> int:
+    """
+    Sums calls of all commands executed by the server, excluding INFO itself.
+
+    :param redis: Redis client.
+    :return: Total number of executed commands.
+    """
+    stats = await redis.info('commandstats')
+    return sum(value['calls'] for name, value in stats.items() if name != 'cmdstat_info')
+
+
+async def run_engine(redis: Redis, algorithm: str, requests: int, keys: int, limit: int, period: int) -> dict:
+    """
+    Runs `requests` checks spread over `keys` keys for one engine.
+
+    :return: A dict with measured values.
+    """
+    engine = RateLimitEngineFactory.create_engine(algorithm, redis, RateLimitConfig())
+    await engine.load()
+    key_names = [f'benchmark:{algorithm}:{i}' for i in range(keys)]
+    await redis.delete(*key_names)
+    await redis.config_resetstat()
+
+    calls_before = await total_calls(redis)
+    started_at = time.perf_counter()
+    for i in range(requests):
+        await engine.check(key_names[i % keys], limit, period)
+    elapsed = time.perf_counter() - started_at
+    calls = await total_calls(redis) - calls_before
+
+    memory = [await redis.memory_usage(key) or 0 for key in key_names]
+    await redis.delete(*key_names)
+    return {
+        'algorithm': algorithm,
+        'ops_per_check': calls / requests,
+        'latency_us': elapsed / requests * 1_000_000,
+        'memory_per_key': sum(memory) / keys,
+    }
+
+
+async def run(requests: int, keys: int, limit: int, period: int):
+    redis_conf = RedisConf()
+    redis = Redis.from_url(f'redis://{redis_conf.host}:{redis_conf.port}')
+    try:
+        print(f'{"algorithm":<16}{"redis ops/check":>18}{"latency, us":>14}{"bytes/key":>12}')
+        for algorithm in ENGINES:
+            result = await run_engine(redis, algorithm, requests, keys, limit, period)
+            print(f'{result["algorithm"]:<16}{result["ops_per_check"]:>18.2f}'
+                  f'{result["latency_us"]:>14.1f}{result["memory_per_key"]:>12.0f}')
+    finally:
+        await redis.close()
+
+
+@app.command()
+def main(requests: int = 2000, keys: int = 100, limit: int = 40, period: int = 60):
+    """
+    Benchmarks all registered rate limiting engines.
+
+    :param requests: Total number of checks per engine.
+    :param keys: Number of distinct limiter keys.
+    :param limit: Allowed requests per period.
+    :param period: Period length in seconds.
+    """
+    asyncio.run(run(requests, keys, limit, period))
+
+
+if __name__ == '__main__':
+    app()
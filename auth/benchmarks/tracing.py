@@ -0,0 +1,134 @@
+"""
+Measures per-request tracing overhead at different sampling settings. Requests are sent straight to an
+instrumented ASGI app, spans are exported by the batch processor to an exporter that discards them
+(or serializes them, for the console exporter), so the difference is the tracing cost.
+
+Run from the `auth` directory:
+
+    python -m benchmarks.tracing --requests 20000
+"""
+import asyncio
+import io
+import time
+from typing import Sequence
+
+import typer
+from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
+from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
+from opentelemetry.sdk.trace import ReadableSpan
+from opentelemetry.sdk.trace.export import (ConsoleSpanExporter, SpanExporter,
+                                            SpanExportResult)
+
+from src.core.config import JaegerConf, TracingConfig
+from src.utils.jaeger import create_tracer_provider
+
+app = typer.Typer()
+
+# Name: tracing settings, whether spans are also serialized by the console exporter.
+SETTINGS = {
+    'always_on+console': ({'sampler': 'always_on'}, True),
+    'always_on': ({'sampler': 'always_on'}, False),
+    'ratio 0.1': ({'sampler': 'ratio', 'ratio': 0.1}, False),
+    'ratio 0.01': ({'sampler': 'ratio', 'ratio': 0.01}, False),
+    'rate_limited 10/s': ({'sampler': 'rate_limited', 'rate_limit': 10.0}, False),
+    'ratio 0.01+tail': ({'sampler': 'ratio', 'ratio': 0.01, 'tail_sampling': True}, False),
+    'always_off': ({'sampler': 'always_off'}, False),
+}
+
+
+class CountingSpanExporter(SpanExporter):
+    """
+    Discards spans, counting them.
+    """
+    def __init__(self):
+        self.exported = 0
+
+    def export(self, spans: Sequence[ReadableSpan]) -> SpanExportResult:
+        self.exported += len(spans)
+        return SpanExportResult.SUCCESS
+
+    def shutdown(self):
+        pass
+
+
+def create_app(settings: dict | None, console: bool = False) -> tuple[FastAPI, CountingSpanExporter | None]:
+    """
+    Builds an app with a single route, instrumented unless `settings` is None.
+
+    :param settings: Tracing settings.
+    :param console: Also export spans with the console exporter, into memory.
+    :return: The app and its counting exporter.
+    """
+    fastapi_app = FastAPI(default_response_class=ORJSONResponse)
+
+    @fastapi_app.get('/health')
+    async def health():
+        return {'status': 'ok'}
+
+    if settings is None:
+        return fastapi_app, None
+    exporter = CountingSpanExporter()
+    config = TracingConfig(exporters='', **settings)
+    exporters = [exporter, ConsoleSpanExporter(out=io.StringIO())] if console else [exporter]
+    provider = create_tracer_provider(JaegerConf(), config, exporters=exporters)
+    FastAPIInstrumentor.instrument_app(fastapi_app, tracer_provider=provider)
+    fastapi_app.state.tracer_provider = provider
+    return fastapi_app, exporter
+
+
+async def call(asgi_app, scope: dict):
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        pass
+
+    await asgi_app(dict(scope), receive, send)
+
+
+async def measure(asgi_app, requests: int) -> float:
+    """
+    Sends `requests` GET /health requests.
+
+    :return: Mean time per request, in microseconds.
+    """
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+        'path': '/health', 'raw_path': b'/health', 'root_path': '', 'query_string': b'',
+        'headers': [(b'host', b'localhost')],
+        'client': ('127.0.0.1', 1234), 'server': ('127.0.0.1', 8000),
+    }
+    # Warm-up builds the middleware stack.
+    for _ in range(100):
+        await call(asgi_app, scope)
+    started_at = time.perf_counter()
+    for _ in range(requests):
+        await call(asgi_app, scope)
+    return (time.perf_counter() - started_at) / requests * 1_000_000
+
+
+async def run(requests: int):
+    fastapi_app, _ = create_app(None)
+    baseline = await measure(fastapi_app, requests)
+    print(f'{"setting":<20}{"latency, us":>14}{"overhead, us":>14}{"spans exported":>16}')
+    print(f'{"no tracing":<20}{baseline:>14.1f}{0.0:>14.1f}{0:>16}')
+    for name, (settings, console) in SETTINGS.items():
+        fastapi_app, exporter = create_app(settings, console)
+        latency = await measure(fastapi_app, requests)
+        fastapi_app.state.tracer_provider.shutdown()
+        print(f'{name:<20}{latency:>14.1f}{latency - baseline:>14.1f}{exporter.exported:>16}')
+
+
+@app.command()
+def main(requests: int = 20000):
+    """
+    Measures per-request tracing overhead at each sampling setting.
+
+    :param requests: Number of requests per setting.
+    """
+    asyncio.run(run(requests))
+
+
+if __name__ == '__main__':
+    app()
@@ -0,0 +1,65 @@
+"""
+Imports users from a CSV file with a header or a JSON lines file, run from the `auth` directory:
+
+    python import_users.py users.csv --rejects rejects.csv
+    python import_users.py users.jsonl --format jsonl
+
+Fields: login, password or password_hash (werkzeug format), first_name, last_name, email.
+Existing logins are rejected, not updated.
+"""
+import asyncio
+import csv
+from pathlib import Path
+
+import typer
+
+from src.core import config
+from src.core.logger import logger
+from src.db.postgres import engine
+from src.services.password import get_password_hasher
+from src.services.user_import import (ImportReport, Rejection, UserImporter,
+                                      read_records)
+
+app = typer.Typer()
+
+
+async def run_import(path: Path, file_format: str, rejects: Path | None) -> ImportReport:
+    password_hasher = get_password_hasher()
+    importer = UserImporter(config.get_user_import_config(), password_hasher, engine)
+    rejects_file = open(rejects, 'w', newline='', encoding='utf-8') if rejects is not None else None
+    rejects_writer = csv.writer(rejects_file) if rejects_file is not None else None
+    if rejects_writer is not None:
+        rejects_writer.writerow(('line', 'login', 'reason'))
+
+    def on_rejected(rejection: Rejection):
+        if rejects_writer is not None:
+            rejects_writer.writerow((rejection.line, rejection.login, rejection.reason))
+
+    try:
+        with open(path, newline='', encoding='utf-8') as file:
+            return await importer.run(read_records(file, file_format), on_rejected)
+    finally:
+        if rejects_file is not None:
+            rejects_file.close()
+        password_hasher.shutdown()
+        await engine.dispose()
+
+
+@app.command()
+def import_users(path: Path,
+                 file_format: str = typer.Option('csv', '--format', help="Input format: csv or jsonl."),
+                 rejects: Path = typer.Option(None, help="CSV file for rejected rows, with line numbers and reasons.")):
+    """
+    Imports users from a file.
+
+    :param path: The input file.
+    :param file_format: 'csv' or 'jsonl'.
+    :param rejects: Where to write rejected rows.
+    """
+    report = asyncio.run(run_import(path, file_format, rejects))
+    logger.info(f"Users import finished in {report.elapsed:.1f} s: {report.total} rows, "
+                f"{report.imported} imported, {report.rejected} rejected, {report.rows_per_second:.0f} rows/s")
+
+
+if __name__ == "__main__":
+    app()
@@ -6,12 +6,22 @@ from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from create_admin import create_admin
 from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
 from sqlalchemy.exc import SQLAlchemyError
+from src.api import internal, metrics, well_known
 from src.api.v1 import roles, user
 from src.core import config
 from src.core.logger import logger
+from src.core.metrics import MetricsMiddleware, exporter
+from src.core.middleware import PathPrefixMiddleware, RequestIdMiddleware
 from src.db import cache
 from src.db.cache import CacheBackendFactory, CacheClientInitializer
 from src.db.postgres import create_database
+from src.services.denylist import get_token_denylist
+from src.services.keys import get_key_store
+from src.services.login_history import (LoginHistoryRetention,
+                                        get_login_history_writer)
+from src.services.password import get_password_hasher
+from src.services.rate_limit import get_rate_limiter
+from src.services.role_cache import get_role_cache
 from src.services.utils import TokenCleaner
 from src.utils.jaeger import configure_tracer
 from starlette.requests import Request
@@ -25,7 +35,7 @@ fast_api_conf = config.get_config()
 
 
 if fast_api_conf.enable_tracer:
-    configure_tracer(fast_api_conf.jaeger.host, fast_api_conf.jaeger.port)
+    configure_tracer(fast_api_conf.jaeger, config.get_tracing_config())
 app = FastAPI(
     title=fast_api_conf.name,
     docs_url='/api/openapi-auth',
@@ -33,7 +43,14 @@ app = FastAPI(
     default_response_class=ORJSONResponse,
 )
 
-app.add_middleware(SessionMiddleware, secret_key=fast_api_conf.secret_key_session)
+# Only the OAuth flow keeps state in the session cookie.
+app.add_middleware(PathPrefixMiddleware,
+                   middleware_class=SessionMiddleware,
+                   prefixes=['/api/v1/user/login/'],
+                   secret_key=fast_api_conf.secret_key_session)
+app.add_middleware(RequestIdMiddleware, exempt_paths=['/metrics'])
+if config.get_metrics_config().is_on:
+    app.add_middleware(MetricsMiddleware)
 
 scheduler = AsyncIOScheduler()
 
@@ -52,15 +69,34 @@ async def startup():
 
     cache_conf = config.CacheConf.read_config()
     logger.info('Startup api service.')
+    get_key_store()
     cache.cache = await CacheBackendFactory.create_backend(
         cache_conf.backend_type,
         **cache_conf.get_init_params()
     )
-    utils_service.token_cleaner = TokenCleaner()
-    await utils_service.token_cleaner.init_session()
-    scheduler.add_job(utils_service.token_cleaner.clear_expired_token,
+    rate_limiter = get_rate_limiter(config.get_rate_limit_config(), cache.cache.client)
+    await rate_limiter.engine.load()
+    if rate_limiter.engine.flush_interval is not None:
+        scheduler.add_job(rate_limiter.engine.flush, 'interval', seconds=rate_limiter.engine.flush_interval)
+    get_role_cache().start(cache.cache.client)
+    get_token_denylist().start(cache.cache.client)
+    if config.get_metrics_config().is_on:
+        metrics.register_collectors()
+        exporter.start(cache.cache.client)
+    if config.get_login_history_config().is_on:
+        get_login_history_writer().start(cache.cache.client)
+    utils_service.token_cleaner = TokenCleaner(config.get_token_cleaner_config(), cache.cache.client,
+                                               interval=fast_api_conf.clear_expired_token_frequency)
+    if config.get_session_store_config().backend == 'postgres':
+        # Redis sessions expire by themselves.
+        scheduler.add_job(utils_service.token_cleaner.clear_expired_token,
+                          'interval',
+                          seconds=fast_api_conf.clear_expired_token_frequency)
+    login_history_retention = LoginHistoryRetention(config.get_login_history_config(), cache.cache.client)
+    await login_history_retention.run()
+    scheduler.add_job(login_history_retention.run,
                       'interval',
-                      seconds=fast_api_conf.clear_expired_token_frequency)
+                      seconds=config.get_login_history_config().retention_frequency)
     scheduler.start()
 
 
@@ -73,11 +109,15 @@ async def shutdown():
     """
     cache_conf = config.CacheConf.read_config()
     logger.info('Shutdown api service.')
+    await get_role_cache().close()
+    await get_token_denylist().close()
+    await get_login_history_writer().close()
+    await exporter.close()
     await CacheClientInitializer.close_client(
         cache_conf.backend_type,
         cache.cache.client
     )
-    await utils_service.token_cleaner.close_session()
+    get_password_hasher().shutdown()
     scheduler.shutdown()
 
 
@@ -107,28 +147,14 @@ async def sqlalchemy_exception_handler(request: Request, exc: SQLAlchemyError):
     )
 
 
-@app.middleware('http')
-async def before_request(request: Request, call_next):
-    """Middleware to enforce the presence of 'X-Request-Id' header in all incoming requests.
-
-    :param request: The incoming HTTP request instance.
-    :param call_next: The function to call the next middleware or route handler.
-    :return: An ORJSONResponse with status code 400 if 'X-Request-Id' is missing, otherwise proceeds to the next handler
-    """
-    # TODO Have troubles with requests from movies-api swagger documentation.
-    request_id = request.headers.get('X-Request-Id')
-    if not request_id:
-        return ORJSONResponse(
-            status_code=HTTPStatus.BAD_REQUEST,
-            content={'detail': 'X-Request-Id is required'}
-        )
-    return await call_next(request)
-
 FastAPIInstrumentor.instrument_app(app)
 
 
 app.include_router(user.router, prefix='/api/v1/user', tags=['user'])
 app.include_router(roles.router, prefix='/api/v1/roles', tags=['roles'])
+app.include_router(well_known.router, prefix='/.well-known', tags=['well-known'])
+app.include_router(internal.router, prefix='/internal/metrics', tags=['internal'])
+app.include_router(metrics.router, tags=['internal'])
 
 
 if __name__ == '__main__':
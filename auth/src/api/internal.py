@@ -0,0 +1,25 @@
+from http import HTTPStatus
+
+from fastapi import APIRouter
+
+from src.db.postgres import db_metrics, engine, replica_router
+
+router = APIRouter()
+
+
+@router.get('/db',
+            status_code=HTTPStatus.OK,
+            summary="Database metrics",
+            description="Connection pool state, pool wait and query timings of the worker serving the request, "
+                        "for the primary and the read replica.")
+async def get_db_metrics() -> dict:
+    """
+    Returns database metrics of this worker. Not routed by nginx, meant for scraping inside the network.
+
+    :return: Pool state and timing counters of the primary, and of the replica with its lag and routing counters.
+        Times are in seconds.
+    """
+    return {
+        'primary': db_metrics.stats(engine.sync_engine),
+        'replica': replica_router.stats(),
+    }
@@ -0,0 +1,92 @@
+from http import HTTPStatus
+from typing import Callable, Iterable
+
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import PlainTextResponse
+
+from src.core.config import MetricsConfig, get_metrics_config
+from src.core.metrics import exporter, registry
+from src.db.postgres import db_conf, db_metrics, engine, replica_router
+from src.services.denylist import get_token_denylist
+from src.services.login_history import get_login_history_writer
+from src.services.password import get_password_hasher
+from src.services.role_cache import get_role_cache
+from src.services.single_flight import flights
+from src.services.utils import get_user_agent_cache_stats
+
+router = APIRouter()
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def pool_samples() -> Iterable[tuple[tuple[str, ...], dict]]:
+    """
+    Returns pool state of the primary and of the read replica, if there is one.
+    """
+    yield ('primary',), db_metrics.stats(engine.sync_engine)
+    replica_stats = replica_router.stats()
+    if replica_stats is not None:
+        yield ('replica',), replica_stats
+
+
+def component_samples(components: dict[str, Callable[[], dict | None]]) -> Iterable[tuple[tuple[str, ...], float]]:
+    for component, stats in components.items():
+        for stat, value in (stats() or {}).items():
+            if isinstance(value, (int, float)):
+                yield (component, stat), value
+
+
+def register_collectors():
+    """
+    Exposes counters that components keep for the internal JSON endpoints, read at collection time.
+    """
+    registry.callback(
+        'token_denylist_events_total', 'Access token denylist checks, bloom filter hits, false positives, '
+        'Redis checks and token generation cache hits and misses.', ('event',),
+        lambda: (((event,), value) for event, value in get_token_denylist().stats().items() if event != 'filter_items'),
+        'counter')
+    registry.callback(
+        'token_denylist_filter_items', 'Items in the access token denylist bloom filter.', (),
+        lambda: [((), get_token_denylist().stats()['filter_items'])])
+    registry.callback(
+        'db_pool_connections', 'Database connections by state.', ('pool', 'state'),
+        lambda: (((pool, state), stats[state]) for (pool,), stats in pool_samples()
+                 for state in ('checked_out', 'checked_in', 'overflow')))
+    registry.callback(
+        'db_pool_saturation', 'Share of the max database connections checked out.', ('pool',),
+        lambda: ((labels, stats['checked_out'] / (stats['pool_size'] + db_conf.max_overflow))
+                 for labels, stats in pool_samples()))
+    registry.callback(
+        'db_replica_lag_seconds', 'Replication lag of the read replica.', (),
+        lambda: [((), (replica_router.stats() or {}).get('lag'))])
+    registry.callback(
+        'single_flight_calls_total', 'Coalesced lookups: calls executed and calls that joined one in flight.',
+        ('flight', 'result'),
+        lambda: (((name, result), flight.stats()[result]) for name, flight in list(flights.items())
+                 for result in ('executed', 'deduplicated')),
+        'counter')
+    registry.callback(
+        'auth_component_stat', 'Counters kept by components of the worker.', ('component', 'stat'),
+        lambda: component_samples({
+            'role_cache': get_role_cache().stats,
+            'login_history': get_login_history_writer().stats,
+            'password_hasher': get_password_hasher().stats,
+            'user_agent_cache': get_user_agent_cache_stats,
+        }), 'untyped')
+
+
+@router.get('/metrics',
+            status_code=HTTPStatus.OK,
+            summary="Prometheus metrics",
+            description="Metrics of all live workers in the Prometheus text format, samples have the `worker` label.",
+            response_class=PlainTextResponse)
+async def get_metrics(config: MetricsConfig = Depends(get_metrics_config)) -> PlainTextResponse:
+    """
+    Returns metrics of all workers. Not routed by nginx, meant for scraping inside the network.
+
+    :param config: Metrics configuration settings.
+    :return: The exposition text.
+    """
+    if not config.is_on:
+        raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail="Metrics are disabled")
+    return PlainTextResponse(await exporter.collect(), media_type=CONTENT_TYPE)
@@ -967,3 +967,141 @@ auth_callback = {
         }
     }
 }
+
+login_history_page = {
+    HTTPStatus.OK: {
+        "description": "Login history page successfully retrieved.",
+        "content": {
+            "application/json": {
+                "examples": {
+                    "Login History Page Example": {
+                        "value": {
+                            "items": login_history[HTTPStatus.OK]["content"]["application/json"]["examples"][
+                                "Login History Example"]["value"],
+                            "next_cursor": "MjAyMy0wMS0wMlQxNTozMDowMHxlNGQ5YjVhMi0xMWI4LTRjMzYt"
+                                           "OTc2Zi0xYmQ4YjQ2ZDNhYmQ="
+                        }
+                    }
+                }
+            }
+        }
+    },
+    HTTPStatus.BAD_REQUEST: {
+        "description": "Malformed cursor.",
+        "content": {
+            "application/json": {
+                "examples": {
+                    "Invalid Cursor": {
+                        "value": {
+                            "detail": "Invalid cursor"
+                        }
+                    }
+                }
+            }
+        }
+    },
+    HTTPStatus.UNAUTHORIZED: login_history[HTTPStatus.UNAUTHORIZED],
+}
+
+introspect = {
+    HTTPStatus.OK: {
+        "description": "Introspection results, in the order of the request.",
+        "content": {
+            "application/json": {
+                "examples": {
+                    "Introspection Example": {
+                        "value": {
+                            "results": [
+                                {
+                                    "active": True,
+                                    "sub": "e4d9b5a2-11b8-4c36-976f-1bd8b46d3abd",
+                                    "roles": ["User", "Moderator"],
+                                    "exp": 1705412000
+                                },
+                                {
+                                    "active": False,
+                                    "sub": None,
+                                    "roles": [],
+                                    "exp": None
+                                }
+                            ]
+                        }
+                    }
+                }
+            }
+        }
+    },
+    HTTPStatus.BAD_REQUEST: {
+        "description": "Too many tokens in the request.",
+        "content": {
+            "application/json": {
+                "examples": {
+                    "Too Many Tokens": {
+                        "value": {
+                            "detail": "Too many tokens, max 100"
+                        }
+                    }
+                }
+            }
+        }
+    },
+}
+
+bulk_change_roles = {
+    HTTPStatus.OK: {
+        "description": "Progress reports as JSON lines, one per chunk, the last one has `done` or `error` set.",
+        "content": {
+            "application/x-ndjson": {
+                "examples": {
+                    "Progress Example": {
+                        "value": '{"processed": 5000, "changed": 4990}\n'
+                                 '{"processed": 7500, "changed": 7480}\n'
+                                 '{"processed": 7500, "changed": 7480, "done": true}\n'
+                    }
+                }
+            }
+        }
+    },
+    HTTPStatus.BAD_REQUEST: {
+        "description": "Too many pairs in the request.",
+        "content": {
+            "application/json": {
+                "examples": {
+                    "Too Many Pairs": {
+                        "value": {
+                            "detail": "Too many pairs, max 100000"
+                        }
+                    }
+                }
+            }
+        }
+    },
+    HTTPStatus.FORBIDDEN: {
+        "description": "The user is not an admin.",
+        "content": {
+            "application/json": {
+                "examples": {
+                    "Forbidden": {
+                        "value": {
+                            "detail": "You do not have permission to perform this action"
+                        }
+                    }
+                }
+            }
+        }
+    },
+    HTTPStatus.NOT_FOUND: {
+        "description": "The role of a filtered request doesn't exist.",
+        "content": {
+            "application/json": {
+                "examples": {
+                    "Role Not Found": {
+                        "value": {
+                            "detail": "Role not found"
+                        }
+                    }
+                }
+            }
+        }
+    },
+}
@@ -2,7 +2,7 @@ import re
 from datetime import datetime
 from uuid import UUID
 
-from pydantic import BaseModel, EmailStr, Field
+from pydantic import BaseModel, EmailStr, Field, model_validator
 from pydantic.functional_validators import AfterValidator
 from typing_extensions import Annotated
 
@@ -100,10 +100,30 @@ class LoginHistoryResponse(BaseModel):
     login_date: datetime
 
 
+class LoginHistoryPageResponse(BaseModel):
+    items: list[LoginHistoryResponse]
+    next_cursor: str | None
+
+
 class RoleNamesResponse(BaseModel):
     name: str
 
 
+class IntrospectRequest(BaseModel):
+    tokens: list[str] = Field(min_length=1)
+
+
+class TokenIntrospection(BaseModel):
+    active: bool
+    sub: str | None = None
+    roles: list[str] = []
+    exp: int | None = None
+
+
+class IntrospectResponse(BaseModel):
+    results: list[TokenIntrospection]
+
+
 class RoleResponse(BaseModel):
     id: str
     name: str
@@ -115,6 +135,29 @@ class AssignRoleRequest(BaseModel):
     role_id: UUID
 
 
+class UserFilter(BaseModel):
+    login_prefix: str | None = None
+    email_domain: str | None = None
+    created_after: datetime | None = None
+    created_before: datetime | None = None
+    is_oauth2: bool | None = None
+
+
+class BulkRoleChangeRequest(BaseModel):
+    """
+    Either explicit (user_id, role_id) pairs, or a role with a filter of users.
+    """
+    pairs: list[AssignRoleRequest] = []
+    role_id: UUID | None = None
+    user_filter: UserFilter | None = None
+
+    @model_validator(mode='after')
+    def check_target(self) -> 'BulkRoleChangeRequest':
+        if bool(self.pairs) == (self.role_id is not None):
+            raise ValueError('Pass either pairs, or role_id with an optional user_filter')
+        return self
+
+
 class OauthData(BaseModel):
     user_id: str
     email: str | None
@@ -1,12 +1,16 @@
+import json
 from http import HTTPStatus
 from uuid import UUID
 
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 
 import src.api.v1.api_examples as api_examples
-from src.api.v1.models.entity import (AssignRoleRequest, RoleCreate,
-                                      RoleNamesResponse, RoleResponse)
+from src.api.v1.models.entity import (AssignRoleRequest, BulkRoleChangeRequest,
+                                      RoleCreate, RoleNamesResponse,
+                                      RoleResponse)
 from src.api.v1.user import get_token
+from src.core.config import BulkRolesConfig, get_bulk_roles_config
 from src.core.logger import logger
 from src.models.entity import Role
 from src.services.rate_limit import rate_limit_dependency
@@ -188,3 +192,72 @@ async def detach_role_from_user(detach_role: AssignRoleRequest,
     await role_service.detach_role_from_user(detach_role.user_id, detach_role.role_id, access_token)
     user_roles = await role_service.get_roles_by_user_id(detach_role.user_id, access_token)
     return [RoleNamesResponse(name=role.name) for role in user_roles]
+
+
+async def bulk_change_roles(request: BulkRoleChangeRequest, assign: bool, access_token: str,
+                            role_service: RoleService, config: BulkRolesConfig) -> StreamingResponse:
+    """
+    Checks a bulk role change request and streams its progress as JSON lines.
+    """
+    await role_service.require_admin(access_token)
+    if request.pairs:
+        if len(request.pairs) > config.max_pairs:
+            raise HTTPException(status_code=HTTPStatus.BAD_REQUEST,
+                                detail=f"Too many pairs, max {config.max_pairs}")
+        pairs = list(dict.fromkeys((pair.user_id, pair.role_id) for pair in request.pairs))
+        chunks = role_service.iter_pair_chunks(pairs, config.chunk_size)
+    else:
+        if await role_service.get_role_by_id(request.role_id) is None:
+            raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail="Role not found")
+        chunks = role_service.iter_filtered_pair_chunks(request.role_id, request.user_filter, config.chunk_size,
+                                                        with_role=not assign)
+
+    async def progress():
+        async for report in role_service.bulk_change_roles(chunks, assign):
+            yield json.dumps(report) + '\n'
+
+    return StreamingResponse(progress(), media_type='application/x-ndjson')
+
+
+@router.post("/bulk/assign",
+             status_code=HTTPStatus.OK,
+             summary="Assign roles to many users",
+             description="Assigns roles by a list of (user_id, role_id) pairs, or a role to all users matching "
+                         "`user_filter`. Progress is streamed as JSON lines, one per chunk.",
+             responses=api_examples.bulk_change_roles)
+async def bulk_assign_roles(request: BulkRoleChangeRequest,
+                            access_token: str = Depends(get_token),
+                            role_service: RoleService = Depends(get_role_service),
+                            config: BulkRolesConfig = Depends(get_bulk_roles_config)) -> StreamingResponse:
+    """
+    Assign roles to many users.
+
+    :param request: (user_id, role_id) pairs, or a role UUID with a user filter.
+    :param access_token: JWT access token for authorization.
+    :param role_service: Dependency injection of the RoleService.
+    :param config: Bulk role change configuration settings.
+    :return: A stream of progress reports.
+    """
+    return await bulk_change_roles(request, True, access_token, role_service, config)
+
+
+@router.post("/bulk/detach",
+             status_code=HTTPStatus.OK,
+             summary="Detach roles from many users",
+             description="Detaches roles by a list of (user_id, role_id) pairs, or a role from all users matching "
+                         "`user_filter`. Progress is streamed as JSON lines, one per chunk.",
+             responses=api_examples.bulk_change_roles)
+async def bulk_detach_roles(request: BulkRoleChangeRequest,
+                            access_token: str = Depends(get_token),
+                            role_service: RoleService = Depends(get_role_service),
+                            config: BulkRolesConfig = Depends(get_bulk_roles_config)) -> StreamingResponse:
+    """
+    Detach roles from many users.
+
+    :param request: (user_id, role_id) pairs, or a role UUID with a user filter.
+    :param access_token: JWT access token for authorization.
+    :param role_service: Dependency injection of the RoleService.
+    :param config: Bulk role change configuration settings.
+    :return: A stream of progress reports.
+    """
+    return await bulk_change_roles(request, False, access_token, role_service, config)
@@ -1,22 +1,28 @@
+import time
 from http import HTTPStatus
 
-from fastapi import (APIRouter, Depends, Form, HTTPException, Query, Response,
-                     Security)
+from fastapi import (APIRouter, Depends, Form, Header, HTTPException, Query,
+                     Response, Security)
 from fastapi.responses import JSONResponse, RedirectResponse
 from fastapi.security import (HTTPAuthorizationCredentials, HTTPBearer,
                               OAuth2PasswordRequestForm)
 from starlette.requests import Request
 
 import src.api.v1.api_examples as api_examples
-from src.api.v1.models.entity import (LoginHistoryResponse, LoginResponse,
-                                      RoleNamesResponse, TwoTokens, UserCreate,
-                                      UserInDB, UserUpdateRequest)
+from src.api.v1.models.entity import (IntrospectRequest, IntrospectResponse,
+                                      LoginHistoryPageResponse,
+                                      LoginHistoryResponse, LoginResponse,
+                                      RoleNamesResponse, TokenIntrospection,
+                                      TwoTokens, UserCreate, UserInDB,
+                                      UserUpdateRequest)
+from src.core.config import IntrospectConfig, get_introspect_config
 from src.core.logger import logger
-from src.db.cache import CacheBackend, get_cache
-from src.models.entity import User
+from src.services.denylist import TokenDenylist, get_token_denylist
+from src.services.idempotency import IdempotencyStore, get_idempotency_store
 from src.services.oauth import OAuthService, get_oauth_service
 from src.services.rate_limit import rate_limit_dependency
 from src.services.roles import RoleService, get_role_service
+from src.services.token import TokenService
 from src.services.users import UserService, get_user_service
 
 router = APIRouter()
@@ -24,17 +30,18 @@ security = HTTPBearer()
 
 
 async def get_token(credentials: HTTPAuthorizationCredentials = Security(security),
-                    cache: CacheBackend = Depends(get_cache)):
+                    denylist: TokenDenylist = Depends(get_token_denylist)):
     """
     Validates the access token from the Authorization header.
 
     :param credentials: Bearer token from the HTTP Authorization header.
-    :param cache: CacheBackend instance.
+    :param denylist: Denylist of revoked access tokens.
     :return: Valid access token.
     """
 
     if credentials and hasattr(credentials, 'credentials'):
-        if await cache.get(credentials.credentials):
+        claims = TokenService.get_unverified_claims(credentials.credentials)
+        if await denylist.is_access_token_revoked(claims):
             raise HTTPException(
                 status_code=HTTPStatus.UNAUTHORIZED,
                 headers={"WWW-Authenticate": "Bearer"},
@@ -55,22 +62,26 @@ async def get_token(credentials: HTTPAuthorizationCredentials = Security(securit
              description="Create a new user account.",
              responses=api_examples.user_creation)
 async def create_user(user: UserCreate,
+                      response: Response,
+                      idempotency_key: str | None = Header(default=None, alias='Idempotency-Key'),
                       user_service: UserService = Depends(get_user_service),
+                      idempotency: IdempotencyStore = Depends(get_idempotency_store),
                       rate_limit=Depends(rate_limit_dependency)) -> UserInDB:
     """
     Registers a new user.
 
     :param user: User data for registration.
+    :param response: The response, marked if it's replayed.
+    :param idempotency_key: Optional key, retries with the same key get the response of the first request.
     :param user_service: User service for database operations.
+    :param idempotency: Store of idempotent responses.
     :param rate_limit: A dependency that enforces rate limiting on this endpoint.
     :return: Registered user data.
     """
-    return await user_service.create_user(
-        User(login=user.login,
-             password=user.password,
-             first_name=user.first_name,
-             last_name=user.last_name)
-    )
+    async def execute() -> dict:
+        return UserInDB.model_validate(await user_service.create_user(user)).model_dump(mode='json')
+
+    return await idempotency.run('signup', idempotency_key, user.model_dump(mode='json'), execute, response)
 
 
 @logger.catch
@@ -81,32 +92,43 @@ async def create_user(user: UserCreate,
              description="Authenticate a user and provide access and refresh tokens.",
              responses=api_examples.login)
 async def login(request: Request,
+                response: Response,
                 form_data: OAuth2PasswordRequestForm = Depends(),
+                idempotency_key: str | None = Header(default=None, alias='Idempotency-Key'),
                 user_service: UserService = Depends(get_user_service),
                 role_service: RoleService = Depends(get_role_service),
+                idempotency: IdempotencyStore = Depends(get_idempotency_store),
                 rate_limit=Depends(rate_limit_dependency)
                 ) -> LoginResponse:
     """
     Authenticates user and returns JWT tokens.
 
     :param request: HTTP request.
+    :param response: The response, marked if it's replayed.
     :param form_data: Login credentials.
+    :param idempotency_key: Optional key, retries with the same key get the response of the first request.
     :param user_service: User service.
     :param role_service: Dependency injection of the RoleService.
+    :param idempotency: Store of idempotent responses.
     :param rate_limit: A dependency that enforces rate limiting on this endpoint.
     :return: Access and refresh JWT tokens.
     """
-    access_token, refresh_token, user = await user_service.authenticate(form_data.username, form_data.password, request)
-    user_roles = await role_service.get_roles_by_user_id_query(user.id)
-    user_roles = [role.name for role in user_roles]
-    return LoginResponse(id=user.id,
-                         access_token=access_token,
-                         refresh_token=refresh_token,
-                         login=user.login,
-                         first_name=user.first_name,
-                         last_name=user.last_name,
-                         roles=user_roles
-                         )
+    async def execute() -> dict:
+        access_token, refresh_token, user = await user_service.authenticate(form_data.username, form_data.password,
+                                                                            request)
+        user_roles = await role_service.get_roles_by_user_id_query(user.id)
+        user_roles = [role.name for role in user_roles]
+        return LoginResponse(id=user.id,
+                             access_token=access_token,
+                             refresh_token=refresh_token,
+                             login=user.login,
+                             first_name=user.first_name,
+                             last_name=user.last_name,
+                             roles=user_roles
+                             ).model_dump(mode='json')
+
+    request_data = {'username': form_data.username, 'password': form_data.password}
+    return await idempotency.run('login', idempotency_key, request_data, execute, response)
 
 
 @router.post('/logout',
@@ -155,20 +177,30 @@ async def logout_all(access_token: str = Depends(get_token),
              description="Refreshes the access and refresh tokens for a user.",
              responses=api_examples.refresh)
 async def refresh(request: Request,
+                  response: Response,
                   refresh_token: str = Form(),
+                  idempotency_key: str | None = Header(default=None, alias='Idempotency-Key'),
                   user_service: UserService = Depends(get_user_service),
+                  idempotency: IdempotencyStore = Depends(get_idempotency_store),
                   rate_limit=Depends(rate_limit_dependency)) -> TwoTokens:
     """
     Refreshes user's authentication tokens.
 
     :param request: HTTP request.
+    :param response: The response, marked if it's replayed.
     :param refresh_token: Current refresh token.
+    :param idempotency_key: Optional key, retries with the same key get the response of the first request
+        instead of being treated as a reuse of the rotated refresh token.
     :param user_service: User service.
+    :param idempotency: Store of idempotent responses.
     :param rate_limit: A dependency that enforces rate limiting on this endpoint.
     :return: New access and refresh tokens.
     """
-    access_token, refresh_token = await user_service.refresh(refresh_token, request)
-    return TwoTokens(access_token=access_token, refresh_token=refresh_token)
+    async def execute() -> dict:
+        access_token, new_refresh_token = await user_service.refresh(refresh_token, request)
+        return TwoTokens(access_token=access_token, refresh_token=new_refresh_token).model_dump(mode='json')
+
+    return await idempotency.run('refresh', idempotency_key, {'refresh_token': refresh_token}, execute, response)
 
 
 @router.get("/login-history",
@@ -201,6 +233,36 @@ async def get_login_history(access_token: str = Depends(get_token),
                                  login_date=x.created_at) for x in records]
 
 
+@router.get("/history",
+            response_model=LoginHistoryPageResponse,
+            summary="Get User Login History Page",
+            description="Retrieves a page of the login history for the current user, newest first. "
+                        "Pass `next_cursor` of a page as `cursor` to get the next one.",
+            responses=api_examples.login_history_page)
+async def get_login_history_page(access_token: str = Depends(get_token),
+                                 cursor: str | None = Query(None),
+                                 page_size: int = Query(100, ge=1, le=1000),
+                                 user_service: UserService = Depends(get_user_service),
+                                 rate_limit=Depends(rate_limit_dependency)) -> LoginHistoryPageResponse:
+    """
+    Retrieves a page of the login history for the current user with keyset pagination.
+
+    :param access_token: JWT access token.
+    :param cursor: Cursor of the page, `next_cursor` of the previous page. None for the first page.
+    :param page_size: The number of login history entries per page.
+    :param user_service: Dependency for user-related operations.
+    :param rate_limit: A dependency that enforces rate limiting on this endpoint.
+    :return: Login history entries and the cursor of the next page, null on the last page.
+    """
+    records, next_cursor = await user_service.get_history_page(access_token=access_token,
+                                                               cursor=cursor,
+                                                               page_size=page_size)
+    items = [LoginHistoryResponse(user_agent=x.user_agent,
+                                  ip_address=x.ip_address,
+                                  login_date=x.created_at) for x in records]
+    return LoginHistoryPageResponse(items=items, next_cursor=next_cursor)
+
+
 @router.patch("/update",
               status_code=HTTPStatus.OK,
               summary="Update User Information",
@@ -220,10 +282,7 @@ async def update_user(user_update: UserUpdateRequest,
     :param rate_limit: A dependency that enforces rate limiting on this endpoint to prevent abuse.
     :return: JSON response indicating successful update of user information.
     """
-    await user_service.update_user(access_token, User(login=user_update.login,
-                                                      password=user_update.password,
-                                                      first_name=user_update.first_name,
-                                                      last_name=user_update.last_name))
+    await user_service.update_user(access_token, user_update)
     return JSONResponse(content={"message": "User information successfully updated"}, status_code=HTTPStatus.OK)
 
 
@@ -245,8 +304,48 @@ async def get_access_data(access_token: str = Depends(get_token),
     :param rate_limit: A dependency that enforces rate limiting on this endpoint to prevent abuse.
     :return: A list of role names associated with the current user.
     """
-    user_roles = await role_service.get_roles_by_access_token(access_token)
-    return [RoleNamesResponse(name=role.name) for role in user_roles]
+    role_names = await role_service.get_role_names_by_access_token(access_token)
+    return [RoleNamesResponse(name=name) for name in role_names]
+
+
+@router.post("/introspect",
+             status_code=HTTPStatus.OK,
+             response_model=IntrospectResponse,
+             summary="Introspect Access Tokens",
+             description="Checks a batch of access tokens and returns validity, subject, roles and expiry of each, "
+                         "in the order of the request. The response may be cached for `Cache-Control: max-age` "
+                         "seconds, bounded by the earliest expiry of the active tokens.",
+             responses=api_examples.introspect)
+async def introspect_tokens(body: IntrospectRequest,
+                            response: Response,
+                            user_service: UserService = Depends(get_user_service),
+                            config: IntrospectConfig = Depends(get_introspect_config),
+                            rate_limit=Depends(rate_limit_dependency)) -> IntrospectResponse:
+    """
+    Introspects a batch of access tokens, meant for gateways and services authorizing many requests.
+
+    :param body: Access tokens to check.
+    :param response: The response, gets the Cache-Control header.
+    :param user_service: Dependency for user-related operations.
+    :param config: Introspection configuration settings.
+    :param rate_limit: A dependency that enforces rate limiting on this endpoint.
+    :return: Introspection results, one per token.
+    """
+    if len(body.tokens) > config.max_tokens:
+        raise HTTPException(status_code=HTTPStatus.BAD_REQUEST,
+                            detail=f"Too many tokens, max {config.max_tokens}")
+    results = []
+    max_age = config.max_age
+    for result in await user_service.introspect(body.tokens):
+        if result is None:
+            results.append(TokenIntrospection(active=False))
+            continue
+        claims, role_names = result
+        results.append(TokenIntrospection(active=True, sub=claims['sub'], roles=role_names, exp=claims.get('exp')))
+        if 'exp' in claims:
+            max_age = min(max_age, max(int(claims['exp'] - time.time()), 0))
+    response.headers['Cache-Control'] = f'private, max-age={max_age}'
+    return IntrospectResponse(results=results)
 
 
 @router.get("/login/{provider}",
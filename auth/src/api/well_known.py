@@ -0,0 +1,30 @@
+from http import HTTPStatus
+
+from fastapi import APIRouter, Depends
+from fastapi.responses import ORJSONResponse
+
+from src.core.config import FastApiConf, get_config
+from src.services.keys import get_key_store
+
+router = APIRouter()
+
+
+@router.get('/jwks.json',
+            status_code=HTTPStatus.OK,
+            summary="JSON Web Key Set",
+            description="Public keys to verify access tokens locally. Keys are matched by the `kid` token header.")
+async def get_jwks(config: FastApiConf = Depends(get_config)) -> ORJSONResponse:
+    """
+    Returns public signing keys in JWKS format. The key set is built once per key reload, so the response
+    is cheap, and consumers are allowed to cache it for `jwks_max_age` seconds.
+
+    :param config: Configuration settings for the FastAPI application.
+    :return: JWKS document, with no keys if tokens are signed with the shared HS256 secret.
+    """
+    key_store = get_key_store()
+    if key_store is None:
+        jwks = {'keys': []}
+    else:
+        key_store.reload_if_changed()
+        jwks = key_store.jwks
+    return ORJSONResponse(content=jwks, headers={'Cache-Control': f'public, max-age={config.jwt.jwks_max_age}'})
@@ -96,12 +96,81 @@ class DbConf(BaseSettings):
     :param password: Database password.
     :param host: Database host, default is 'auth_db'.
     :param port: Database port, default is '5432'.
+    :param pool_size: Connections kept open in the pool of each worker.
+    :param max_overflow: Connections opened above `pool_size` under load, closed when returned.
+    :param pool_timeout: Max wait for a pooled connection, in seconds.
+    :param pool_recycle: Max age of a pooled connection, in seconds.
+    :param pool_pre_ping: Check connections before handing them out.
+    :param statement_timeout_ms: Server-side statement timeout in milliseconds, 0 to disable.
+    :param prepared_statement_cache_size: Size of the asyncpg prepared statement cache of a connection.
+    :param echo: Log every SQL statement.
+    :param slow_query_ms: Queries running longer are logged as slow, in milliseconds.
     """
     db: str
     user: str
     password: str
     host: str = 'auth_db'
     port: str = '5432'
+    pool_size: int = 10
+    max_overflow: int = 10
+    pool_timeout: float = 30.0
+    pool_recycle: int = 1800
+    pool_pre_ping: bool = True
+    statement_timeout_ms: int = 30000
+    prepared_statement_cache_size: int = 100
+    echo: bool = False
+    slow_query_ms: int = 500
+
+
+class DbReplicaConf(BaseSettings):
+    """
+    Configuration settings for the read replica. Database name, credentials and pool settings are shared
+    with the primary.
+
+    :param host: Replica host, None to send all queries to the primary.
+    :param port: Replica port.
+    :param max_lag_seconds: Reads go to the primary while the replica lags more.
+    :param lag_check_interval: Interval of checking the replica lag, in seconds.
+    """
+    model_config = SettingsConfigDict(env_file=env_file, env_prefix='POSTGRES_REPLICA_')
+
+    host: str | None = None
+    port: str = '5432'
+    max_lag_seconds: float = 5.0
+    lag_check_interval: float = 2.0
+
+
+@lru_cache()
+def get_db_replica_config() -> DbReplicaConf:
+    return DbReplicaConf()
+
+
+class LoggingConfig(BaseSettings):
+    """
+    Configuration settings for logging.
+
+    :param level: Min level of logged messages.
+    :param serialize: Write records as JSON lines, otherwise as text.
+    :param file: Log file path, empty to log to stderr only.
+    :param max_bytes: Size of the log file that triggers rotation, in bytes.
+    :param backup_count: Amount of rotated log files kept.
+    :param queue_size: Max records waiting for the writer thread, further records are dropped.
+    :param sample_every: Sampled call sites log one of every `sample_every` calls.
+    """
+    model_config = SettingsConfigDict(env_file=env_file, env_prefix='LOG_')
+
+    level: str = 'INFO'
+    serialize: bool = True
+    file: str = 'server.log'
+    max_bytes: int = 10 * 1024 * 1024
+    backup_count: int = 5
+    queue_size: int = 10000
+    sample_every: int = 100
+
+
+@lru_cache()
+def get_logging_config() -> LoggingConfig:
+    return LoggingConfig()
 
 
 class JaegerConf(BaseSettings):
@@ -117,6 +186,67 @@ class JaegerConf(BaseSettings):
     port: int = 6831
 
 
+class TracingConfig(BaseSettings):
+    """
+    Configuration settings for trace sampling and span export.
+
+    :param sampler: Head sampler of new traces: 'always_on', 'always_off', 'ratio' or 'rate_limited'.
+    :param ratio: Share of traces sampled by the 'ratio' sampler.
+    :param rate_limit: Max traces per second sampled by the 'rate_limited' sampler, per worker.
+    :param parent_based: Follow the sampling decision of the caller when a request carries trace context.
+    :param exporters: Comma-separated span exporters: 'jaeger', 'console'. Empty to export nothing.
+    :param max_queue_size: Max spans waiting for export, further spans are dropped.
+    :param max_export_batch_size: Max spans exported at once.
+    :param schedule_delay_millis: Max time between exports, in milliseconds.
+    :param export_timeout_millis: Timeout of an export, in milliseconds.
+    :param tail_sampling: Record traces the head sampler dropped and export the ones that turned out slow or errored.
+    :param tail_latency_ms: Traces whose local root span lasted longer are kept by tail sampling, in milliseconds.
+    :param tail_max_traces: Max unfinished traces buffered by tail sampling, the oldest ones are dropped.
+    """
+    model_config = SettingsConfigDict(env_file=env_file, env_prefix='TRACING_')
+
+    sampler: str = 'ratio'
+    ratio: float = 0.1
+    rate_limit: float = 10.0
+    parent_based: bool = True
+    exporters: str = 'jaeger'
+    max_queue_size: int = 2048
+    max_export_batch_size: int = 512
+    schedule_delay_millis: int = 5000
+    export_timeout_millis: int = 30000
+    tail_sampling: bool = False
+    tail_latency_ms: float = 500.0
+    tail_max_traces: int = 1000
+
+
+@lru_cache()
+def get_tracing_config() -> TracingConfig:
+    return TracingConfig()
+
+
+class JwtConf(BaseSettings):
+    """
+    Configuration settings for JWT signing.
+
+    :param algorithm: Signing algorithm: 'RS256', 'EdDSA' or 'HS256' (shared `secret_key`, no JWKS).
+    :param keys_dir: Directory with `<kid>.pem` private keys. The key with the greatest kid signs new tokens.
+    :param key_size: RSA key size for generated keys, in bits.
+    :param generate_if_missing: Generate a key if the keys directory is empty (always on in dev mode). Only for
+        a keys directory shared by all workers and replicas and kept across restarts, a key generated elsewhere
+        invalidates the tokens it didn't sign.
+    :param reload_seconds: How often the keys directory is checked for rotated keys, in seconds.
+    :param jwks_max_age: `Cache-Control` max-age of the JWKS endpoint, in seconds.
+    """
+    model_config = SettingsConfigDict(env_file=env_file, env_prefix='JWT_')
+
+    algorithm: str = 'RS256'
+    keys_dir: str = 'keys'
+    key_size: int = 2048
+    generate_if_missing: bool = False
+    reload_seconds: int = 30
+    jwks_max_age: int = 300
+
+
 class FastApiConf(BaseSettings):
     """
     Configuration settings for the FastAPI application.
@@ -131,6 +261,7 @@ class FastApiConf(BaseSettings):
     :param refresh_token_ttl: Time-to-live for refresh tokens, in seconds.
     :param clear_expired_token_frequency: Frequency to clear expired tokens, in seconds.
     :param jaeger: Configuration settings for Jaeger tracing integration.
+    :param jwt: Configuration settings for JWT signing.
     """
     model_config = SettingsConfigDict(env_file=env_file, env_prefix='PROJECT_')
 
@@ -141,17 +272,19 @@ class FastApiConf(BaseSettings):
     admin_passwd: str = 'admin'
 
     is_dev_mode: bool = True
-    enable_tracer: bool = True
+    enable_tracer: bool = False
 
     access_token_ttl: int = 60 * 30
     refresh_token_ttl: int = 60 * 60 * 24 * 2
     clear_expired_token_frequency: int = 60 * 60 * 12
 
     jaeger: JaegerConf = JaegerConf()
+    jwt: JwtConf = JwtConf()
 
     def __hash__(self):
         return hash((self.name,
                      self.secret_key,
+                     self.jwt.algorithm,
                      self.access_token_ttl,
                      self.refresh_token_ttl,
                      self.clear_expired_token_frequency))
@@ -212,21 +345,306 @@ def get_config() -> FastApiConf:
 class RateLimitConfig(BaseSettings):
     """
     Configuration settings for the RateLimit service.
+
+    :param is_on: Flag to enable rate limiting.
+    :param algorithm: Rate limiting engine: 'gcra', 'token_bucket', 'sliding_window' or 'hybrid'.
+    :param times: Allowed requests per period for authenticated users.
+    :param times_anonymous: Allowed requests per period for anonymous users.
+    :param seconds: Rate limiting period, in seconds.
+    :param hybrid_error_bound: Share of the limit reserved for strict Redis checks in the hybrid mode,
+        requests are admitted locally while the estimate stays below `limit * (1 - hybrid_error_bound)`.
+    :param hybrid_sync_interval_ms: Max time between syncs of locally admitted requests to Redis, in milliseconds.
+    :param hybrid_sync_requests: Max amount of locally admitted requests of a key between syncs to Redis, per worker.
+        Capped at `limit * hybrid_error_bound / hybrid_workers`, so the limit isn't overshot.
+    :param hybrid_workers: Amount of workers sharing the limits, e.g. `gunicorn -w`.
+    :param hybrid_buckets: Amount of sub-windows the hybrid sliding window is split into.
+    :param hybrid_max_keys: Max amount of keys kept in the local window cache of a worker.
     """
     model_config = SettingsConfigDict(env_file=env_file, env_prefix='RATE_LIMIT_')
 
     is_on: bool = True
+    algorithm: str = 'gcra'
     times: int = 40
     times_anonymous: int = 10
     seconds: int = 60
 
+    hybrid_error_bound: float = 0.2
+    hybrid_sync_interval_ms: int = 250
+    hybrid_sync_requests: int = 20
+    hybrid_workers: int = 4
+    hybrid_buckets: int = 12
+    hybrid_max_keys: int = 10000
+
     def __hash__(self):
         return hash((self.is_on,
+                     self.algorithm,
                      self.times,
                      self.times_anonymous,
-                     self.seconds))
+                     self.seconds,
+                     self.hybrid_error_bound,
+                     self.hybrid_sync_interval_ms,
+                     self.hybrid_sync_requests,
+                     self.hybrid_workers,
+                     self.hybrid_buckets,
+                     self.hybrid_max_keys))
 
 
 @lru_cache()
 def get_rate_limit_config() -> RateLimitConfig:
     return RateLimitConfig()
+
+
+class RoleCacheConfig(BaseSettings):
+    """
+    Configuration settings for the per-worker roles cache.
+
+    :param is_on: Flag to enable the cache.
+    :param catalog_ttl: Max age of the role catalog, in seconds. A safety net, changes are published immediately.
+    :param user_roles_ttl: Max age of a cached user role set, in seconds.
+    :param user_roles_max_size: Max amount of users in the user role sets cache.
+    :param channel: Redis pub/sub channel used for invalidations.
+    """
+    model_config = SettingsConfigDict(env_file=env_file, env_prefix='ROLE_CACHE_')
+
+    is_on: bool = True
+    catalog_ttl: int = 300
+    user_roles_ttl: int = 60
+    user_roles_max_size: int = 10000
+    channel: str = 'auth:roles:invalidate'
+
+
+@lru_cache()
+def get_role_cache_config() -> RoleCacheConfig:
+    return RoleCacheConfig()
+
+
+class BulkRolesConfig(BaseSettings):
+    """
+    Configuration settings for bulk role assignment and detachment.
+
+    :param chunk_size: Amount of (user, role) pairs changed by one statement and committed together.
+    :param max_pairs: Max amount of explicit pairs in a request. Role with a user filter isn't limited.
+    """
+    model_config = SettingsConfigDict(env_file=env_file, env_prefix='BULK_ROLES_')
+
+    chunk_size: int = 5000
+    max_pairs: int = 100000
+
+
+@lru_cache()
+def get_bulk_roles_config() -> BulkRolesConfig:
+    return BulkRolesConfig()
+
+
+class IntrospectConfig(BaseSettings):
+    """
+    Configuration settings for the batch token introspection endpoint.
+
+    :param max_tokens: Max amount of tokens in a request.
+    :param max_age: Upper bound of `Cache-Control: max-age` of responses, in seconds. Revocations reach
+        callers caching the responses within this time.
+    """
+    model_config = SettingsConfigDict(env_file=env_file, env_prefix='INTROSPECT_')
+
+    max_tokens: int = 100
+    max_age: int = 30
+
+
+@lru_cache()
+def get_introspect_config() -> IntrospectConfig:
+    return IntrospectConfig()
+
+
+class PasswordHashConfig(BaseSettings):
+    """
+    Configuration settings for the password hashing service.
+
+    :param executor: Executor used for hashing, 'process' or 'thread'.
+    :param max_workers: Number of executor workers, None means the number of CPUs.
+    :param max_concurrency: Maximum number of hashing jobs handed to the executor at once.
+    :param method: Werkzeug hashing method used for new password hashes.
+    :param salt_length: Salt length used for new password hashes.
+    """
+    model_config = SettingsConfigDict(env_file=env_file, env_prefix='PASSWORD_HASH_')
+
+    executor: str = 'process'
+    max_workers: int | None = None
+    max_concurrency: int = 8
+    method: str = 'pbkdf2'
+    salt_length: int = 16
+
+
+@lru_cache()
+def get_password_hash_config() -> PasswordHashConfig:
+    return PasswordHashConfig()
+
+
+class UserImportConfig(BaseSettings):
+    """
+    Configuration settings for the bulk user import.
+
+    :param batch_size: Amount of rows copied and merged in one transaction.
+    :param hash_chunk_size: Amount of passwords hashed by one executor job.
+    """
+    model_config = SettingsConfigDict(env_file=env_file, env_prefix='USER_IMPORT_')
+
+    batch_size: int = 5000
+    hash_chunk_size: int = 200
+
+
+@lru_cache()
+def get_user_import_config() -> UserImportConfig:
+    return UserImportConfig()
+
+
+class DenylistConfig(BaseSettings):
+    """
+    Configuration settings for the revoked access tokens denylist.
+
+    :param capacity: Expected amount of revoked, not yet expired tokens. The local filter grows past it on rebuild.
+    :param error_rate: Target false positive rate of the local filter.
+    :param sync_interval: Interval of rebuilding the local filter from Redis, in seconds.
+    :param key: Redis sorted set of revoked jtis, scored by token expiry.
+    :param channel: Redis pub/sub channel announcing revocations.
+    :param generation_key: Redis key of a user token generation, replaced to revoke all tokens of the user.
+    :param generation_cache_ttl: Max age of a locally cached token generation, in seconds.
+    :param generation_cache_size: Max amount of locally cached token generations.
+    """
+    model_config = SettingsConfigDict(env_file=env_file, env_prefix='DENYLIST_')
+
+    capacity: int = 100000
+    error_rate: float = 0.001
+    sync_interval: int = 30
+    key: str = 'denylist:access_tokens'
+    channel: str = 'auth:denylist'
+    generation_key: str = 'token_generation:user:{user_id}'
+    generation_cache_ttl: float = 5.0
+    generation_cache_size: int = 10000
+
+
+@lru_cache()
+def get_denylist_config() -> DenylistConfig:
+    return DenylistConfig()
+
+
+class SessionStoreConfig(BaseSettings):
+    """
+    Configuration settings for the refresh sessions store.
+
+    :param backend: Store of refresh sessions, 'postgres' or 'redis'.
+    :param key_prefix: Prefix of Redis keys of the 'redis' store.
+    """
+    model_config = SettingsConfigDict(env_file=env_file, env_prefix='SESSION_STORE_')
+
+    backend: str = 'postgres'
+    key_prefix: str = 'session'
+
+
+@lru_cache()
+def get_session_store_config() -> SessionStoreConfig:
+    return SessionStoreConfig()
+
+
+class TokenCleanerConfig(BaseSettings):
+    """
+    Configuration settings for the expired refresh tokens cleaner.
+
+    :param batch_size: Max amount of rows deleted by one transaction.
+    :param batch_pause: Pause between batches, in seconds. Limits the load on the database.
+    :param max_run_seconds: Max duration of a run.
+    :param lock_key: Redis key of the leader lock, only one worker cleans per scheduled interval.
+    """
+    model_config = SettingsConfigDict(env_file=env_file, env_prefix='TOKEN_CLEANER_')
+
+    batch_size: int = 1000
+    batch_pause: float = 0.1
+    max_run_seconds: int = 300
+    lock_key: str = 'token_cleaner:lock'
+
+
+@lru_cache()
+def get_token_cleaner_config() -> TokenCleanerConfig:
+    return TokenCleanerConfig()
+
+
+class LoginHistoryConfig(BaseSettings):
+    """
+    Configuration settings for the login history writer.
+
+    :param is_on: Write login history in background batches. Otherwise it's written by the login transaction.
+    :param queue_size: Max amount of login events waiting in a worker. Further events go to the overflow stream.
+    :param batch_size: Max amount of rows inserted at once.
+    :param flush_interval: Max time an event waits for a batch, in seconds.
+    :param stream: Redis stream keeping events that couldn't be queued or written.
+    :param stream_max_len: Approximate max length of the overflow stream.
+    :param drain_interval: Interval of moving events from the overflow stream to the database, in seconds.
+    :param retention_months: Months of login history kept, older monthly partitions are dropped.
+    :param partitions_ahead: Amount of monthly partitions created ahead of the current month.
+    :param retention_frequency: Frequency of the partition maintenance job, in seconds.
+    :param retention_lock_key: Redis key of the partition maintenance leader lock.
+    """
+    model_config = SettingsConfigDict(env_file=env_file, env_prefix='LOGIN_HISTORY_')
+
+    is_on: bool = True
+    queue_size: int = 10000
+    batch_size: int = 500
+    flush_interval: float = 1.0
+    stream: str = 'login_history:overflow'
+    stream_max_len: int = 1000000
+    drain_interval: float = 5.0
+    retention_months: int = 12
+    partitions_ahead: int = 2
+    retention_frequency: int = 60 * 60 * 24
+    retention_lock_key: str = 'login_history:retention:lock'
+
+
+@lru_cache()
+def get_login_history_config() -> LoginHistoryConfig:
+    return LoginHistoryConfig()
+
+
+class MetricsConfig(BaseSettings):
+    """
+    Configuration settings for Prometheus metrics.
+
+    :param is_on: Expose `/metrics` and publish snapshots of the worker.
+    :param publish_interval: Interval of publishing the snapshot of a worker to Redis, in seconds.
+    :param key: Redis hash keeping worker snapshots by worker id.
+    """
+    model_config = SettingsConfigDict(env_file=env_file, env_prefix='METRICS_')
+
+    is_on: bool = True
+    publish_interval: float = 5.0
+    key: str = 'metrics:workers'
+
+
+@lru_cache()
+def get_metrics_config() -> MetricsConfig:
+    return MetricsConfig()
+
+
+class IdempotencyConfig(BaseSettings):
+    """
+    Configuration settings for `Idempotency-Key` handling of signup, login and refresh.
+
+    :param is_on: Honor `Idempotency-Key` headers. Otherwise they're ignored. Off by default: stored login
+        and refresh outcomes hold tokens, encrypted with a key derived from the server secret.
+    :param ttl: How long a response is replayed for its key, in seconds.
+    :param lock_ttl: Max time a request holds its key, concurrent duplicates wait for it, in seconds.
+    :param poll_interval: Interval of checking for the response of a concurrent duplicate, in seconds.
+    :param max_key_length: Max length of a key.
+    :param key_prefix: Prefix of Redis keys.
+    """
+    model_config = SettingsConfigDict(env_file=env_file, env_prefix='IDEMPOTENCY_')
+
+    is_on: bool = False
+    ttl: int = 300
+    lock_ttl: float = 10.0
+    poll_interval: float = 0.05
+    max_key_length: int = 255
+    key_prefix: str = 'idempotency'
+
+
+@lru_cache()
+def get_idempotency_config() -> IdempotencyConfig:
+    return IdempotencyConfig()
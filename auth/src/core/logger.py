@@ -1,11 +1,160 @@
+"""
+Structured logging.
+
+Records are handed to a writer thread without blocking: the thread serializes them as JSON lines (or text)
+and writes them to stderr and to a rotating file. Pass values as arguments, `logger.debug("Refreshed {}", user_id)`,
+so the message is only formatted if the level is enabled, and `logger.opt(lazy=True)` for expensive values.
+Call sites logging on every request use `sampled_logger`. Every record carries the request id.
+"""
+import atexit
 import logging
+import queue
+import sys
+import threading
+import traceback
+from logging.handlers import RotatingFileHandler
 
+import orjson
 from loguru import logger
 
-fmt = "{process.id} - {thread.id} - {time} - {name} - {level} - {message}"
-logger.add('server.log', format=fmt,
-           rotation='10MB', compression='zip',
-           enqueue=True)
+from src.core.config import LoggingConfig, get_logging_config
+from src.core.middleware import request_id_var
+
+fmt = "{process.id} - {thread.id} - {time} - {extra[request_id]} - {name} - {level} - {message}"
+
+
+def format_json(record: dict) -> str:
+    """
+    Serializes a loguru record as a JSON line.
+
+    :param record: The record.
+    :return: The JSON document.
+    """
+    data = {
+        'time': record['time'].isoformat(),
+        'level': record['level'].name,
+        'message': record['message'],
+        'logger': record['name'],
+        'function': record['function'],
+        'line': record['line'],
+        'process': record['process'].id,
+        **record['extra'],
+    }
+    if record['exception'] is not None:
+        data['exception'] = ''.join(traceback.format_exception(*record['exception']))
+    return orjson.dumps(data, default=str).decode()
+
+
+class BackgroundSink:
+    """
+    Loguru sink handing records to a writer thread. A call only puts the record into a queue, so logging
+    never waits for I/O; when `queue_size` records are waiting, further records are dropped and counted.
+
+    :param handlers: Handlers writing the lines.
+    :param serialize: Write records as JSON, otherwise as formatted by loguru.
+    :param queue_size: Max records waiting for the writer.
+    """
+    def __init__(self, handlers: list[logging.Handler], serialize: bool, queue_size: int):
+        self.handlers = handlers
+        self.serialize = serialize
+        self.queue_size = queue_size
+        self.queue: queue.SimpleQueue = queue.SimpleQueue()
+        self.dropped = 0
+        self._thread = threading.Thread(target=self._write, name='log-writer', daemon=True)
+
+    def __call__(self, message):
+        if self.queue.qsize() >= self.queue_size:
+            self.dropped += 1
+            return
+        self.queue.put(message.record if self.serialize else str(message))
+
+    def _write(self):
+        while (item := self.queue.get()) is not None:
+            line = format_json(item) if self.serialize else item.rstrip('\n')
+            log_record = logging.makeLogRecord({'msg': line})
+            for handler in self.handlers:
+                try:
+                    handler.emit(log_record)
+                except Exception:
+                    handler.handleError(log_record)
+
+    def start(self):
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """
+        Writes the queued records and stops the writer.
+        """
+        self.queue.put(None)
+        self._thread.join(timeout=5)
+        for handler in self.handlers:
+            handler.close()
+
+
+class SampledLogger:
+    """
+    Logs one of every `every` calls of each call site, for events too frequent to log every time.
+    A skipped call costs a counter increment, logged records carry the rate in `extra[sampled]`.
+
+    :param logger: The logger.
+    :param every: Sampling rate.
+    """
+    def __init__(self, logger: 'logger', every: int):
+        self.logger = logger.bind(sampled=every)
+        self.every = every
+        self.counters: dict[tuple, int] = {}
+
+    def _is_sampled(self) -> bool:
+        frame = sys._getframe(2)
+        key = (frame.f_code, frame.f_lineno)
+        count = self.counters.get(key, 0)
+        self.counters[key] = count + 1
+        return count % self.every == 0
+
+    def debug(self, message: str, *args, **kwargs):
+        if self._is_sampled():
+            self.logger.opt(depth=1).debug(message, *args, **kwargs)
+
+    def info(self, message: str, *args, **kwargs):
+        if self._is_sampled():
+            self.logger.opt(depth=1).info(message, *args, **kwargs)
+
+    def warning(self, message: str, *args, **kwargs):
+        if self._is_sampled():
+            self.logger.opt(depth=1).warning(message, *args, **kwargs)
+
+    def error(self, message: str, *args, **kwargs):
+        if self._is_sampled():
+            self.logger.opt(depth=1).error(message, *args, **kwargs)
+
+
+def configure_logging(config: LoggingConfig) -> BackgroundSink:
+    """
+    Replaces the default loguru handler with the background sink.
+
+    :param config: Logging configuration settings.
+    :return: The sink.
+    """
+    formatter = logging.Formatter('%(message)s')
+    handlers = [logging.StreamHandler(sys.stderr)]
+    if config.file:
+        handlers.append(RotatingFileHandler(config.file, maxBytes=config.max_bytes,
+                                            backupCount=config.backup_count, delay=True))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    sink = BackgroundSink(handlers, config.serialize, config.queue_size)
+    logger.remove()
+    logger.configure(patcher=lambda record: record['extra'].update(request_id=request_id_var.get()))
+    # JSON lines are built by the writer, loguru only formats the message.
+    logger.add(sink, level=config.level, format='{message}' if config.serialize else fmt)
+    sink.start()
+    return sink
+
+
+logging_config = get_logging_config()
+log_sink = configure_logging(logging_config)
+sampled_logger = SampledLogger(logger, logging_config.sample_every)
 
 LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 LOG_DEFAULT_HANDLERS = ['console', ]
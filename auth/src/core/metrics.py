@@ -0,0 +1,377 @@
+"""
+Prometheus-style metrics of a worker.
+
+Metric updates are plain in-memory additions: the worker runs a single event loop thread, so no locks are taken
+on hot paths. Every worker publishes a snapshot to Redis, `/metrics` merges the snapshots of all live workers
+with a `worker` label, so a scrape through any worker sees the whole service.
+"""
+import asyncio
+import json
+import os
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from contextvars import ContextVar
+from dataclasses import dataclass
+from functools import wraps
+from typing import Callable, Iterable
+
+from redis.asyncio import Redis, RedisError
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from src.core.config import MetricsConfig, get_metrics_config
+from src.core.logger import logger
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CALLS_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+
+
+@dataclass
+class RequestStats:
+    """
+    Redis and database calls made while serving a request.
+    """
+    redis_calls: int = 0
+    redis_seconds: float = 0.0
+    db_queries: int = 0
+    db_seconds: float = 0.0
+
+
+request_stats_var: ContextVar[RequestStats | None] = ContextVar('request_stats', default=None)
+
+
+class Metric(ABC):
+    """
+    Base class of metric families.
+
+    :param name: Metric name.
+    :param documentation: Help text.
+    :param labelnames: Names of the labels.
+    """
+    type = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+
+    @abstractmethod
+    def samples(self) -> Iterable[tuple[str, dict, float]]:
+        """
+        Returns the current samples: name suffix, labels and value.
+        """
+        pass
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, *labelvalues: str, amount: float = 1.0):
+        self.values[labelvalues] = self.values.get(labelvalues, 0.0) + amount
+
+    def samples(self) -> Iterable[tuple[str, dict, float]]:
+        for labelvalues, value in self.values.items():
+            yield '', dict(zip(self.labelnames, labelvalues)), value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = buckets
+        # Per label values: counts of each bucket (not cumulative) and of +Inf, sum.
+        self.values: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, *labelvalues: str):
+        entry = self.values.get(labelvalues)
+        if entry is None:
+            entry = self.values[labelvalues] = ([0] * (len(self.buckets) + 1), [0.0])
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1][0] += value
+
+    def samples(self) -> Iterable[tuple[str, dict, float]]:
+        for labelvalues, (counts, total) in self.values.items():
+            labels = dict(zip(self.labelnames, labelvalues))
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += count
+                yield '_bucket', {**labels, 'le': str(bound)}, cumulative
+            yield '_sum', labels, total[0]
+            yield '_count', labels, cumulative
+
+
+class CallbackMetric(Metric):
+    """
+    A metric read from a callback at collection time, e.g. counters kept by a component.
+
+    :param callback: Returns label values and values of the samples.
+    """
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...],
+                 callback: Callable[[], Iterable[tuple[tuple[str, ...], float]]], metric_type: str = 'gauge'):
+        super().__init__(name, documentation, labelnames)
+        self.type = metric_type
+        self.callback = callback
+
+    def samples(self) -> Iterable[tuple[str, dict, float]]:
+        try:
+            values = list(self.callback())
+        except Exception as e:
+            logger.warning(f"Can't collect metric {self.name}: {e}")
+            return
+        for labelvalues, value in values:
+            if value is not None:
+                yield '', dict(zip(self.labelnames, labelvalues)), value
+
+
+class MetricsRegistry:
+    """
+    Metric families of a worker.
+    """
+    def __init__(self):
+        self.metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+                  buckets: tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def callback(self, name: str, documentation: str, labelnames: tuple[str, ...],
+                 callback: Callable[[], Iterable[tuple[tuple[str, ...], float]]],
+                 metric_type: str = 'gauge') -> CallbackMetric:
+        return self.register(CallbackMetric(name, documentation, labelnames, callback, metric_type))
+
+    def snapshot(self) -> dict:
+        """
+        Returns the current values of all metrics in a JSON-serializable form.
+        """
+        return {
+            metric.name: {
+                'type': metric.type,
+                'help': metric.documentation,
+                'samples': [[suffix, labels, value] for suffix, labels, value in metric.samples()],
+            }
+            for metric in self.metrics.values()
+        }
+
+
+def format_labels(labels: dict) -> str:
+    escaped = (f'{name}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+               for name, value in labels.items())
+    return '{' + ','.join(escaped) + '}'
+
+
+def render(snapshots: dict[str, dict]) -> str:
+    """
+    Renders snapshots of workers in the Prometheus text format, samples get the `worker` label.
+
+    :param snapshots: Snapshots by worker id.
+    :return: The exposition text.
+    """
+    families: dict[str, dict] = {}
+    for worker, snapshot in snapshots.items():
+        for name, family in snapshot.items():
+            merged = families.setdefault(name, {'type': family['type'], 'help': family['help'], 'samples': []})
+            merged['samples'].extend((suffix, {'worker': worker, **labels}, value)
+                                     for suffix, labels, value in family['samples'])
+    lines = []
+    for name, family in families.items():
+        lines.append(f'# HELP {name} {family["help"]}')
+        lines.append(f'# TYPE {name} {family["type"]}')
+        lines.extend(f'{name}{suffix}{format_labels(labels)} {value}' for suffix, labels, value in family['samples'])
+    return '\n'.join(lines) + '\n'
+
+
+def timed(histogram: Histogram, *labelvalues: str):
+    """
+    Decorator observing the duration of a coroutine function in a histogram.
+
+    :param histogram: The histogram.
+    :param labelvalues: Label values of the observations.
+    """
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            started_at = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started_at, *labelvalues)
+        return wrapper
+    return decorator
+
+
+class MetricsExporter:
+    """
+    Publishes snapshots of this worker to Redis and collects snapshots of all workers.
+
+    Snapshots are fields of a single Redis hash keyed by worker id, read with one HGETALL. Hash fields
+    don't expire, so snapshots carry their publish time: ones not refreshed for `3 * publish_interval`,
+    e.g. of killed workers, are skipped and removed by the collecting worker.
+
+    :param config: Metrics configuration settings.
+    :param registry: Metrics of this worker.
+    """
+    def __init__(self, config: MetricsConfig, registry: MetricsRegistry):
+        self.config = config
+        self.registry = registry
+        self.worker = f'{os.uname().nodename}:{os.getpid()}'
+        self.redis: Redis | None = None
+        self._task: asyncio.Task | None = None
+
+    async def publish(self):
+        snapshot = {'published_at': time.time(), 'metrics': self.registry.snapshot()}
+        await self.redis.hset(self.config.key, self.worker, json.dumps(snapshot))
+
+    async def _publish_loop(self):
+        while True:
+            try:
+                await self.publish()
+            except RedisError as e:
+                logger.warning(f"Can't publish metrics: {e}")
+            await asyncio.sleep(self.config.publish_interval)
+
+    async def collect(self) -> str:
+        """
+        Renders metrics of all workers. Snapshots of other workers are at most `publish_interval` seconds old,
+        metrics of this worker are current. Without Redis only this worker is rendered.
+
+        :return: The exposition text.
+        """
+        snapshots = {}
+        if self.redis is not None:
+            try:
+                stale = []
+                expired_at = time.time() - self.config.publish_interval * 3
+                for worker, value in (await self.redis.hgetall(self.config.key)).items():
+                    snapshot = json.loads(value)
+                    if snapshot['published_at'] < expired_at:
+                        stale.append(worker)
+                    else:
+                        snapshots[worker.decode()] = snapshot['metrics']
+                if stale:
+                    await self.redis.hdel(self.config.key, *stale)
+            except RedisError as e:
+                logger.warning(f"Can't collect metrics of other workers: {e}")
+        snapshots[self.worker] = self.registry.snapshot()
+        return render(snapshots)
+
+    def start(self, redis: Redis):
+        """
+        Starts publishing snapshots.
+
+        :param redis: Redis client.
+        """
+        self.redis = redis
+        if self._task is None:
+            self._task = asyncio.create_task(self._publish_loop())
+
+    async def close(self):
+        """
+        Stops publishing and removes the snapshot of this worker.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self.redis is not None:
+            try:
+                await self.redis.hdel(self.config.key, self.worker)
+            except RedisError as e:
+                logger.warning(f"Can't remove metrics snapshot: {e}")
+            self.redis = None
+
+
+registry = MetricsRegistry()
+exporter = MetricsExporter(get_metrics_config(), registry)
+
+auth_operation_seconds = registry.histogram(
+    'auth_operation_duration_seconds', 'Duration of auth operations.', ('operation',))
+rate_limit_check_seconds = registry.histogram(
+    'rate_limit_check_duration_seconds', 'Duration of rate limit checks.')
+rate_limit_decisions = registry.counter(
+    'rate_limit_decisions_total', 'Rate limit decisions: allowed, limited or error.', ('result',))
+redis_command_seconds = registry.histogram(
+    'redis_command_duration_seconds', 'Duration of Redis commands and pipelines.', ('command',))
+db_query_seconds = registry.histogram(
+    'db_query_duration_seconds', 'Duration of database queries.', ('pool',))
+db_checkout_wait_seconds = registry.histogram(
+    'db_pool_checkout_wait_seconds', 'Time waited for a database connection.', ('pool',))
+password_hash_queue_seconds = registry.histogram(
+    'password_hash_queue_seconds', 'Time password hashing jobs wait for the executor.')
+password_hash_run_seconds = registry.histogram(
+    'password_hash_run_seconds', 'Duration of password hashing jobs in the executor.')
+http_request_seconds = registry.histogram(
+    'http_request_duration_seconds', 'Duration of HTTP requests.', ('endpoint', 'method', 'status'))
+http_request_redis_calls = registry.histogram(
+    'http_request_redis_calls', 'Redis commands and pipelines per HTTP request.', ('endpoint',), CALLS_BUCKETS)
+http_request_redis_seconds = registry.histogram(
+    'http_request_redis_seconds', 'Time spent in Redis per HTTP request.', ('endpoint',))
+http_request_db_queries = registry.histogram(
+    'http_request_db_queries', 'Database queries per HTTP request.', ('endpoint',), CALLS_BUCKETS)
+http_request_db_seconds = registry.histogram(
+    'http_request_db_seconds', 'Time spent in database queries per HTTP request.', ('endpoint',))
+
+
+def observe_redis_call(command: str, seconds: float):
+    redis_command_seconds.observe(seconds, command)
+    stats = request_stats_var.get()
+    if stats is not None:
+        stats.redis_calls += 1
+        stats.redis_seconds += seconds
+
+
+def observe_db_query(pool: str, seconds: float):
+    db_query_seconds.observe(seconds, pool)
+    stats = request_stats_var.get()
+    if stats is not None:
+        stats.db_queries += 1
+        stats.db_seconds += seconds
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware observing duration of HTTP requests, and Redis and database calls made while serving them.
+    Requests are labelled by the name of the endpoint function, so path parameters don't multiply series.
+
+    :param app: The wrapped ASGI app.
+    """
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        status = 500
+
+        async def send_with_status(message: Message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        stats = RequestStats()
+        token = request_stats_var.set(stats)
+        started_at = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            request_stats_var.reset(token)
+            endpoint = scope.get('endpoint')
+            endpoint_name = endpoint.__name__ if endpoint is not None else 'unmatched'
+            http_request_seconds.observe(time.perf_counter() - started_at, endpoint_name, scope['method'], str(status))
+            http_request_redis_calls.observe(stats.redis_calls, endpoint_name)
+            http_request_redis_seconds.observe(stats.redis_seconds, endpoint_name)
+            http_request_db_queries.observe(stats.db_queries, endpoint_name)
+            http_request_db_seconds.observe(stats.db_seconds, endpoint_name)
@@ -0,0 +1,87 @@
+"""
+Pure ASGI middlewares. Unlike `@app.middleware('http')`, they don't run the rest of the stack in a separate task
+and don't wrap response bodies into a memory stream, so streaming responses pass through untouched.
+"""
+from contextvars import ContextVar
+from http import HTTPStatus
+from typing import Sequence
+
+import orjson
+from opentelemetry import trace
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+REQUEST_ID_HEADER = b'x-request-id'
+
+request_id_var: ContextVar[str | None] = ContextVar('request_id', default=None)
+
+
+class RequestIdMiddleware:
+    """
+    Rejects HTTP requests without the `X-Request-Id` header. The request id is kept in `request_id_var`
+    for logs, set as the `http.request_id` attribute of the current span and echoed in the response.
+
+    :param app: The wrapped ASGI app.
+    :param exempt_paths: Paths served without the header, e.g. for scrapers that can't send it.
+    """
+    def __init__(self, app: ASGIApp, exempt_paths: Sequence[str] = ()):
+        self.app = app
+        self.exempt_paths = frozenset(exempt_paths)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http' or scope['path'] in self.exempt_paths:
+            await self.app(scope, receive, send)
+            return
+        request_id = None
+        for name, value in scope['headers']:
+            if name == REQUEST_ID_HEADER:
+                request_id = value
+                break
+        if not request_id:
+            await self._reject(send)
+            return
+
+        async def send_with_request_id(message: Message):
+            if message['type'] == 'http.response.start':
+                message['headers'] = [*message.get('headers', ()), (REQUEST_ID_HEADER, request_id)]
+            await send(message)
+
+        token = request_id_var.set(request_id.decode('latin-1'))
+        span = trace.get_current_span()
+        if span.is_recording():
+            span.set_attribute('http.request_id', request_id_var.get())
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            request_id_var.reset(token)
+
+    @staticmethod
+    async def _reject(send: Send):
+        body = orjson.dumps({'detail': 'X-Request-Id is required'})
+        await send({
+            'type': 'http.response.start',
+            'status': HTTPStatus.BAD_REQUEST,
+            'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+
+class PathPrefixMiddleware:
+    """
+    Applies a middleware only to HTTP requests whose path starts with one of the prefixes,
+    other requests skip it.
+
+    :param app: The wrapped ASGI app.
+    :param middleware_class: The middleware to apply.
+    :param prefixes: Path prefixes.
+    :param options: Arguments of the middleware.
+    """
+    def __init__(self, app: ASGIApp, middleware_class: type, prefixes: Sequence[str], **options):
+        self.app = app
+        self.middleware = middleware_class(app, **options)
+        self.prefixes = tuple(prefixes)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] == 'http' and scope['path'].startswith(self.prefixes):
+            await self.middleware(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
@@ -1,10 +1,41 @@
+import time
 from abc import ABC, abstractmethod
 from typing import Any
 
 import backoff
 from redis.asyncio import ConnectionError, Redis
+from redis.asyncio.client import Pipeline
 
 from src.core.logger import LoggerAdapter, logger
+from src.core.metrics import observe_redis_call
+
+
+class InstrumentedPipeline(Pipeline):
+    """
+    Pipeline observing each execution as one Redis call.
+    """
+    async def execute(self, raise_on_error: bool = True):
+        started_at = time.perf_counter()
+        try:
+            return await super().execute(raise_on_error)
+        finally:
+            observe_redis_call('PIPELINE', time.perf_counter() - started_at)
+
+
+class InstrumentedRedis(Redis):
+    """
+    Redis client observing the count and duration of commands, in total and per request.
+    Every user of the shared client is covered: the cache, the denylist, the rate limiter and the session store.
+    """
+    async def execute_command(self, *args, **options):
+        started_at = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        finally:
+            observe_redis_call(str(args[0]), time.perf_counter() - started_at)
+
+    def pipeline(self, transaction: bool = True, shard_hint: str | None = None) -> Pipeline:
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
 
 
 class CacheClientInitializer:
@@ -25,7 +56,7 @@ class CacheClientInitializer:
         if backend_type == 'redis':
             host = kwargs.get('host')
             port = kwargs.get('port')
-            return Redis.from_url(f"redis://{host}:{port}")
+            return InstrumentedRedis.from_url(f"redis://{host}:{port}")
         else:
             raise ValueError(f"Unknown cache backend type: {backend_type}")
 
@@ -64,13 +95,34 @@ class CacheBackend(ABC):
         pass
 
     @abstractmethod
-    async def set(self, key: str, value, expire: int):
+    async def set(self, key: str, value, expire: int | None):
         """
         Asynchronously sets the value for the given key in the cache with an expiration time.
 
         :param key: The key for which to set the value.
         :param value: The value to set.
-        :param expire: The expiration time in seconds.
+        :param expire: The expiration time in seconds, None to keep the key without expiration.
+        """
+        pass
+
+    @abstractmethod
+    async def mget(self, keys: list[str]) -> list[str | None]:
+        """
+        Asynchronously retrieves values for several keys in one call.
+
+        :param keys: The keys for which to retrieve values.
+        :return: Values in the order of the keys, None for missing keys.
+        """
+        pass
+
+    @abstractmethod
+    async def set_if_missing(self, key: str, value: str) -> str:
+        """
+        Asynchronously sets the value for the given key without expiration, unless the key already exists.
+
+        :param key: The key for which to set the value.
+        :param value: The value to set.
+        :return: The value the key holds after the call.
         """
         pass
 
@@ -99,16 +151,40 @@ class RedisCache(CacheBackend):
 
     @backoff.on_exception(backoff.expo, ConnectionError, factor=0.5, max_value=5.0,
                           max_tries=3, logger=LoggerAdapter(logger))
-    async def set(self, key: str, value: str, expire: int) -> None:
+    async def set(self, key: str, value: str, expire: int | None) -> None:
         """
         Asynchronously sets the value for the given key in the Redis cache with an expiration time.
 
         :param key: The key for which to set the value.
         :param value: The value to set.
-        :param expire: The expiration time in seconds.
+        :param expire: The expiration time in seconds, None to keep the key without expiration.
         """
         await self.client.set(name=key, value=value, ex=expire)
 
+    @backoff.on_exception(backoff.expo, ConnectionError, factor=0.5, max_value=5.0,
+                          max_tries=3, logger=LoggerAdapter(logger))
+    async def mget(self, keys: list[str]) -> list[str | None]:
+        """
+        Asynchronously retrieves values for several keys from the Redis cache in one round trip.
+
+        :param keys: The keys for which to retrieve values.
+        :return: Values in the order of the keys, None for missing keys.
+        """
+        return await self.client.mget(keys)
+
+    @backoff.on_exception(backoff.expo, ConnectionError, factor=0.5, max_value=5.0,
+                          max_tries=3, logger=LoggerAdapter(logger))
+    async def set_if_missing(self, key: str, value: str) -> str:
+        """
+        Asynchronously sets the value for the given key in the Redis cache, unless the key already exists.
+
+        :param key: The key for which to set the value.
+        :param value: The value to set.
+        :return: The value the key holds after the call.
+        """
+        current = await self.client.set(name=key, value=value, nx=True, get=True)
+        return value if current is None else current
+
 
 class CacheBackendFactory:
     """
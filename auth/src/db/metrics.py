@@ -0,0 +1,108 @@
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from src.core.logger import logger
+from src.core.metrics import db_checkout_wait_seconds, observe_db_query
+
+
+class DbMetrics:
+    """
+    Connection pool and query timing counters of a worker.
+
+    :param slow_query_ms: Queries running longer are logged and counted as slow, in milliseconds.
+    :param pool: Name of the pool in Prometheus metrics.
+    """
+    def __init__(self, slow_query_ms: int, pool: str = 'primary'):
+        self.pool = pool
+        self.slow_query_seconds = slow_query_ms / 1000
+        self.checkouts = 0
+        self.checkout_wait_total = 0.0
+        self.checkout_wait_max = 0.0
+        self.queries = 0
+        self.query_time_total = 0.0
+        self.query_time_max = 0.0
+        self.slow_queries = 0
+
+    def observe_checkout_wait(self, seconds: float):
+        self.checkouts += 1
+        self.checkout_wait_total += seconds
+        self.checkout_wait_max = max(self.checkout_wait_max, seconds)
+        db_checkout_wait_seconds.observe(seconds, self.pool)
+
+    def observe_query(self, statement: str, seconds: float):
+        self.queries += 1
+        self.query_time_total += seconds
+        self.query_time_max = max(self.query_time_max, seconds)
+        observe_db_query(self.pool, seconds)
+        if seconds >= self.slow_query_seconds:
+            self.slow_queries += 1
+            logger.warning(f"Slow query, {seconds * 1000:.0f} ms: {statement[:200]}")
+
+    def instrument(self, engine: Engine):
+        """
+        Registers query timing hooks on an engine. The start time is kept on the execution context, which is
+        dropped with the statement, so failed statements leave nothing behind on the pooled connection.
+        Failed statements are timed too: a statement timeout is the slowest query of all.
+
+        :param engine: A sync engine, `AsyncEngine.sync_engine` for async ones.
+        """
+        @event.listens_for(engine, 'before_cursor_execute')
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            # Internal statements, e.g. sequence fetches, may run without a context and aren't timed.
+            if context is not None:
+                context.query_started_at = time.perf_counter()
+
+        @event.listens_for(engine, 'after_cursor_execute')
+        def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            if context is not None:
+                self.observe_query(statement, time.perf_counter() - context.query_started_at)
+
+        @event.listens_for(engine, 'handle_error')
+        def handle_error(exception_context):
+            context = exception_context.execution_context
+            started_at = getattr(context, 'query_started_at', None)
+            if started_at is not None:
+                self.observe_query(exception_context.statement or '', time.perf_counter() - started_at)
+
+    def stats(self, engine: Engine) -> dict:
+        """
+        Returns pool state and counters.
+
+        :param engine: The instrumented sync engine.
+        :return: A dict of metrics.
+        """
+        pool = engine.pool
+        return {
+            'pool_size': pool.size(),
+            'checked_out': pool.checkedout(),
+            'checked_in': pool.checkedin(),
+            'overflow': pool.overflow(),
+            'checkouts': self.checkouts,
+            'checkout_wait_avg': self.checkout_wait_total / self.checkouts if self.checkouts else 0.0,
+            'checkout_wait_max': self.checkout_wait_max,
+            'queries': self.queries,
+            'query_time_avg': self.query_time_total / self.queries if self.queries else 0.0,
+            'query_time_max': self.query_time_max,
+            'slow_queries': self.slow_queries,
+        }
+
+
+def instrumented_pool_class(metrics: DbMetrics) -> type[AsyncAdaptedQueuePool]:
+    """
+    Builds a pool class measuring how long checkouts wait for a connection.
+
+    :param metrics: Metrics to report to.
+    :return: The pool class.
+    """
+    class InstrumentedPool(AsyncAdaptedQueuePool):
+        def _do_get(self):
+            started_at = time.perf_counter()
+            try:
+                return super()._do_get()
+            finally:
+                metrics.observe_checkout_wait(time.perf_counter() - started_at)
+
+    return InstrumentedPool
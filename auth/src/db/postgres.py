@@ -1,23 +1,158 @@
-from sqlalchemy import DDL, select
+import asyncio
+import time
+
+from sqlalchemy import DDL, select, text
 from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.ext.asyncio import (AsyncEngine, AsyncSession,
+                                    create_async_engine)
 from sqlalchemy.orm import declarative_base, sessionmaker
 
 from src.core import config
+from src.core.logger import logger
+from src.db.metrics import DbMetrics, instrumented_pool_class
 
 db_conf = config.DbConf()
 Base = declarative_base()
 
 DSN = f"postgresql+asyncpg://{db_conf.user}:{db_conf.password}@{db_conf.host}:{db_conf.port}/{db_conf.db}"
-engine = create_async_engine(DSN, echo=True, future=True)
+db_metrics = DbMetrics(db_conf.slow_query_ms)
+
+
+def create_engine(dsn: str, conf: config.DbConf, metrics: DbMetrics) -> AsyncEngine:
+    """
+    Creates an instrumented async engine.
+
+    :param dsn: Database DSN.
+    :param conf: Database configuration settings.
+    :param metrics: Metrics collecting pool waits and query timings of the engine.
+    :return: The engine.
+    """
+    server_settings = {}
+    if conf.statement_timeout_ms:
+        server_settings['statement_timeout'] = str(conf.statement_timeout_ms)
+    async_engine = create_async_engine(
+        f"{dsn}?prepared_statement_cache_size={conf.prepared_statement_cache_size}",
+        echo=conf.echo,
+        future=True,
+        poolclass=instrumented_pool_class(metrics),
+        pool_size=conf.pool_size,
+        max_overflow=conf.max_overflow,
+        pool_timeout=conf.pool_timeout,
+        pool_recycle=conf.pool_recycle,
+        pool_pre_ping=conf.pool_pre_ping,
+        connect_args={'server_settings': server_settings},
+    )
+    metrics.instrument(async_engine.sync_engine)
+    return async_engine
+
+
+engine = create_engine(DSN, db_conf, db_metrics)
 async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
 
+class ReplicaRouter:
+    """
+    Routes read-only sessions to the read replica while its replication lag is acceptable.
+
+    The lag is checked at most every `lag_check_interval` seconds. A replica streaming from the primary
+    that has replayed everything it received has no lag, however old its last transaction is. When the WAL
+    receiver is not streaming, the replica doesn't know what it misses, so the lag is the age of its last
+    replayed transaction. Failed checks route reads to the primary.
+
+    :param conf: Read replica configuration settings.
+    """
+    def __init__(self, conf: config.DbReplicaConf):
+        self.conf = conf
+        self.metrics = DbMetrics(db_conf.slow_query_ms, pool='replica')
+        self.engine = None
+        self.session_factory = None
+        if conf.host:
+            replica_dsn = f"postgresql+asyncpg://{db_conf.user}:{db_conf.password}@{conf.host}:{conf.port}/{db_conf.db}"
+            self.engine = create_engine(replica_dsn, db_conf, self.metrics)
+            self.session_factory = sessionmaker(self.engine, class_=AsyncSession, expire_on_commit=False)
+        self.lag: float | None = None
+        self.checked_at = 0.0
+        self.replica_reads = 0
+        self.primary_reads = 0
+        self._lock = asyncio.Lock()
+
+    async def check_lag(self) -> float | None:
+        """
+        Measures the replication lag. The WAL receiver status is visible to roles with `pg_read_all_stats`,
+        for other roles the receiver is treated as not streaming.
+
+        :return: The lag in seconds, None if it can't be measured.
+        """
+        try:
+            async with self.engine.connect() as conn:
+                return await conn.scalar(text(
+                    "SELECT CASE WHEN EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming') "
+                    "AND pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+                    "ELSE extract(epoch FROM now() - pg_last_xact_replay_timestamp()) END"
+                ))
+        except (SQLAlchemyError, OSError) as e:
+            logger.error(f"Can't check read replica lag: {e}")
+            return None
+
+    async def is_usable(self) -> bool:
+        """
+        Checks if reads may go to the replica.
+
+        :return: True if the replica is configured and its lag is acceptable.
+        """
+        if self.engine is None:
+            return False
+        if time.monotonic() - self.checked_at >= self.conf.lag_check_interval:
+            async with self._lock:
+                if time.monotonic() - self.checked_at >= self.conf.lag_check_interval:
+                    lag = await self.check_lag()
+                    self.lag = float(lag) if lag is not None else None
+                    self.checked_at = time.monotonic()
+        return self.lag is not None and self.lag <= self.conf.max_lag_seconds
+
+    def stats(self) -> dict | None:
+        """
+        Returns replica routing counters and replica pool metrics, None if there is no replica.
+        """
+        if self.engine is None:
+            return None
+        return {
+            'lag': self.lag,
+            'replica_reads': self.replica_reads,
+            'primary_reads': self.primary_reads,
+            **self.metrics.stats(self.engine.sync_engine),
+        }
+
+
+replica_router = ReplicaRouter(config.get_db_replica_config())
+
+
 async def get_session() -> AsyncSession:
     async with async_session() as session:
         yield session
 
 
+async def get_read_session_factory() -> sessionmaker:
+    """
+    Picks the session factory for read-only queries: the read replica when it's usable, otherwise the primary.
+    """
+    if await replica_router.is_usable():
+        replica_router.replica_reads += 1
+        return replica_router.session_factory
+    replica_router.primary_reads += 1
+    return async_session
+
+
+async def get_read_session() -> AsyncSession:
+    """
+    Provides a session for read-only queries: on the read replica when it's usable, otherwise on the primary.
+    Changes made through it must never be committed.
+    """
+    session_factory = await get_read_session_factory()
+    async with session_factory() as session:
+        yield session
+
+
 async def create_admin_role_if_not_exist(db: AsyncSession):
     from src.models.entity import Role
     result = await db.execute(select(Role).where(Role.name == "admin"))
@@ -32,19 +167,20 @@ async def create_admin_role_if_not_exist(db: AsyncSession):
 
 async def create_admin_user_if_not_exist(db: AsyncSession, login: str, password: str) -> None:
     from src.models.entity import User, UserRoles
+    from src.services.password import get_password_hasher
 
+    password_hasher = get_password_hasher()
     try:
         result = await db.execute(select(User).where(User.login == login))
         admin_user = result.scalars().first()
         admin_role = await create_admin_role_if_not_exist(db)
 
         if admin_user is None:
-            admin_user = User(login=login, password=password)
+            admin_user = User(login=login, password_hash=await password_hasher.hash(password))
             db.add(admin_user)
-        else:
-            temp_user = User(login=login, password=password)
-            if admin_user.password != temp_user.password:
-                admin_user.password = temp_user.password
+            await db.flush()
+        elif not await password_hasher.verify(admin_user.password, password):
+            admin_user.password = await password_hasher.hash(password)
 
         admin_user_role = await db.execute(
             select(UserRoles).where(UserRoles.user_id == admin_user.id, UserRoles.role_id == admin_role.id)
@@ -63,10 +199,12 @@ async def create_admin_user_if_not_exist(db: AsyncSession, login: str, password:
 async def create_database() -> None:
     from src.models.entity import (LoginHistory, RefreshToken, Role, User,
                                    UserRoles)
+    from src.services.login_history import ensure_partitions
 
     async with engine.begin() as conn:
         await conn.execute(DDL('CREATE SCHEMA IF NOT EXISTS content'))
         await conn.run_sync(Base.metadata.create_all)
+        await ensure_partitions(conn, config.get_login_history_config())
 
 
 async def purge_database() -> None:
@@ -1,8 +1,8 @@
 import uuid
 from datetime import datetime
 
-from sqlalchemy import (Boolean, Column, DateTime, ForeignKey, Index, String,
-                        Text)
+from sqlalchemy import (Boolean, Column, DateTime, ForeignKey, Index,
+                        LargeBinary, String, Text)
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
 from werkzeug.security import check_password_hash, generate_password_hash
@@ -38,14 +38,19 @@ class User(Base):
     login_histories = relationship('LoginHistory', back_populates='user')
 
     def __init__(self, login: str,
-                 password: str,
+                 password: str | None = None,
                  first_name: str | None = None,
                  last_name: str | None = None,
                  email: str | None = None,
                  is_oauth2: bool = False,
-                 credentials_updated: bool = True) -> None:
+                 credentials_updated: bool = True,
+                 password_hash: str | None = None) -> None:
+        """
+        Hashing here is synchronous. Code running on the event loop should hash with
+        `PasswordHasher` and pass the result as `password_hash`.
+        """
         self.login = login
-        self.password = generate_password_hash(password)
+        self.password = password_hash if password_hash is not None else generate_password_hash(password)
         self.first_name = first_name
         self.last_name = last_name
         self.email = email
@@ -88,15 +93,15 @@ class Role(Base):
 
 
 class RefreshToken(Base):
+    """
+    Issued refresh token. Only the SHA-256 digest of the token is stored, see `src.services.token.token_digest`.
+    """
     __tablename__ = 'refresh_tokens'
-    __table_args__ = (
-        Index('idx_refresh_tokens_token', 'jwt_token', 'user_agent'),
-        {"schema": "content"},
-    )
+    __table_args__ = {"schema": "content"}
 
     id = Column(UUID(as_uuid=True), primary_key=True, index=True, default=uuid.uuid4)
     user_id = Column(UUID(as_uuid=True), ForeignKey('content.users.id', ondelete='CASCADE'))
-    jwt_token = Column(Text, index=True)
+    token_hash = Column(LargeBinary(32), unique=True, index=True)
     user_agent = Column(String)
     created_at = Column(DateTime, default=datetime.utcnow)
     expiry_date = Column(DateTime)
@@ -105,20 +110,29 @@ class RefreshToken(Base):
 
 
 class LoginHistory(Base):
+    """
+    Login events, range-partitioned by month of `created_at`. Monthly partitions are created ahead
+    and dropped after the retention period, see `src.services.login_history.LoginHistoryRetention`.
+    """
     __tablename__ = 'login_histories'
-    __table_args__ = {"schema": "content"}
+    __table_args__ = {"schema": "content", "postgresql_partition_by": "RANGE (created_at)"}
 
-    id = Column(UUID(as_uuid=True), primary_key=True, index=True, default=uuid.uuid4)
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     user_id = Column(UUID(as_uuid=True), ForeignKey('content.users.id', ondelete='CASCADE'))
     user_agent = Column(String)
     ip_address = Column(String)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, primary_key=True, default=datetime.utcnow)
     user = relationship('User', back_populates='login_histories')
 
     def __init__(self, user_id: UUID, user_agent: str, ip_address: str) -> None:
         self.user_id = user_id
         self.user_agent = user_agent
         self.ip_address = ip_address
+        self.created_at = datetime.utcnow()
+
+
+Index('ix_content_login_histories_user_id_created_at',
+      LoginHistory.user_id, LoginHistory.created_at.desc(), LoginHistory.id.desc())
 
 
 class OAuth2User(Base):
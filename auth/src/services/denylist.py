@@ -0,0 +1,342 @@
+import asyncio
+import hashlib
+import math
+import secrets
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+from redis.asyncio import Redis, RedisError
+
+from src.core.config import DenylistConfig, get_denylist_config
+from src.core.logger import logger
+from src.services.single_flight import get_single_flight
+
+
+class BloomFilter:
+    """
+    Bloom filter of strings: no false negatives, false positives at about `error_rate` when filled to `capacity`.
+
+    :param capacity: Expected amount of items.
+    :param error_rate: Target false positive rate.
+    """
+    def __init__(self, capacity: int, error_rate: float):
+        capacity = max(capacity, 1)
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self.hash_count):
+            yield (first + i * second) % self.size
+
+    def add(self, item: str):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class TokenGenerations:
+    """
+    Per-user token generations. Access tokens carry the generation of their user at issue time (`gen`),
+    replacing it revokes all of them at once. Generations are cached locally for `generation_cache_ttl` seconds,
+    so a bump reaches other workers within that time.
+
+    Generations are random values rather than counters, so a generation lost by Redis is never issued again.
+    The generation is created when the first token of the user is issued, a missing one means Redis lost it
+    and tokens carrying any generation are rejected.
+
+    :param config: Denylist configuration settings.
+    """
+    def __init__(self, config: DenylistConfig):
+        self.config = config
+        self.entries: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self.redis: Redis | None = None
+        self.hits = 0
+        self.misses = 0
+
+    def _store(self, user_id: str, generation: bytes | str | None) -> str | None:
+        if generation is None:
+            self.entries.pop(user_id, None)
+            return None
+        if isinstance(generation, bytes):
+            generation = generation.decode()
+        self.entries[user_id] = (time.monotonic() + self.config.generation_cache_ttl, generation)
+        self.entries.move_to_end(user_id)
+        while len(self.entries) > self.config.generation_cache_size:
+            self.entries.popitem(last=False)
+        return generation
+
+    async def fetch(self, user_id: str) -> str | None:
+        """
+        Reads the current generation of a user from Redis, bypassing the local cache.
+
+        :param user_id: The UUID of the user.
+        :return: The token generation, None if it's missing.
+        """
+        return self._store(user_id, await self.redis.get(self.config.generation_key.format(user_id=user_id)))
+
+    async def issue(self, user_id: str) -> str:
+        """
+        Returns the current generation of a user, creating it if it's missing. Used to issue tokens.
+
+        :param user_id: The UUID of the user.
+        :return: The token generation.
+        """
+        generation = secrets.token_hex(8)
+        current = await self.redis.set(self.config.generation_key.format(user_id=user_id), generation,
+                                       nx=True, get=True)
+        return self._store(user_id, generation if current is None else current)
+
+    def get_cached(self, user_id: str) -> str | None:
+        """
+        Returns the generation of a user from the local cache.
+
+        :param user_id: The UUID of the user.
+        :return: The token generation, None if it isn't cached or is stale.
+        """
+        entry = self.entries.get(user_id)
+        if entry is not None and entry[0] > time.monotonic():
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        return None
+
+    async def get(self, user_id: str) -> str | None:
+        """
+        Returns the generation of a user, from the local cache when it's fresh.
+
+        :param user_id: The UUID of the user.
+        :return: The token generation, None if it's missing.
+        """
+        generation = self.get_cached(user_id)
+        if generation is not None:
+            return generation
+        return await get_single_flight('token_generation').do(user_id, lambda: self.fetch(user_id))
+
+    async def bump(self, user_id: str) -> str:
+        """
+        Revokes all tokens of a user issued so far.
+
+        :param user_id: The UUID of the user.
+        :return: The new token generation.
+        """
+        generation = secrets.token_hex(8)
+        await self.redis.set(self.config.generation_key.format(user_id=user_id), generation)
+        return self._store(user_id, generation)
+
+
+class TokenDenylist:
+    """
+    Denylist of revoked access tokens, keyed by the token `jti`.
+
+    Revoked jtis are kept in a Redis sorted set scored by token expiry. Every worker keeps a Bloom filter
+    of them: a jti missing from the filter is certainly not revoked, so only filter hits are confirmed in Redis.
+    Revocations are announced over pub/sub and added to the filters of all workers right away. Filters are rebuilt
+    from Redis every `sync_interval` seconds, which drops expired jtis and recovers announcements lost
+    on reconnects. Until the first rebuild succeeds every check goes to Redis.
+
+    Tokens whose user generation is not the current one are revoked as well, see `TokenGenerations`.
+
+    :param config: Denylist configuration settings.
+    """
+    def __init__(self, config: DenylistConfig):
+        self.config = config
+        self.filter: BloomFilter | None = None
+        self.generations = TokenGenerations(config)
+        self.redis: Redis | None = None
+        self.checks = 0
+        self.filter_hits = 0
+        self.false_positives = 0
+        self.redis_checks = 0
+        self._task: asyncio.Task | None = None
+
+    async def revoke(self, jti: str, expires_at: int | float):
+        """
+        Adds a token to the denylist until it expires.
+
+        :param jti: The token identifier.
+        :param expires_at: Token expiry, a unix timestamp.
+        """
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.zadd(self.config.key, {jti: expires_at})
+            pipe.zremrangebyscore(self.config.key, '-inf', time.time())
+            pipe.publish(self.config.channel, jti)
+            await pipe.execute()
+        if self.filter is not None:
+            self.filter.add(jti)
+
+    async def is_revoked(self, jti: str | None) -> bool:
+        """
+        Checks if a token is revoked.
+
+        :param jti: The token identifier.
+        :return: True if the token is in the denylist.
+        """
+        if jti is None:
+            return False
+        self.checks += 1
+        if self.filter is not None:
+            if jti not in self.filter:
+                return False
+            self.filter_hits += 1
+        self.redis_checks += 1
+        expires_at = await get_single_flight('denylist').do(jti, lambda: self.redis.zscore(self.config.key, jti))
+        revoked = expires_at is not None and expires_at > time.time()
+        if self.filter is not None and not revoked:
+            self.false_positives += 1
+        return revoked
+
+    async def is_access_token_revoked(self, access_token_decoded: dict) -> bool:
+        """
+        Checks if an access token is revoked, by its jti or by its user generation.
+
+        :param access_token_decoded: Claims of the access token.
+        :return: True if the token must be rejected.
+        """
+        if 'sub' in access_token_decoded:
+            generation = await self.generations.get(access_token_decoded['sub'])
+            if generation is None or access_token_decoded.get('gen') != generation:
+                return True
+        return await self.is_revoked(access_token_decoded.get('jti'))
+
+    async def are_access_tokens_revoked(self, access_tokens_decoded: list[dict]) -> list[bool]:
+        """
+        Checks a batch of access tokens with a single Redis round trip: one MGET for generations
+        missing from the local cache and one ZMSCORE for jtis passing the filter.
+
+        :param access_tokens_decoded: Claims of the access tokens.
+        :return: For each token, True if it must be rejected.
+        """
+        generations = {}
+        missing_user_ids = []
+        for user_id in {claims['sub'] for claims in access_tokens_decoded if 'sub' in claims}:
+            generation = self.generations.get_cached(user_id)
+            if generation is None:
+                missing_user_ids.append(user_id)
+            else:
+                generations[user_id] = generation
+        jtis = []
+        for jti in dict.fromkeys(claims.get('jti') for claims in access_tokens_decoded):
+            if jti is None:
+                continue
+            self.checks += 1
+            if self.filter is not None:
+                if jti not in self.filter:
+                    continue
+                self.filter_hits += 1
+            jtis.append(jti)
+
+        revoked_jtis = set()
+        if missing_user_ids or jtis:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                if missing_user_ids:
+                    pipe.mget([self.config.generation_key.format(user_id=user_id) for user_id in missing_user_ids])
+                if jtis:
+                    pipe.zmscore(self.config.key, jtis)
+                results = await pipe.execute()
+            if missing_user_ids:
+                for user_id, generation in zip(missing_user_ids, results.pop(0)):
+                    generations[user_id] = self.generations._store(user_id, generation)
+            if jtis:
+                self.redis_checks += len(jtis)
+                now = time.time()
+                for jti, expires_at in zip(jtis, results.pop(0)):
+                    if expires_at is not None and expires_at > now:
+                        revoked_jtis.add(jti)
+                    elif self.filter is not None:
+                        self.false_positives += 1
+
+        return [('sub' in claims and (generations[claims['sub']] is None
+                                      or claims.get('gen') != generations[claims['sub']]))
+                or claims.get('jti') in revoked_jtis
+                for claims in access_tokens_decoded]
+
+    async def rebuild(self):
+        """
+        Replaces the local filter with a new one, built from revoked jtis of not yet expired tokens.
+        """
+        now = time.time()
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.zremrangebyscore(self.config.key, '-inf', now)
+            pipe.zrangebyscore(self.config.key, now, '+inf')
+            _, jtis = await pipe.execute()
+        bloom_filter = BloomFilter(max(self.config.capacity, 2 * len(jtis)), self.config.error_rate)
+        for jti in jtis:
+            bloom_filter.add(jti.decode() if isinstance(jti, bytes) else jti)
+        self.filter = bloom_filter
+        logger.debug("Token denylist filter rebuilt, revoked tokens: {}", len(jtis))
+
+    async def _sync(self):
+        while True:
+            pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(self.config.channel)
+                await self.rebuild()
+                rebuilt_at = time.monotonic()
+                while True:
+                    # Announcements received during a rebuild wait in the connection buffer and are applied after it.
+                    message = await pubsub.get_message(timeout=1.0)
+                    if message is not None and self.filter is not None:
+                        data = message['data']
+                        self.filter.add(data.decode() if isinstance(data, bytes) else data)
+                    if time.monotonic() - rebuilt_at >= self.config.sync_interval:
+                        await self.rebuild()
+                        rebuilt_at = time.monotonic()
+            except RedisError as e:
+                logger.error(f"Token denylist sync failed: {e}")
+                self.filter = None
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.close()
+
+    def start(self, redis: Redis):
+        """
+        Starts syncing the local filter.
+
+        :param redis: Redis client.
+        """
+        self.redis = redis
+        self.generations.redis = redis
+        if self._task is None:
+            self._task = asyncio.create_task(self._sync())
+
+    async def close(self):
+        """
+        Stops syncing the local filter.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self) -> dict:
+        """
+        Returns denylist counters of this worker.
+
+        :return: A dict of counters.
+        """
+        return {
+            'checks': self.checks,
+            'filter_hits': self.filter_hits,
+            'false_positives': self.false_positives,
+            'redis_checks': self.redis_checks,
+            'filter_items': self.filter.count if self.filter is not None else 0,
+            'generation_hits': self.generations.hits,
+            'generation_misses': self.generations.misses,
+        }
+
+
+@lru_cache()
+def get_token_denylist() -> TokenDenylist:
+    """
+    Provides the process-wide TokenDenylist.
+
+    :return: An instance of TokenDenylist.
+    """
+    return TokenDenylist(get_denylist_config())
@@ -0,0 +1,174 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import time
+from http import HTTPStatus
+from typing import Awaitable, Callable
+
+import orjson
+from cryptography.fernet import Fernet, InvalidToken
+from fastapi import Depends, HTTPException, Response
+from redis.asyncio import Redis, RedisError
+from redis.exceptions import LockError
+
+from src.core.config import (FastApiConf, IdempotencyConfig, get_config,
+                             get_idempotency_config)
+from src.core.logger import logger
+from src.db.cache import get_redis_instance
+
+REPLAYED_HEADER = 'Idempotent-Replayed'
+
+
+def request_fingerprint(secret: bytes, operation: str, request_data: dict) -> str:
+    """
+    Computes an HMAC of the operation and its input, so a key reused for a different request is detected
+    and stored responses are never handed out for other credentials. The input holds passwords and tokens,
+    keying the digest with the server secret rules out offline guessing.
+
+    :param secret: The server secret.
+    :param operation: Name of the operation.
+    :param request_data: The request input.
+    :return: A hex digest.
+    """
+    message = orjson.dumps([operation, request_data], option=orjson.OPT_SORT_KEYS)
+    return hmac.new(secret, message, hashlib.sha256).hexdigest()
+
+
+class IdempotencyStore:
+    """
+    Replays responses of requests with an `Idempotency-Key`.
+
+    A request takes a short Redis lock on its key and stores its outcome for `ttl` seconds: the response,
+    or a client error. Duplicates arriving meanwhile wait for the outcome instead of executing, so a retry storm
+    costs one execution. Server errors aren't stored, the next retry executes again. If Redis is unavailable,
+    requests execute as if they had no key.
+
+    Outcomes of login and refresh hold access and refresh tokens, so they are encrypted with a key derived from
+    the server secret and the `Idempotency-Key`, which is only kept in Redis as a digest: reading Redis is not
+    enough to recover the tokens.
+
+    :param config: Idempotency configuration settings.
+    :param redis: Redis client.
+    :param secret_key: The server secret, keys fingerprints and encryption of stored outcomes.
+    """
+    def __init__(self, config: IdempotencyConfig, redis: Redis, secret_key: str):
+        self.config = config
+        self.redis = redis
+        self.secret = secret_key.encode()
+
+    def _key(self, operation: str, idempotency_key: str) -> str:
+        digest = hashlib.sha256(idempotency_key.encode()).hexdigest()
+        return f'{self.config.key_prefix}:{operation}:{digest}'
+
+    def _cipher(self, operation: str, idempotency_key: str) -> Fernet:
+        key = hmac.new(self.secret, f'{operation}:{idempotency_key}'.encode(), hashlib.sha256).digest()
+        return Fernet(base64.urlsafe_b64encode(key))
+
+    @staticmethod
+    def _replay(cipher: Fernet, stored: bytes, fingerprint: str) -> dict:
+        try:
+            outcome = orjson.loads(cipher.decrypt(stored))
+        except InvalidToken:
+            # Stored under another server secret.
+            outcome = {'fingerprint': None}
+        if outcome['fingerprint'] != fingerprint:
+            raise HTTPException(status_code=HTTPStatus.UNPROCESSABLE_ENTITY,
+                                detail="Idempotency-Key was used for a different request")
+        if 'error' in outcome:
+            raise HTTPException(status_code=outcome['status'], detail=outcome['error'], headers=outcome['headers'])
+        return outcome['response']
+
+    async def _wait(self, cipher: Fernet, key: str, fingerprint: str) -> dict | None:
+        """
+        Waits while a duplicate holds the key.
+
+        :return: The stored response, None if the duplicate released the key without storing an outcome.
+        """
+        deadline = time.monotonic() + self.config.lock_ttl
+        while time.monotonic() < deadline:
+            stored, locked = await self.redis.mget([key, f'{key}:lock'])
+            if stored is not None:
+                return self._replay(cipher, stored, fingerprint)
+            if locked is None:
+                return None
+            await asyncio.sleep(self.config.poll_interval)
+        raise HTTPException(status_code=HTTPStatus.CONFLICT,
+                            detail="A request with this Idempotency-Key is in progress")
+
+    async def _store(self, cipher: Fernet, key: str, outcome: dict):
+        try:
+            await self.redis.set(key, cipher.encrypt(orjson.dumps(outcome)), ex=self.config.ttl)
+        except RedisError as e:
+            logger.error(f"Can't store idempotent response: {e}")
+
+    async def run(self, operation: str, idempotency_key: str | None, request_data: dict,
+                  execute: Callable[[], Awaitable[dict]], response: Response) -> dict:
+        """
+        Executes a request once per idempotency key, replaying the stored outcome for duplicates.
+
+        :param operation: Name of the operation, keys of different operations don't clash.
+        :param idempotency_key: The `Idempotency-Key` header, None to just execute.
+        :param request_data: Input of the request, a key reused with a different input is rejected.
+        :param execute: Coroutine function executing the request, returning a JSON-serializable response.
+        :param response: The response, marked with the `Idempotent-Replayed` header on replays.
+        :return: The response.
+        """
+        if idempotency_key is None or not self.config.is_on:
+            return await execute()
+        if not idempotency_key or len(idempotency_key) > self.config.max_key_length:
+            raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail="Invalid Idempotency-Key")
+        key = self._key(operation, idempotency_key)
+        cipher = self._cipher(operation, idempotency_key)
+        fingerprint = request_fingerprint(self.secret, operation, request_data)
+        try:
+            while True:
+                stored = await self.redis.get(key)
+                if stored is not None:
+                    response.headers[REPLAYED_HEADER] = 'true'
+                    return self._replay(cipher, stored, fingerprint)
+                lock = self.redis.lock(f'{key}:lock', timeout=self.config.lock_ttl)
+                if await lock.acquire(blocking=False):
+                    break
+                result = await self._wait(cipher, key, fingerprint)
+                if result is not None:
+                    response.headers[REPLAYED_HEADER] = 'true'
+                    return result
+        except RedisError as e:
+            logger.error(f"Idempotency check failed, executing request: {e}")
+            return await execute()
+
+        try:
+            # The outcome may have been stored between the check and the lock.
+            stored = await self.redis.get(key)
+            if stored is not None:
+                response.headers[REPLAYED_HEADER] = 'true'
+                return self._replay(cipher, stored, fingerprint)
+            try:
+                result = await execute()
+            except HTTPException as e:
+                if e.status_code < HTTPStatus.INTERNAL_SERVER_ERROR:
+                    await self._store(cipher, key, {'fingerprint': fingerprint, 'status': e.status_code,
+                                                    'error': e.detail, 'headers': e.headers})
+                raise
+            await self._store(cipher, key, {'fingerprint': fingerprint, 'response': result})
+            return result
+        finally:
+            try:
+                await lock.release()
+            except (LockError, RedisError) as e:
+                logger.warning(f"Can't release idempotency lock: {e}")
+
+
+def get_idempotency_store(config: IdempotencyConfig = Depends(get_idempotency_config),
+                          redis: Redis = Depends(get_redis_instance),
+                          app_config: FastApiConf = Depends(get_config)) -> IdempotencyStore:
+    """
+    Provides an IdempotencyStore.
+
+    :param config: Idempotency configuration settings.
+    :param redis: Redis client.
+    :param app_config: Configuration settings of the application, provides the server secret.
+    :return: An instance of IdempotencyStore.
+    """
+    return IdempotencyStore(config, redis, app_config.secret_key)
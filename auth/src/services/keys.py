@@ -0,0 +1,193 @@
+import fcntl
+import json
+import os
+import time
+import uuid
+from dataclasses import dataclass
+from datetime import datetime
+from functools import lru_cache
+from pathlib import Path
+from typing import Any
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
+from jwt.algorithms import OKPAlgorithm, RSAAlgorithm
+
+from src.core.config import JwtConf, get_config
+from src.core.logger import logger
+
+KEY_SUFFIX = '.pem'
+LOCK_FILE = '.lock'
+
+
+@dataclass
+class SigningKey:
+    """
+    A JWT signing key pair.
+
+    :param kid: Key identifier, put into the `kid` header of issued tokens.
+    :param algorithm: JWT algorithm of the key, 'RS256' or 'EdDSA'.
+    :param private_key: Private key used for signing.
+    :param public_key: Public key used for verification.
+    """
+    kid: str
+    algorithm: str
+    private_key: Any
+    public_key: Any
+
+    def to_jwk(self) -> dict:
+        """
+        Exports the public part of the key in JWK format.
+
+        :return: JWK dict.
+        """
+        algorithm_class = RSAAlgorithm if self.algorithm == 'RS256' else OKPAlgorithm
+        jwk = json.loads(algorithm_class.to_jwk(self.public_key))
+        jwk.update({'kid': self.kid, 'alg': self.algorithm, 'use': 'sig'})
+        return jwk
+
+
+def generate_private_key(algorithm: str, key_size: int = 2048):
+    """
+    Generates a new private key for the algorithm.
+
+    :param algorithm: JWT algorithm, 'RS256' or 'EdDSA'.
+    :param key_size: RSA key size in bits.
+    :return: The private key.
+    """
+    if algorithm == 'RS256':
+        return rsa.generate_private_key(public_exponent=65537, key_size=key_size)
+    if algorithm == 'EdDSA':
+        return ed25519.Ed25519PrivateKey.generate()
+    raise ValueError(f"Unsupported JWT signing algorithm: {algorithm}")
+
+
+def key_algorithm(private_key) -> str:
+    """
+    Detects the JWT algorithm of a private key.
+
+    :param private_key: The private key.
+    :return: JWT algorithm name.
+    """
+    if isinstance(private_key, rsa.RSAPrivateKey):
+        return 'RS256'
+    if isinstance(private_key, ed25519.Ed25519PrivateKey):
+        return 'EdDSA'
+    raise ValueError(f"Unsupported private key type: {type(private_key).__name__}")
+
+
+class KeyStore:
+    """
+    File-based store of JWT signing keys.
+
+    Every `<kid>.pem` file in the keys directory is a private key. Kids start with a creation timestamp, the newest
+    key signs new tokens, older ones are kept to verify tokens issued before a rotation until their files are removed.
+    The directory is re-read when its modification time changes, checked at most every `reload_seconds`.
+
+    :param config: JWT configuration settings.
+    """
+    def __init__(self, config: JwtConf):
+        self.config = config
+        self.keys_dir = Path(config.keys_dir)
+        self.keys: dict[str, SigningKey] = {}
+        self.active: SigningKey | None = None
+        self.jwks: dict = {'keys': []}
+        self._dir_mtime = 0.0
+        self._checked_at = 0.0
+
+    def load(self, create_if_empty: bool = False) -> None:
+        """
+        Reads keys from the keys directory.
+
+        :param create_if_empty: Generate a key if the directory has none.
+        """
+        self.keys_dir.mkdir(parents=True, exist_ok=True)
+        with open(self.keys_dir / LOCK_FILE, 'w') as lock:
+            # Workers start concurrently, only one of them may generate the first key.
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                if create_if_empty and not any(self.keys_dir.glob(f'*{KEY_SUFFIX}')):
+                    self.generate_key()
+                keys = {}
+                for path in sorted(self.keys_dir.glob(f'*{KEY_SUFFIX}')):
+                    private_key = serialization.load_pem_private_key(path.read_bytes(), password=None)
+                    kid = path.name[:-len(KEY_SUFFIX)]
+                    keys[kid] = SigningKey(kid=kid,
+                                           algorithm=key_algorithm(private_key),
+                                           private_key=private_key,
+                                           public_key=private_key.public_key())
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+        if not keys:
+            raise RuntimeError(f"No JWT signing keys found in {self.keys_dir}")
+        self.keys = keys
+        self.active = keys[max(keys)]
+        self.jwks = {'keys': [key.to_jwk() for key in keys.values()]}
+        self._dir_mtime = self.keys_dir.stat().st_mtime
+        self._checked_at = time.monotonic()
+        logger.info(f"Loaded JWT signing keys: {list(keys)}, active: {self.active.kid}")
+
+    def generate_key(self) -> str:
+        """
+        Generates a new private key file. It becomes the active key on the next reload.
+
+        :return: The kid of the new key.
+        """
+        kid = f'{datetime.utcnow().strftime("%Y%m%d%H%M%S")}-{uuid.uuid4().hex[:8]}'
+        private_key = generate_private_key(self.config.algorithm, self.config.key_size)
+        pem = private_key.private_bytes(encoding=serialization.Encoding.PEM,
+                                        format=serialization.PrivateFormat.PKCS8,
+                                        encryption_algorithm=serialization.NoEncryption())
+        fd = os.open(self.keys_dir / f'{kid}{KEY_SUFFIX}', os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, 'wb') as key_file:
+            key_file.write(pem)
+        logger.info(f"Generated JWT signing key {kid}")
+        return kid
+
+    def reload_if_changed(self) -> None:
+        """
+        Reloads keys if the keys directory was modified since the last load.
+        """
+        if time.monotonic() - self._checked_at < self.config.reload_seconds:
+            return
+        self._checked_at = time.monotonic()
+        try:
+            if self.keys_dir.stat().st_mtime != self._dir_mtime:
+                self.load()
+        except (OSError, RuntimeError, ValueError) as e:
+            logger.error(f"Failed to reload JWT signing keys: {e}")
+
+    def get_active_key(self) -> SigningKey:
+        """
+        Returns the key used to sign new tokens.
+
+        :return: The active signing key.
+        """
+        self.reload_if_changed()
+        return self.active
+
+    def get_key(self, kid: str | None) -> SigningKey | None:
+        """
+        Returns a verification key by its kid.
+
+        :param kid: Key identifier from the token header.
+        :return: The signing key, or None if it's unknown.
+        """
+        self.reload_if_changed()
+        return self.keys.get(kid)
+
+
+@lru_cache()
+def get_key_store() -> KeyStore | None:
+    """
+    Provides the process-wide KeyStore, or None if tokens are signed with the shared HS256 secret.
+
+    :return: An instance of KeyStore or None.
+    """
+    config = get_config()
+    if config.jwt.algorithm == 'HS256':
+        return None
+    key_store = KeyStore(config.jwt)
+    key_store.load(create_if_empty=config.is_dev_mode or config.jwt.generate_if_missing)
+    return key_store
@@ -0,0 +1,371 @@
+import asyncio
+import base64
+import binascii
+import os
+import re
+import time
+import uuid
+from datetime import date, datetime
+from functools import lru_cache
+from uuid import UUID
+
+from redis.asyncio import Redis, RedisError, ResponseError
+from redis.exceptions import LockError
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from src.core.config import LoginHistoryConfig, get_login_history_config
+from src.core.logger import logger
+from src.db.postgres import async_session, engine
+from src.models.entity import LoginHistory
+
+STREAM_GROUP = 'login_history_writer'
+PARTITION_NAME = re.compile(r'^login_histories_y(\d{4})m(\d{2})$')
+
+
+def encode_cursor(created_at: datetime, record_id: UUID) -> str:
+    """
+    Builds an opaque keyset pagination cursor pointing after a login history record.
+
+    :param created_at: Creation time of the last record of a page.
+    :param record_id: ID of the last record of a page.
+    :return: The cursor.
+    """
+    return base64.urlsafe_b64encode(f'{created_at.isoformat()}|{record_id}'.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, UUID]:
+    """
+    Parses a keyset pagination cursor.
+
+    :param cursor: The cursor.
+    :return: Creation time and ID of the last record of the previous page.
+    :raises ValueError: If the cursor is malformed.
+    """
+    try:
+        created_at, record_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(created_at), UUID(record_id)
+    except (binascii.Error, UnicodeDecodeError) as e:
+        raise ValueError('Malformed cursor') from e
+
+
+def add_months(month: date, months: int) -> date:
+    """
+    Shifts the first day of a month by a number of months.
+    """
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+async def create_partitions(conn: AsyncConnection, first_month: date, count: int):
+    """
+    Creates missing monthly partitions of `login_histories`.
+
+    :param conn: Database connection.
+    :param first_month: First day of the first month.
+    :param count: Amount of months.
+    """
+    for i in range(count):
+        month = add_months(first_month, i)
+        await conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS content.login_histories_y{month:%Y}m{month:%m} "
+            f"PARTITION OF content.login_histories "
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+        ))
+
+
+async def drop_partitions_before(conn: AsyncConnection, month: date) -> list[str]:
+    """
+    Drops monthly partitions of `login_histories` older than a month.
+
+    :param conn: Database connection.
+    :param month: First day of the oldest month to keep.
+    :return: Names of dropped partitions.
+    """
+    result = await conn.execute(text(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "JOIN pg_namespace ON pg_namespace.oid = parent.relnamespace "
+        "WHERE parent.relname = 'login_histories' AND pg_namespace.nspname = 'content'"
+    ))
+    dropped = []
+    for name in result.scalars():
+        match = PARTITION_NAME.match(name)
+        if match and date(int(match[1]), int(match[2]), 1) < month:
+            await conn.execute(text(f"DROP TABLE IF EXISTS content.{name}"))
+            dropped.append(name)
+    return dropped
+
+
+async def ensure_partitions(conn: AsyncConnection, config: LoginHistoryConfig):
+    """
+    Creates partitions for the current month and `partitions_ahead` months after it.
+
+    :param conn: Database connection.
+    :param config: Login history configuration settings.
+    """
+    await create_partitions(conn, datetime.utcnow().date().replace(day=1), config.partitions_ahead + 1)
+
+
+class LoginHistoryWriter:
+    """
+    Writes login history in the background, so logins don't wait for the insert.
+
+    Login events are put into a bounded in-process queue and inserted in multi-row batches of up to `batch_size`
+    rows, at least every `flush_interval` seconds. Events that don't fit into the queue, and batches that failed
+    to insert, are appended to a Redis stream. Workers drain the stream through a consumer group every
+    `drain_interval` seconds. Events carry their ids, so an event written twice is inserted once.
+
+    :param config: Login history configuration settings.
+    """
+    def __init__(self, config: LoginHistoryConfig):
+        self.config = config
+        self.queue: asyncio.Queue[dict] = asyncio.Queue(maxsize=config.queue_size)
+        self.redis: Redis | None = None
+        self.consumer = f'{os.uname().nodename}:{os.getpid()}'
+        self.enqueued = 0
+        self.written = 0
+        self.batches = 0
+        self.overflowed = 0
+        self.dropped = 0
+        self._batch: list[dict] = []
+        self._tasks: list[asyncio.Task] = []
+
+    async def record(self, user_id: UUID | str, user_agent: str, ip_address: str):
+        """
+        Queues a login event.
+
+        :param user_id: The ID of the user who is logging in.
+        :param user_agent: The user agent string from the user's request.
+        :param ip_address: The IP address of the user at the time of login.
+        """
+        event = {
+            'id': str(uuid.uuid4()),
+            'user_id': str(user_id),
+            'user_agent': user_agent,
+            'ip_address': ip_address,
+            'created_at': datetime.utcnow().isoformat(),
+        }
+        try:
+            self.queue.put_nowait(event)
+            self.enqueued += 1
+        except asyncio.QueueFull:
+            await self._overflow([event])
+
+    async def _overflow(self, events: list[dict]):
+        """
+        Appends events to the overflow stream.
+
+        :param events: Login events.
+        """
+        if self.redis is None:
+            self.dropped += len(events)
+            logger.error(f"Login history overflow stream is unavailable, dropped {len(events)} events")
+            return
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for event in events:
+                    pipe.xadd(self.config.stream, event, maxlen=self.config.stream_max_len, approximate=True)
+                await pipe.execute()
+            self.overflowed += len(events)
+        except Exception as e:
+            self.dropped += len(events)
+            logger.error(f"Can't write login history to the overflow stream, dropped {len(events)} events: {e}")
+
+    async def insert(self, events: list[dict]):
+        """
+        Inserts events with a single statement, events already written are skipped.
+
+        :param events: Login events.
+        """
+        rows = [{
+            'id': UUID(event['id']),
+            'user_id': UUID(event['user_id']),
+            'user_agent': event['user_agent'],
+            'ip_address': event['ip_address'],
+            'created_at': datetime.fromisoformat(event['created_at']),
+        } for event in events]
+        async with async_session() as session:
+            async with session.begin():
+                await session.execute(insert(LoginHistory).values(rows).on_conflict_do_nothing())
+        self.written += len(rows)
+        self.batches += 1
+
+    async def _collect_batch(self):
+        # The batch is kept on the writer, so events taken from the queue survive cancellation on shutdown.
+        self._batch.append(await self.queue.get())
+        deadline = time.monotonic() + self.config.flush_interval
+        while len(self._batch) < self.config.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                self._batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+    async def _write_loop(self):
+        failures = 0
+        while True:
+            await self._collect_batch()
+            written = await self._write(self._batch)
+            self._batch = []
+            if written:
+                failures = 0
+                continue
+            # The database is unavailable: back off, meanwhile new events overflow from the full queue.
+            failures += 1
+            await asyncio.sleep(min(self.config.flush_interval * 2 ** failures, self.config.drain_interval))
+
+    async def _write(self, batch: list[dict]) -> bool:
+        """
+        Inserts a batch, moves it to the overflow stream if the insert fails for any reason.
+
+        :param batch: Login events.
+        :return: True if the batch is inserted.
+        """
+        try:
+            await self.insert(batch)
+            return True
+        except Exception as e:
+            logger.error(f"Can't insert {len(batch)} login history events, moving them to the overflow stream: {e}")
+            await self._overflow(batch)
+            return False
+
+    async def _drain_overflow(self):
+        """
+        Moves events from the overflow stream to the database. Entries idle in other consumers, e.g. of stopped
+        workers, are claimed, entries are acknowledged and deleted once inserted.
+        """
+        try:
+            await self.redis.xgroup_create(self.config.stream, STREAM_GROUP, id='0', mkstream=True)
+        except ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+        while True:
+            _, claimed, *_ = await self.redis.xautoclaim(self.config.stream, STREAM_GROUP, self.consumer,
+                                                          min_idle_time=60000, count=self.config.batch_size)
+            entries = claimed or []
+            if not entries:
+                response = await self.redis.xreadgroup(STREAM_GROUP, self.consumer, {self.config.stream: '>'},
+                                                       count=self.config.batch_size)
+                entries = response[0][1] if response else []
+            if not entries:
+                return
+            ids = [entry_id for entry_id, _ in entries]
+            events = [{key.decode(): value.decode() for key, value in fields.items()} for _, fields in entries]
+            try:
+                await self.insert(events)
+            except IntegrityError:
+                # E.g. a user deleted meanwhile, insert one by one to keep the rest of the batch.
+                await self._insert_each(events)
+            await self.redis.xack(self.config.stream, STREAM_GROUP, *ids)
+            await self.redis.xdel(self.config.stream, *ids)
+
+    async def _insert_each(self, events: list[dict]):
+        for event in events:
+            try:
+                await self.insert([event])
+            except IntegrityError as e:
+                self.dropped += 1
+                logger.warning(f"Dropped login history event {event['id']}: {e}")
+
+    async def _drain_loop(self):
+        while True:
+            await asyncio.sleep(self.config.drain_interval)
+            try:
+                await self._drain_overflow()
+            except Exception as e:
+                logger.error(f"Can't drain the login history overflow stream: {e}")
+
+    def start(self, redis: Redis | None):
+        """
+        Starts background writing.
+
+        :param redis: Redis client for the overflow stream.
+        """
+        self.redis = redis
+        if not self._tasks:
+            self._tasks.append(asyncio.create_task(self._write_loop()))
+            if redis is not None:
+                self._tasks.append(asyncio.create_task(self._drain_loop()))
+
+    async def close(self):
+        """
+        Stops background writing and writes the queued events.
+        """
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        events, self._batch = self._batch, []
+        while not self.queue.empty():
+            events.append(self.queue.get_nowait())
+        for i in range(0, len(events), self.config.batch_size):
+            await self._write(events[i:i + self.config.batch_size])
+
+    def stats(self) -> dict:
+        """
+        Returns writer counters of this worker.
+
+        :return: A dict of counters.
+        """
+        return {
+            'queued': self.queue.qsize(),
+            'enqueued': self.enqueued,
+            'written': self.written,
+            'batches': self.batches,
+            'overflowed': self.overflowed,
+            'dropped': self.dropped,
+        }
+
+
+class LoginHistoryRetention:
+    """
+    Maintains monthly partitions of the login history: creates upcoming ones and drops the ones older
+    than `retention_months`. Every worker schedules the job, the one holding the Redis lock runs it.
+
+    :param config: Login history configuration settings.
+    :param redis: Redis client for the leader lock. Without it every call runs.
+    """
+    def __init__(self, config: LoginHistoryConfig, redis: Redis | None = None):
+        self.config = config
+        self.redis = redis
+
+    async def run(self):
+        lock = None
+        if self.redis is not None:
+            lock = self.redis.lock(self.config.retention_lock_key, timeout=300)
+            try:
+                if not await lock.acquire(blocking=False):
+                    return
+            except RedisError as e:
+                logger.error(f"Login history retention can't acquire the leader lock: {e}")
+                return
+        try:
+            async with engine.begin() as conn:
+                await ensure_partitions(conn, self.config)
+                oldest_month = add_months(datetime.utcnow().date().replace(day=1), -self.config.retention_months)
+                dropped = await drop_partitions_before(conn, oldest_month)
+            if dropped:
+                logger.info(f"Dropped login history partitions: {dropped}")
+        except SQLAlchemyError as e:
+            logger.error(f"Login history retention failed: {e}")
+        finally:
+            if lock is not None:
+                try:
+                    await lock.release()
+                except (LockError, RedisError) as e:
+                    logger.warning(f"Login history retention can't release the leader lock: {e}")
+
+
+@lru_cache()
+def get_login_history_writer() -> LoginHistoryWriter:
+    """
+    Provides the process-wide LoginHistoryWriter.
+
+    :return: An instance of LoginHistoryWriter.
+    """
+    return LoginHistoryWriter(get_login_history_config())
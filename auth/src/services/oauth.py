@@ -222,8 +222,9 @@ class OAuthService:
         else:
             try:
                 login = generate_unique_login()
+                password_hash = await self.user_service.password_hasher.hash(str(uuid.uuid4()))
                 user = User(login=login,
-                            password=str(uuid.uuid4()),
+                            password_hash=password_hash,
                             email=user_data.email,
                             is_oauth2=True,
                             credentials_updated=False)
@@ -0,0 +1,160 @@
+import asyncio
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache, partial
+from multiprocessing import get_context
+from typing import Any, Callable
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from src.core.config import PasswordHashConfig, get_password_hash_config
+from src.core.logger import logger
+from src.core.metrics import password_hash_queue_seconds, password_hash_run_seconds
+
+
+def generate_password_hashes(passwords: list[str], method: str, salt_length: int) -> list[str]:
+    """
+    Hashes a chunk of passwords in one executor job, so bulk hashing doesn't pay a round trip per password.
+    """
+    return [generate_password_hash(password, method=method, salt_length=salt_length) for password in passwords]
+
+
+class PasswordHasher:
+    """
+    Hashes and verifies passwords outside the event loop.
+
+    PBKDF2/scrypt work is submitted to a process (or thread) pool. The number of jobs handed to the pool at once
+    is capped by a semaphore, so a login storm waits in the event loop instead of flooding the executor.
+
+    :param config: Configuration settings for password hashing.
+    """
+    def __init__(self, config: PasswordHashConfig):
+        self.config = config
+        self._executor: Executor | None = None
+        self._semaphore = asyncio.Semaphore(config.max_concurrency)
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.in_flight = 0
+        self.completed = 0
+        self.total_wait_time = 0.0
+        self.total_run_time = 0.0
+
+    def _get_executor(self) -> Executor:
+        """
+        Lazily creates the executor, so importing the module or running the CLI doesn't spawn workers.
+
+        :return: The executor used for hashing jobs.
+        """
+        if self._executor is None:
+            if self.config.executor == 'process':
+                # spawn instead of fork: the parent holds an event loop, sockets and scheduler threads.
+                self._executor = ProcessPoolExecutor(max_workers=self.config.max_workers,
+                                                     mp_context=get_context('spawn'))
+            elif self.config.executor == 'thread':
+                self._executor = ThreadPoolExecutor(max_workers=self.config.max_workers,
+                                                    thread_name_prefix='password-hash')
+            else:
+                raise ValueError(f"Unknown password hash executor type: {self.config.executor}")
+            logger.info(f"Password hash executor started: {self.config.executor}, "
+                        f"workers: {self.config.max_workers or 'cpu count'}")
+        return self._executor
+
+    async def _run(self, func: Callable, *args: Any, **kwargs: Any) -> Any:
+        """
+        Runs a hashing job in the executor, respecting the concurrency cap and collecting queue metrics.
+
+        :param func: Picklable function to execute.
+        :param args: Positional arguments for the function.
+        :param kwargs: Keyword arguments for the function.
+        :return: The function result.
+        """
+        enqueued_at = time.perf_counter()
+        self.queue_depth += 1
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.queue_depth -= 1
+
+        started_at = time.perf_counter()
+        self.total_wait_time += started_at - enqueued_at
+        password_hash_queue_seconds.observe(started_at - enqueued_at)
+        self.in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), partial(func, *args, **kwargs))
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+            run_time = time.perf_counter() - started_at
+            self.total_run_time += run_time
+            password_hash_run_seconds.observe(run_time)
+            self._semaphore.release()
+
+    async def hash(self, password: str) -> str:
+        """
+        Generates a werkzeug-format password hash.
+
+        :param password: The plain password.
+        :return: The password hash.
+        """
+        return await self._run(generate_password_hash, password,
+                               method=self.config.method, salt_length=self.config.salt_length)
+
+    async def hash_many(self, passwords: list[str], chunk_size: int) -> list[str]:
+        """
+        Generates werkzeug-format hashes of many passwords, chunks are hashed by all executor workers in parallel.
+
+        :param passwords: The plain passwords.
+        :param chunk_size: Amount of passwords hashed by one executor job.
+        :return: The password hashes, in the order of `passwords`.
+        """
+        chunks = await asyncio.gather(*(
+            self._run(generate_password_hashes, passwords[i:i + chunk_size],
+                      method=self.config.method, salt_length=self.config.salt_length)
+            for i in range(0, len(passwords), chunk_size)
+        ))
+        return [password_hash for chunk in chunks for password_hash in chunk]
+
+    async def verify(self, password_hash: str, password: str) -> bool:
+        """
+        Checks a plain password against a werkzeug-format password hash.
+
+        :param password_hash: The stored password hash.
+        :param password: The plain password to check.
+        :return: True if the password matches, False otherwise.
+        """
+        return await self._run(check_password_hash, password_hash, password)
+
+    def stats(self) -> dict[str, int | float]:
+        """
+        Returns queue and execution metrics of the hasher.
+
+        :return: A dict with queue depth, in-flight jobs, completed jobs and average wait / run times in seconds.
+        """
+        return {
+            'queue_depth': self.queue_depth,
+            'max_queue_depth': self.max_queue_depth,
+            'in_flight': self.in_flight,
+            'completed': self.completed,
+            'avg_wait_time': self.total_wait_time / self.completed if self.completed else 0.0,
+            'avg_run_time': self.total_run_time / self.completed if self.completed else 0.0,
+        }
+
+    def shutdown(self):
+        """
+        Stops the executor if it was started.
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+@lru_cache()
+def get_password_hasher() -> PasswordHasher:
+    """
+    Provides the process-wide PasswordHasher instance.
+
+    :return: An instance of PasswordHasher.
+    """
+    return PasswordHasher(get_password_hash_config())
@@ -1,20 +1,491 @@
+import math
 import time
+import uuid
+from abc import ABC, abstractmethod
+from array import array
+from collections import OrderedDict
+from dataclasses import dataclass
 from functools import lru_cache
 from http import HTTPStatus
 
-from fastapi import Depends, HTTPException
+from fastapi import Depends, HTTPException, Response
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from redis.asyncio import Redis, RedisError
 from starlette.requests import Request
 
 from src.core.config import RateLimitConfig, get_rate_limit_config
-from src.core.logger import logger
-from src.db.cache import CacheBackend, get_cache, get_redis_instance
+from src.core.logger import logger, sampled_logger
+from src.core.metrics import rate_limit_check_seconds, rate_limit_decisions, timed
+from src.db.cache import get_redis_instance
+from src.services.denylist import TokenDenylist, get_token_denylist
 from src.services.token import TokenService, get_token_service
-from src.services.utils import get_ip_address, get_user_agent
+from src.services.utils import get_ip_address, get_user_agent_key
 
 security = HTTPBearer()
 
+# KEYS[1] - limiter key, ARGV - limit, period in seconds, cost.
+# The key holds only the theoretical arrival time (TAT) of the next request.
+GCRA_SCRIPT = """
+local limit = tonumber(ARGV[1])
+local period = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local interval = period / limit
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+
+local tat = tonumber(redis.call('GET', KEYS[1]))
+if not tat or tat < now then
+    tat = now
+end
+
+local new_tat = tat + interval * cost
+local allow_at = new_tat - period
+if allow_at > now then
+    local remaining = math.floor((period - (tat - now)) / interval + 1e-6)
+    return {1, remaining, tostring(tat - now), tostring(allow_at - now)}
+end
+
+redis.call('SET', KEYS[1], tostring(new_tat), 'PX', math.ceil((new_tat - now) * 1000))
+local remaining = math.floor((period - (new_tat - now)) / interval + 1e-6)
+return {0, remaining, tostring(new_tat - now), '0'}
+"""
+
+# KEYS[1] - limiter key, ARGV - capacity, period in seconds, cost.
+# The key is a hash with the amount of tokens left and the time of the last refill.
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local period = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local rate = capacity / period
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+
+local limited = 0
+local retry_after = 0
+if tokens < cost then
+    limited = 1
+    retry_after = (cost - tokens) / rate
+else
+    tokens = tokens - cost
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(period * 1000))
+return {limited, math.floor(tokens), tostring((capacity - tokens) / rate), tostring(retry_after)}
+"""
+
+# KEYS[1] - limiter key, ARGV - current bucket, buckets in window, pending delta, request flag, limit, ttl in ms.
+# The key is a hash of bucket number -> requests. Pending requests were already admitted locally and are always
+# added, the request itself is added only if it fits into the limit. Returns {limited, total, bucket counts...}
+# with counts ordered from the oldest bucket of the window to the current one.
+HYBRID_SYNC_SCRIPT = """
+local current = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local pending = tonumber(ARGV[3])
+local request = tonumber(ARGV[4])
+local limit = tonumber(ARGV[5])
+local oldest = current - window + 1
+
+local fields = redis.call('HGETALL', KEYS[1])
+local counts = {}
+local total = 0
+for i = 1, #fields, 2 do
+    local bucket = tonumber(fields[i])
+    if bucket < oldest then
+        redis.call('HDEL', KEYS[1], fields[i])
+    elseif bucket <= current then
+        local count = tonumber(fields[i + 1])
+        counts[bucket - oldest + 1] = count
+        total = total + count
+    end
+end
+
+local limited = 0
+local add = pending
+if request == 1 then
+    if total + pending + 1 > limit then
+        limited = 1
+    else
+        add = add + 1
+    end
+end
+if add > 0 then
+    redis.call('HINCRBY', KEYS[1], current, add)
+    counts[window] = (counts[window] or 0) + add
+    total = total + add
+end
+redis.call('PEXPIRE', KEYS[1], ARGV[6])
+
+local result = {limited, total}
+for i = 1, window do
+    result[i + 2] = counts[i] or 0
+end
+return result
+"""
+
+
+@dataclass
+class RateLimitResult:
+    """
+    Outcome of a single rate limit check.
+
+    :param limited: True if the request must be rejected.
+    :param limit: Allowed requests per period.
+    :param remaining: Requests left in the current period.
+    :param reset: Seconds until the quota is fully restored.
+    :param retry_after: Seconds until the next request is allowed, 0 if it is allowed now.
+    """
+    limited: bool
+    limit: int
+    remaining: int
+    reset: float
+    retry_after: float = 0.0
+
+    def headers(self) -> dict[str, str]:
+        """
+        Builds `RateLimit-*` response headers for the result.
+
+        :return: A dict of HTTP headers.
+        """
+        headers = {
+            'RateLimit-Limit': str(self.limit),
+            'RateLimit-Remaining': str(max(self.remaining, 0)),
+            'RateLimit-Reset': str(math.ceil(self.reset)),
+        }
+        if self.limited:
+            headers['Retry-After'] = str(math.ceil(self.retry_after))
+        return headers
+
+
+class RateLimitEngine(ABC):
+    """
+    Base class for rate limiting algorithms backed by Redis.
+
+    :param redis: Redis client instance for data storage and retrieval.
+    :param config: Configuration settings for rate limiting.
+    """
+    # Interval of `flush` calls in seconds, None if the engine keeps no local state.
+    flush_interval: float | None = None
+
+    def __init__(self, redis: Redis, config: RateLimitConfig):
+        self.redis = redis
+        self.config = config
+
+    async def load(self) -> None:
+        """
+        Prepares server-side resources of the engine (e.g. preloads scripts). Called once on startup.
+        """
+        pass
+
+    async def flush(self) -> None:
+        """
+        Pushes requests counted locally to Redis. Called every `flush_interval` seconds.
+        """
+        pass
+
+    @abstractmethod
+    async def check(self, key: str, limit: int, period: int) -> RateLimitResult:
+        """
+        Registers a request for the key and checks whether it exceeds the limit.
+
+        :param key: The key to identify the rate limit context.
+        :param limit: Allowed requests per period.
+        :param period: Period length in seconds.
+        :return: The result of the check.
+        """
+        pass
+
+
+class ScriptRateLimitEngine(RateLimitEngine):
+    """
+    Engine executing its whole algorithm in a single server-side Lua script call (EVALSHA).
+    The script returns {limited, remaining, reset, retry_after}.
+    """
+    script: str = ''
+
+    def __init__(self, redis: Redis, config: RateLimitConfig):
+        super().__init__(redis, config)
+        self._script = redis.register_script(self.script)
+
+    async def load(self) -> None:
+        await self.redis.script_load(self.script)
+
+    async def check(self, key: str, limit: int, period: int) -> RateLimitResult:
+        limited, remaining, reset, retry_after = await self._script(keys=[key], args=[limit, period, 1])
+        return RateLimitResult(limited=bool(limited),
+                               limit=limit,
+                               remaining=int(remaining),
+                               reset=float(reset),
+                               retry_after=float(retry_after))
+
+
+class GcraRateLimitEngine(ScriptRateLimitEngine):
+    """
+    Generic cell rate algorithm. Stores a single float per key.
+    """
+    script = GCRA_SCRIPT
+
+
+class TokenBucketRateLimitEngine(ScriptRateLimitEngine):
+    """
+    Token bucket algorithm. Stores a two-field hash per key.
+    """
+    script = TOKEN_BUCKET_SCRIPT
+
+
+class SlidingWindowRateLimitEngine(RateLimitEngine):
+    """
+    Sliding window log on a sorted set. Stores one member per request in the window.
+    """
+    async def check(self, key: str, limit: int, period: int) -> RateLimitResult:
+        current = time.time()
+        async with self.redis.pipeline() as pipe:
+            pipe.zremrangebyscore(key, 0, current - period)
+            pipe.zadd(key, {f'{current}:{uuid.uuid4().hex}': current})
+            pipe.zcard(key)
+            pipe.zrange(key, 0, 0, withscores=True)
+            pipe.expire(key, period)
+            _, _, count, oldest, _ = await pipe.execute()
+        reset = oldest[0][1] + period - current if oldest else 0.0
+        return RateLimitResult(limited=count > limit,
+                               limit=limit,
+                               remaining=limit - count,
+                               reset=reset,
+                               retry_after=reset if count > limit else 0.0)
+
+
+class LocalWindow:
+    """
+    Per-worker approximation of a key's sliding window.
+
+    Bucket counts live in a ring of compact arrays indexed by `bucket % size`, so old buckets fall out of the
+    window without any bookkeeping. Counts are overwritten with the global ones from Redis on every sync,
+    locally admitted requests are added on top and kept in `pending` until the next sync.
+
+    :param size: Amount of buckets in the window.
+    """
+    __slots__ = ('size', 'counts', 'buckets', 'pending', 'synced_at', 'limit', 'period')
+
+    def __init__(self, size: int):
+        self.size = size
+        self.counts = array('L', [0] * size)
+        self.buckets = array('q', [-1] * size)
+        self.pending = 0
+        self.synced_at = 0.0
+        self.limit = 0
+        self.period = 0
+
+    def add(self, bucket: int, count: int) -> None:
+        """
+        Adds requests to the bucket.
+
+        :param bucket: The bucket number.
+        :param count: The amount of requests.
+        """
+        slot = bucket % self.size
+        if self.buckets[slot] != bucket:
+            self.buckets[slot] = bucket
+            self.counts[slot] = 0
+        self.counts[slot] += count
+
+    def load(self, current: int, counts: list[int]) -> None:
+        """
+        Replaces the window with global bucket counts.
+
+        :param current: The current bucket number.
+        :param counts: Counts ordered from the oldest bucket of the window to the current one.
+        """
+        oldest = current - self.size + 1
+        for offset, count in enumerate(counts):
+            bucket = oldest + offset
+            slot = bucket % self.size
+            self.buckets[slot] = bucket
+            self.counts[slot] = int(count)
+
+    def total(self, current: int) -> int:
+        """
+        Sums requests of the buckets which are still inside the window.
+
+        :param current: The current bucket number.
+        :return: Estimated amount of requests in the window.
+        """
+        oldest = current - self.size + 1
+        return sum(count for bucket, count in zip(self.buckets, self.counts) if bucket >= oldest)
+
+    def oldest_bucket(self, current: int) -> int | None:
+        """
+        Returns the oldest non-empty bucket inside the window.
+
+        :param current: The current bucket number.
+        :return: The bucket number, or None if the window is empty.
+        """
+        oldest = current - self.size + 1
+        buckets = [bucket for bucket, count in zip(self.buckets, self.counts) if bucket >= oldest and count]
+        return min(buckets) if buckets else None
+
+
+class HybridRateLimitEngine(RateLimitEngine):
+    """
+    Two-tier limiter: requests are admitted against a local window estimate and their count is synced
+    to a bucketed sliding window in Redis every sync batch of requests or `hybrid_sync_interval_ms`, pending
+    requests of idle keys are pushed by `flush`. Keys seen for the first time and keys whose estimate gets close
+    to the limit are checked strictly in Redis.
+
+    Every worker may admit a sync batch per key on a global count that is stale for all of them, so the batch
+    is `min(hybrid_sync_requests, limit * hybrid_error_bound / hybrid_workers)`: the requests of all workers
+    between syncs fit in the error bound reserve (give or take the ones admitted while a sync is in flight).
+    Limits too small for a batch of one request per worker are checked strictly in Redis on every request.
+    """
+    def __init__(self, redis: Redis, config: RateLimitConfig):
+        super().__init__(redis, config)
+        self._script = redis.register_script(HYBRID_SYNC_SCRIPT)
+        self._windows: OrderedDict[str, LocalWindow] = OrderedDict()
+        self.flush_interval = config.hybrid_sync_interval_ms / 1000
+        self.local_checks = 0
+        self.redis_checks = 0
+
+    def sync_batch(self, limit: int) -> int:
+        """
+        Returns the max amount of requests of a key a worker admits locally between syncs.
+
+        :param limit: Allowed requests per period.
+        :return: The batch size, 0 if every request must be checked in Redis.
+        """
+        share = int(limit * self.config.hybrid_error_bound / self.config.hybrid_workers)
+        return min(self.config.hybrid_sync_requests, share)
+
+    async def load(self) -> None:
+        await self.redis.script_load(HYBRID_SYNC_SCRIPT)
+
+    def _get_window(self, key: str) -> LocalWindow:
+        """
+        Returns the local window of the key, evicting the least recently used one when the cache is full.
+        Requests pending in an evicted window are never synced.
+
+        :param key: The key to identify the rate limit context.
+        :return: The local window.
+        """
+        window = self._windows.get(key)
+        if window is None:
+            window = LocalWindow(self.config.hybrid_buckets)
+            self._windows[key] = window
+            if len(self._windows) > self.config.hybrid_max_keys:
+                self._windows.popitem(last=False)
+        else:
+            self._windows.move_to_end(key)
+        return window
+
+    async def _sync(self, key: str, window: LocalWindow, current: int, request: bool,
+                    limit: int, period: int) -> bool:
+        """
+        Pushes pending requests to Redis and loads global bucket counts into the local window.
+
+        :param request: If True, the current request is checked strictly against the limit in Redis.
+        :return: True if the current request is limited.
+        """
+        pending, window.pending = window.pending, 0
+        try:
+            limited, _, *counts = await self._script(
+                keys=[key],
+                args=[current, window.size, pending, int(request), limit, period * 1000]
+            )
+        except RedisError:
+            window.pending += pending
+            raise
+        window.load(current, counts)
+        # Requests admitted locally while the sync was in flight are not in the global counts yet.
+        window.add(current, window.pending)
+        window.synced_at = time.monotonic()
+        return bool(limited)
+
+    async def check(self, key: str, limit: int, period: int) -> RateLimitResult:
+        bucket_seconds = period / self.config.hybrid_buckets
+        now = time.time()
+        current = int(now // bucket_seconds)
+        window = self._get_window(key)
+
+        window.limit, window.period = limit, period
+        batch = self.sync_batch(limit)
+        local_threshold = limit * (1 - self.config.hybrid_error_bound)
+        if batch and window.synced_at and window.total(current) + 1 <= local_threshold:
+            self.local_checks += 1
+            limited = False
+            window.add(current, 1)
+            window.pending += 1
+            if window.pending >= batch or time.monotonic() - window.synced_at >= self.flush_interval:
+                await self._sync(key, window, current, False, limit, period)
+        else:
+            self.redis_checks += 1
+            limited = await self._sync(key, window, current, True, limit, period)
+
+        total = window.total(current)
+        oldest = window.oldest_bucket(current)
+        reset = (oldest + self.config.hybrid_buckets) * bucket_seconds - now if oldest is not None else 0.0
+        return RateLimitResult(limited=limited,
+                               limit=limit,
+                               remaining=limit - total,
+                               reset=reset,
+                               retry_after=reset if limited else 0.0)
+
+    async def flush(self) -> None:
+        """
+        Pushes requests pending for `hybrid_sync_interval_ms` or longer, e.g. of keys without further requests,
+        which would otherwise stay out of the global count.
+        """
+        for key, window in list(self._windows.items()):
+            if not window.pending or time.monotonic() - window.synced_at < self.flush_interval:
+                continue
+            current = int(time.time() // (window.period / self.config.hybrid_buckets))
+            try:
+                await self._sync(key, window, current, False, window.limit, window.period)
+            except RedisError as e:
+                logger.warning(f"Can't flush pending rate limit counts: {e}")
+                return
+
+
+class RateLimitEngineFactory:
+    """
+    Factory class for creating rate limiting engines.
+    Manages the registration and instantiation of various algorithms.
+    """
+    _engines: dict[str, type[RateLimitEngine]] = {}
+
+    @classmethod
+    def register_engine(cls, algorithm: str, engine_class: type[RateLimitEngine]) -> None:
+        """
+        Registers a new rate limiting algorithm and its corresponding class.
+
+        :param algorithm: The name of the algorithm.
+        :param engine_class: The class implementing the algorithm.
+        """
+        cls._engines[algorithm] = engine_class
+
+    @classmethod
+    def create_engine(cls, algorithm: str, redis: Redis, config: RateLimitConfig) -> RateLimitEngine:
+        """
+        Creates and returns an instance of the specified rate limiting engine.
+
+        :param algorithm: The name of the algorithm.
+        :param redis: Redis client instance.
+        :param config: Configuration settings for rate limiting.
+        :return: An instance of the specified engine.
+        """
+        engine_class = cls._engines.get(algorithm)
+        if engine_class is None:
+            raise ValueError(f"Unknown rate limit algorithm: {algorithm}")
+        return engine_class(redis, config)
+
+
+RateLimitEngineFactory.register_engine('gcra', GcraRateLimitEngine)
+RateLimitEngineFactory.register_engine('token_bucket', TokenBucketRateLimitEngine)
+RateLimitEngineFactory.register_engine('sliding_window', SlidingWindowRateLimitEngine)
+RateLimitEngineFactory.register_engine('hybrid', HybridRateLimitEngine)
+
 
 class RateLimiter:
     """
@@ -26,6 +497,37 @@ class RateLimiter:
     def __init__(self, config: RateLimitConfig, redis):
         self.config = config
         self.redis = redis
+        self.engine = RateLimitEngineFactory.create_engine(config.algorithm, redis, config)
+
+    def get_limit(self, key: str) -> int:
+        """
+        Returns the allowed amount of requests per period for the key.
+
+        :param key: The key to identify the rate limit context.
+        :return: Allowed requests per period.
+        """
+        if 'auth' in key.split(':'):
+            return self.config.times
+        return self.config.times_anonymous
+
+    @timed(rate_limit_check_seconds)
+    async def check(self, key: str) -> RateLimitResult | None:
+        """
+        Registers a request for the key and checks it against the limit.
+
+        :param key: The key to identify the rate limit context (e.g., user ID or IP).
+        :return: The result of the check, or None if Redis is unavailable.
+        """
+        try:
+            result = await self.engine.check(key, self.get_limit(key), self.config.seconds)
+        except RedisError as e:
+            # Logged for every request while Redis is down.
+            sampled_logger.error("Redis error encountered: {}", e)
+            rate_limit_decisions.inc('error')
+            return None
+        rate_limit_decisions.inc('limited' if result.limited else 'allowed')
+        sampled_logger.debug("Rate Limited {} {}", key, result)
+        return result
 
     async def is_rate_limited(self, key: str) -> bool:
         """
@@ -34,24 +536,8 @@ class RateLimiter:
         :param key: The key to identify the rate limit context (e.g., user ID or IP).
         :return: True if rate limited, False otherwise.
         """
-        current = int(time.time())
-        print(current)
-        window_start = current - self.config.seconds
-        async with self.redis.pipeline() as pipe:
-            try:
-                pipe.zremrangebyscore(key, 0, window_start)
-                pipe.zcard(key)
-                pipe.zadd(key, {current: current})
-                pipe.expire(key, self.config.seconds)
-                results = await pipe.execute()
-            except RedisError as e:
-                logger.error(f"Redis error encountered: {e}")
-                pass
-        logger.debug(f"Rate Limited {key} {results}")
-        if 'auth' in key.split(':'):
-            return results[1] > self.config.times
-        else:
-            return results[1] > self.config.times_anonymous
+        result = await self.check(key)
+        return result is not None and result.limited
 
 
 @lru_cache
@@ -83,32 +569,44 @@ async def get_optional_credentials(request: Request,
 
 
 async def rate_limit_dependency(request: Request,
+                                response: Response,
                                 credentials: HTTPAuthorizationCredentials | None = Depends(get_optional_credentials),
-                                cache: CacheBackend = Depends(get_cache),
+                                denylist: TokenDenylist = Depends(get_token_denylist),
                                 rate_limiter: RateLimiter = Depends(get_rate_limiter),
                                 token_service: TokenService = Depends(get_token_service)
                                 ) -> None:
     """
-     Enforces rate limiting on the endpoint using user identification from JWT or IP address and user agent.
+     Enforces rate limiting on the endpoint using user identification from JWT or IP address and a digest
+     of the raw User-Agent header, which is never parsed here.
+     Adds `RateLimit-*` headers to the response.
 
      :param request: The current HTTP request to determine the user's IP and user agent.
+     :param response: The response to add rate limit headers to.
      :param credentials: Optional JWT credentials for the user, used for user identification.
-     :param cache: Backend cache service to check for existing rate limit data.
+     :param denylist: Denylist of revoked access tokens.
      :param rate_limiter: The rate limiting service to enforce request limits.
      :param token_service: Service to decode JWT tokens for user identification.
      """
+    if not rate_limiter.config.is_on:
+        return
     successful_decode = False
-    if credentials and hasattr(credentials, 'credentials') and not await cache.get(credentials.credentials):
+    if credentials and hasattr(credentials, 'credentials'):
         try:
-            user_id = token_service.decode_jwt(credentials.credentials)['sub']
-            user_id = f"auth:{user_id}"
-            successful_decode = True
+            access_token_decoded = token_service.decode_jwt(credentials.credentials)
+            if not await denylist.is_access_token_revoked(access_token_decoded):
+                user_id = f"auth:{access_token_decoded['sub']}"
+                successful_decode = True
         except Exception:
             pass
     if not successful_decode:
         ip_address = get_ip_address(request)
-        user_agent = get_user_agent(request)
+        user_agent = get_user_agent_key(request)
         user_id = f"anonym:{ip_address}:{user_agent}"
-    key = f"rate_limit:{request.url.path}:{user_id}"
-    if await rate_limiter.is_rate_limited(key):
-        raise HTTPException(status_code=HTTPStatus.TOO_MANY_REQUESTS, detail="Too many requests")
+    key = f"rate_limit:{rate_limiter.config.algorithm}:{request.url.path}:{user_id}"
+    result = await rate_limiter.check(key)
+    if result is None:
+        return
+    if result.limited:
+        raise HTTPException(status_code=HTTPStatus.TOO_MANY_REQUESTS, detail="Too many requests",
+                            headers=result.headers())
+    response.headers.update(result.headers())
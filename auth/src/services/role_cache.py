@@ -0,0 +1,293 @@
+import asyncio
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Awaitable, Callable
+from uuid import UUID
+
+from redis.asyncio import Redis, RedisError
+
+from src.core.config import RoleCacheConfig, get_role_cache_config
+from src.core.logger import logger
+from src.services.single_flight import get_single_flight
+
+CATALOG_MESSAGE = 'catalog'
+USER_MESSAGE_PREFIX = 'user:'
+
+
+@dataclass(frozen=True)
+class CachedRole:
+    """
+    Immutable copy of a role row, safe to share between requests of a worker.
+
+    :param id: The UUID of the role.
+    :param name: The name of the role.
+    :param description: The description of the role.
+    """
+    id: UUID
+    name: str
+    description: str | None
+
+
+class RoleCatalog:
+    """
+    All roles of the system, indexed by id and by name. The catalog is small and rarely changes,
+    so it's loaded with a single query and kept until invalidated or older than `ttl`.
+
+    :param ttl: Max age of the catalog, in seconds.
+    """
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+        self.by_id: dict[UUID, CachedRole] = {}
+        self.by_name: dict[str, CachedRole] = {}
+        self.loaded_at: float | None = None
+
+    def is_fresh(self) -> bool:
+        return self.loaded_at is not None and time.monotonic() - self.loaded_at < self.ttl
+
+    def fill(self, roles: list[CachedRole]):
+        self.by_id = {role.id: role for role in roles}
+        self.by_name = {role.name: role for role in roles}
+        self.loaded_at = time.monotonic()
+
+    def clear(self):
+        self.loaded_at = None
+
+
+class UserRolesCache:
+    """
+    LRU cache of user role id sets with a TTL.
+
+    :param max_size: Max amount of cached users.
+    :param ttl: Max age of an entry, in seconds.
+    """
+    def __init__(self, max_size: int, ttl: int):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries: OrderedDict[str, tuple[float, frozenset[UUID]]] = OrderedDict()
+
+    def get(self, user_id: str) -> frozenset[UUID] | None:
+        entry = self.entries.get(user_id)
+        if entry is None:
+            return None
+        expires_at, role_ids = entry
+        if expires_at < time.monotonic():
+            del self.entries[user_id]
+            return None
+        self.entries.move_to_end(user_id)
+        return role_ids
+
+    def set(self, user_id: str, role_ids: frozenset[UUID]):
+        self.entries[user_id] = (time.monotonic() + self.ttl, role_ids)
+        self.entries.move_to_end(user_id)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def discard(self, user_id: str):
+        self.entries.pop(user_id, None)
+
+    def clear(self):
+        self.entries.clear()
+
+
+class RoleCache:
+    """
+    Per-worker cache of the role catalog and of user role sets.
+
+    Changes are published to a Redis pub/sub channel, every worker listens to it and drops the affected entries.
+    A generation counter is bumped on every invalidation, so a value loaded while an invalidation arrived
+    is not stored. The TTLs bound staleness if a message is lost, the whole cache is dropped on reconnect.
+
+    :param config: Role cache configuration settings.
+    """
+    def __init__(self, config: RoleCacheConfig):
+        self.config = config
+        self.catalog = RoleCatalog(config.catalog_ttl)
+        self.user_roles = UserRolesCache(config.user_roles_max_size, config.user_roles_ttl)
+        self.generation = 0
+        self.redis: Redis | None = None
+        self.catalog_hits = 0
+        self.catalog_misses = 0
+        self.user_roles_hits = 0
+        self.user_roles_misses = 0
+        self.invalidations = 0
+        self.invalidated_at = 0.0
+        self._catalog_lock = asyncio.Lock()
+        self._user_roles_flight = get_single_flight('user_role_ids')
+        self._task: asyncio.Task | None = None
+
+    async def get_catalog(self, load: Callable[[], Awaitable[list[CachedRole]]]) -> RoleCatalog:
+        """
+        Returns the role catalog, loading it if it's missing or expired.
+
+        :param load: Coroutine function returning all roles.
+        :return: The role catalog.
+        """
+        if self.config.is_on and self.catalog.is_fresh():
+            self.catalog_hits += 1
+            return self.catalog
+        async with self._catalog_lock:
+            # Concurrent requests of the worker wait for a single load.
+            if self.config.is_on and self.catalog.is_fresh():
+                self.catalog_hits += 1
+                return self.catalog
+            self.catalog_misses += 1
+            generation = self.generation
+            roles = await load()
+            catalog = RoleCatalog(self.config.catalog_ttl)
+            catalog.fill(roles)
+            if self.config.is_on and generation == self.generation:
+                self.catalog = catalog
+            return catalog
+
+    async def get_user_role_ids(self, user_id: UUID | str,
+                                load: Callable[[], Awaitable[frozenset[UUID]]]) -> frozenset[UUID]:
+        """
+        Returns role ids of a user, loading them on a cache miss.
+
+        :param user_id: The UUID of the user.
+        :param load: Coroutine function returning role ids of the user. Its call is shared with concurrent
+            callers and outlives a cancelled caller, so it must not use the session of a request.
+        :return: A set of role ids.
+        """
+        if self.config.is_on:
+            role_ids = self.user_roles.get(str(user_id))
+            if role_ids is not None:
+                self.user_roles_hits += 1
+                return role_ids
+        self.user_roles_misses += 1
+        generation = self.generation
+        # Concurrent misses of a user share one load, unless an invalidation came in between.
+        role_ids = await self._user_roles_flight.do((str(user_id), generation), load)
+        if self.config.is_on and generation == self.generation:
+            self.user_roles.set(str(user_id), role_ids)
+        return role_ids
+
+    async def get_many_user_role_ids(
+            self, user_ids: list[str],
+            load: Callable[[list[str]], Awaitable[dict[str, frozenset[UUID]]]]) -> dict[str, frozenset[UUID]]:
+        """
+        Returns role ids of several users, loading all cache misses at once.
+
+        :param user_ids: UUIDs of the users.
+        :param load: Coroutine function returning role ids of the given users.
+        :return: A dict of role id sets by user id.
+        """
+        result = {}
+        missing = []
+        for user_id in user_ids:
+            role_ids = self.user_roles.get(user_id) if self.config.is_on else None
+            if role_ids is None:
+                missing.append(user_id)
+            else:
+                result[user_id] = role_ids
+        self.user_roles_hits += len(result)
+        if missing:
+            self.user_roles_misses += len(missing)
+            generation = self.generation
+            loaded = await load(missing)
+            for user_id in missing:
+                result[user_id] = loaded.get(user_id, frozenset())
+                if self.config.is_on and generation == self.generation:
+                    self.user_roles.set(user_id, result[user_id])
+        return result
+
+    def invalidated_within(self, seconds: float) -> bool:
+        """
+        Checks if the cache was invalidated recently, e.g. to load from the primary while replicas may lag.
+
+        :param seconds: Length of the period.
+        :return: True if an invalidation happened within the last `seconds`.
+        """
+        return time.monotonic() - self.invalidated_at < seconds
+
+    def invalidate_local(self, message: str):
+        """
+        Drops cache entries of this worker.
+
+        :param message: 'catalog' to drop everything, 'user:<id>' to drop role ids of a user.
+        """
+        self.generation += 1
+        self.invalidations += 1
+        self.invalidated_at = time.monotonic()
+        if message.startswith(USER_MESSAGE_PREFIX):
+            self.user_roles.discard(message[len(USER_MESSAGE_PREFIX):])
+        else:
+            self.catalog.clear()
+            self.user_roles.clear()
+
+    async def invalidate(self, user_id: UUID | str | None = None):
+        """
+        Drops cache entries in this worker and publishes the invalidation to all other workers.
+
+        :param user_id: The UUID of the user whose roles changed, None if the catalog changed.
+        """
+        message = CATALOG_MESSAGE if user_id is None else f'{USER_MESSAGE_PREFIX}{user_id}'
+        self.invalidate_local(message)
+        if self.redis is None:
+            return
+        try:
+            await self.redis.publish(self.config.channel, message)
+        except RedisError as e:
+            logger.error(f"Can't publish roles cache invalidation {message}: {e}")
+
+    async def _listen(self):
+        while True:
+            pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(self.config.channel)
+                # Messages published while unsubscribed are lost.
+                self.invalidate_local(CATALOG_MESSAGE)
+                async for message in pubsub.listen():
+                    data = message['data']
+                    self.invalidate_local(data.decode() if isinstance(data, bytes) else data)
+            except RedisError as e:
+                logger.error(f"Roles cache invalidation listener failed: {e}")
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.close()
+
+    def start(self, redis: Redis):
+        """
+        Starts listening to invalidations published by other workers.
+
+        :param redis: Redis client.
+        """
+        self.redis = redis
+        if self._task is None:
+            self._task = asyncio.create_task(self._listen())
+
+    async def close(self):
+        """
+        Stops listening to invalidations.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self.redis = None
+
+    def stats(self) -> dict:
+        """
+        Returns cache counters of this worker.
+
+        :return: A dict of counters.
+        """
+        return {
+            'catalog_hits': self.catalog_hits,
+            'catalog_misses': self.catalog_misses,
+            'user_roles_hits': self.user_roles_hits,
+            'user_roles_misses': self.user_roles_misses,
+            'user_roles_size': len(self.user_roles.entries),
+            'invalidations': self.invalidations,
+        }
+
+
+@lru_cache()
+def get_role_cache() -> RoleCache:
+    """
+    Provides the process-wide RoleCache.
+
+    :return: An instance of RoleCache.
+    """
+    return RoleCache(get_role_cache_config())
@@ -1,19 +1,56 @@
+import secrets
+from datetime import datetime
 from functools import lru_cache
 from http import HTTPStatus
+from typing import AsyncIterator
 from uuid import UUID
 
 from fastapi import Depends, HTTPException
-from sqlalchemy import select
+from redis.asyncio import RedisError
+from sqlalchemy import column, delete, literal, select, values
+from sqlalchemy.dialects.postgresql import UUID as PG_UUID
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.core.config import FastApiConf, get_config
+from src.api.v1.models.entity import UserFilter
+from src.core.config import (DbReplicaConf, FastApiConf, get_config,
+                             get_db_replica_config)
 from src.core.logger import logger
-from src.db.postgres import get_session
+from src.core.metrics import auth_operation_seconds, timed
+from src.db.cache import CacheBackend, get_cache
+from src.db.postgres import (async_session, get_read_session,
+                             get_read_session_factory, get_session)
 from src.models.entity import Role, User, UserRoles
+from src.services.role_cache import CachedRole, RoleCache, get_role_cache
+from src.services.single_flight import get_single_flight
 from src.services.token import TokenService, get_token_service
 
 
+ROLES_VERSION_GLOBAL_KEY = 'roles_version:global'
+ROLES_VERSION_USER_KEY = 'roles_version:user:{user_id}'
+
+
+def new_roles_version_part() -> str:
+    """
+    Generates a roles version part. Parts are random rather than counters, so they are not reused
+    after the cache loses them.
+    """
+    return secrets.token_hex(8)
+
+
+def join_roles_version(global_version: bytes | str | None, user_version: bytes | str | None) -> str | None:
+    """
+    Builds the roles version '<global>.<user>' from its parts as read from the cache.
+
+    :return: The roles version, None if any part is missing.
+    """
+    if global_version is None or user_version is None:
+        return None
+    parts = [part.decode() if isinstance(part, bytes) else part for part in (global_version, user_version)]
+    return '.'.join(parts)
+
+
 class RoleAlreadyExistsException(HTTPException):
     pass
 
@@ -26,17 +63,40 @@ class RoleService:
     """
     Service class for managing roles in the application.
 
+    Access tokens carry the user's role names (`roles`) and the roles version (`rv`) they were issued with.
+    The version is kept in the cache as '<global>.<user>': the user part is replaced with a new random value when
+    the user's roles change, the global part when a role is deleted. Claims of a token with the current version
+    are trusted without querying the database. Random parts are never reused, so claims can't become current again
+    after the cache loses the keys: a missing part means the version is unknown and roles are queried.
+
+    Roles and user role sets are read through the per-worker role cache, changes invalidate it in all workers.
+    Cache misses are loaded through the read-only session, except right after an invalidation,
+    when a lagging replica could still return the old roles.
+
     :param db_session: The database session to use for queries.
+    :param read_db_session: The database session for read-only queries, possibly on a read replica.
+    :param cache_service: Service for caching, keeps roles versions.
     :param token_service: The service for handling JWT tokens.
+    :param role_cache: Per-worker cache of roles and user role sets.
     :param admin_login: The login identifier for the admin user.
+    :param replica_max_lag: Max lag of the read replica in seconds, reads after an invalidation wait it out.
+        It includes the lag check interval, the lag the router trusts may be that old.
     """
 
     def __init__(self, db_session: AsyncSession,
+                 read_db_session: AsyncSession,
+                 cache_service: CacheBackend,
                  token_service: TokenService,
-                 admin_login: str
+                 role_cache: RoleCache,
+                 admin_login: str,
+                 replica_max_lag: float = 0.0
                  ):
         self.db = db_session
+        self.read_db = read_db_session
+        self.replica_max_lag = replica_max_lag
+        self.cache_service = cache_service
         self.token_service = token_service
+        self.role_cache = role_cache
         self.admin_login = admin_login
         self.admin_user_id = None
         self.admin_role_id = None
@@ -50,7 +110,7 @@ class RoleService:
         :return: The newly created Role object.
         """
         access_token_decoded = self.token_service.decode_jwt(access_token)
-        if not await self.is_admin(user_id=access_token_decoded['sub']):
+        if not await self.is_admin_by_token(access_token_decoded):
             raise HTTPException(status_code=HTTPStatus.FORBIDDEN,
                                 detail="You do not have permission to perform this action")
 
@@ -62,6 +122,7 @@ class RoleService:
             logger.error(f"User creation failed, user already exists: {role.name}")
             raise RoleAlreadyExistsException(status_code=HTTPStatus.CONFLICT, detail="Role already exists")
         await self.db.refresh(role)
+        await self.role_cache.invalidate()
         logger.info(f'Create new role: {role.name}')
         return role
 
@@ -78,15 +139,17 @@ class RoleService:
                                 detail="Deleting the admin role is forbidden")
 
         access_token_decoded = self.token_service.decode_jwt(access_token)
-        if not await self.is_admin(user_id=access_token_decoded['sub']):
+        if not await self.is_admin_by_token(access_token_decoded):
             raise HTTPException(status_code=HTTPStatus.FORBIDDEN,
                                 detail="You do not have permission to perform this action")
 
         role = await self.db.get(Role, role_id)
-        if not role:
-            return
-        await self.db.delete(role)
-        await self.db.commit()
+        if role:
+            await self.db.delete(role)
+            await self.db.commit()
+            await self.role_cache.invalidate()
+        # Also bumped if the role is gone, so a retry after a failed bump invalidates the claims.
+        await self.bump_roles_version()
 
     async def assign_role_to_user(self, user_id: UUID, role_id: UUID, access_token: str):
         """
@@ -97,7 +160,7 @@ class RoleService:
         :param access_token: JWT access token to authenticate the user.
         """
         access_token_decoded = self.token_service.decode_jwt(access_token)
-        if not await self.is_admin(user_id=access_token_decoded['sub']):
+        if not await self.is_admin_by_token(access_token_decoded):
             raise HTTPException(status_code=HTTPStatus.FORBIDDEN,
                                 detail="You do not have permission to perform this action")
 
@@ -115,6 +178,8 @@ class RoleService:
             await self.db.rollback()
             raise HTTPException(status_code=HTTPStatus.INTERNAL_SERVER_ERROR,
                                 detail="Error while assigning role to user")
+        await self.role_cache.invalidate(user_id)
+        await self.bump_roles_version(user_id)
 
     async def detach_role_from_user(self, user_id: UUID, role_id: UUID, access_token: str):
         """
@@ -131,7 +196,7 @@ class RoleService:
                                 detail="Deleting the admin role from admin user is forbidden")
 
         access_token_decoded = self.token_service.decode_jwt(access_token)
-        if not await self.is_admin(user_id=access_token_decoded['sub']):
+        if not await self.is_admin_by_token(access_token_decoded):
             raise HTTPException(status_code=HTTPStatus.FORBIDDEN,
                                 detail="You do not have permission to perform this action")
 
@@ -140,66 +205,360 @@ class RoleService:
             UserRoles.role_id == role_id)
         )
         user_role = user_role.scalars().first()
-        if not user_role:
-            return
+        if user_role:
+            await self.db.delete(user_role)
+            await self.db.commit()
+            await self.role_cache.invalidate(user_id)
+        # Also bumped if the role is already detached, so a retry after a failed bump invalidates the claims.
+        await self.bump_roles_version(user_id)
+
+    async def require_admin(self, access_token: str):
+        """
+        Checks that the token owner is an admin.
+
+        :param access_token: JWT access token to authenticate the user.
+        :raises HTTPException: If the user is not an admin.
+        """
+        access_token_decoded = self.token_service.decode_jwt(access_token)
+        if not await self.is_admin_by_token(access_token_decoded):
+            raise HTTPException(status_code=HTTPStatus.FORBIDDEN,
+                                detail="You do not have permission to perform this action")
+
+    @staticmethod
+    async def iter_pair_chunks(pairs: list[tuple[UUID, UUID]],
+                               chunk_size: int) -> AsyncIterator[list[tuple[UUID, UUID]]]:
+        """
+        Splits explicit (user_id, role_id) pairs into chunks.
+
+        :param pairs: The pairs.
+        :param chunk_size: Max amount of pairs in a chunk.
+        :return: An async iterator of chunks.
+        """
+        for i in range(0, len(pairs), chunk_size):
+            yield pairs[i:i + chunk_size]
+
+    async def iter_filtered_pair_chunks(self, role_id: UUID, user_filter: UserFilter | None, chunk_size: int,
+                                        with_role: bool = False) -> AsyncIterator[list[tuple[UUID, UUID]]]:
+        """
+        Pairs a role with users matching a filter, in chunks. Users are paged by id, so users changed
+        between chunks are neither skipped nor repeated.
+
+        :param role_id: The UUID of the role.
+        :param user_filter: Conditions on users, None for all users.
+        :param chunk_size: Max amount of pairs in a chunk.
+        :param with_role: True to take only users having the role, e.g. to detach it.
+        :return: An async iterator of chunks.
+        """
+        conditions = []
+        if user_filter is not None:
+            if user_filter.login_prefix is not None:
+                conditions.append(User.login.startswith(user_filter.login_prefix, autoescape=True))
+            if user_filter.email_domain is not None:
+                conditions.append(User.email.endswith(f'@{user_filter.email_domain}', autoescape=True))
+            if user_filter.created_after is not None:
+                conditions.append(User.created_at >= user_filter.created_after)
+            if user_filter.created_before is not None:
+                conditions.append(User.created_at < user_filter.created_before)
+            if user_filter.is_oauth2 is not None:
+                conditions.append(User.is_oauth2.is_(user_filter.is_oauth2))
+        if with_role:
+            conditions.append(User.id.in_(select(UserRoles.user_id).where(UserRoles.role_id == role_id)))
+        last_user_id = None
+        while True:
+            query = select(User.id).where(*conditions).order_by(User.id).limit(chunk_size)
+            if last_user_id is not None:
+                query = query.where(User.id > last_user_id)
+            user_ids = (await self.db.scalars(query)).all()
+            if not user_ids:
+                return
+            yield [(user_id, role_id) for user_id in user_ids]
+            last_user_id = user_ids[-1]
+
+    async def bulk_change_roles(self, chunks: AsyncIterator[list[tuple[UUID, UUID]]],
+                                assign: bool) -> AsyncIterator[dict]:
+        """
+        Assigns or detaches roles chunk by chunk, with one statement and one commit per chunk. Pairs with
+        unknown users or roles are skipped, as well as already assigned or missing ones. Role caches
+        and role claims of all users are invalidated once, after the last chunk. Claims are invalidated after
+        any detachment, even of missing roles, so a retry after a failed invalidation completes it.
+
+        :param chunks: Chunks of (user_id, role_id) pairs.
+        :param assign: True to assign roles, False to detach them.
+        :return: An async iterator of progress reports: pairs processed and changed so far.
+            The last report has `done` set, or `error` if a chunk failed, changes of previous chunks are kept.
+        """
+        admin_pair = None if assign else (await self._get_admin_user_id(), await self._get_admin_role_id())
+        processed = changed = 0
+        error = None
+        try:
+            async for chunk in chunks:
+                if admin_pair is not None:
+                    chunk = [pair for pair in chunk if pair != admin_pair]
+                try:
+                    if assign:
+                        changed += await self._insert_user_roles(chunk)
+                    else:
+                        changed += await self._delete_user_roles(chunk)
+                    await self.db.commit()
+                except SQLAlchemyError as e:
+                    await self.db.rollback()
+                    logger.error(f"Bulk role change failed after {processed} pairs: {e}")
+                    error = "Error while changing roles"
+                    break
+                processed += len(chunk)
+                yield {'processed': processed, 'changed': changed}
+        finally:
+            if changed:
+                await self.role_cache.invalidate()
+            if changed or not assign:
+                try:
+                    await self.bump_roles_version()
+                except HTTPException as e:
+                    error = e.detail
+            logger.info(f"Bulk role {'assignment' if assign else 'detachment'}: "
+                        f"{processed} pairs processed, {changed} changed")
+        if error is not None:
+            yield {'processed': processed, 'changed': changed, 'error': error}
+        else:
+            yield {'processed': processed, 'changed': changed, 'done': True}
+
+    @staticmethod
+    def _pairs_values(pairs: list[tuple[UUID, UUID]]):
+        return values(column('user_id', PG_UUID(as_uuid=True)),
+                      column('role_id', PG_UUID(as_uuid=True)),
+                      name='pairs').data(pairs)
+
+    async def _insert_user_roles(self, pairs: list[tuple[UUID, UUID]]) -> int:
+        """
+        Assigns roles with a single `INSERT ... SELECT ... ON CONFLICT DO NOTHING`.
+
+        :param pairs: (user_id, role_id) pairs.
+        :return: The number of assigned roles.
+        """
+        if not pairs:
+            return 0
+        pairs_values = self._pairs_values(pairs)
+        now = datetime.utcnow()
+        result = await self.db.execute(
+            insert(UserRoles)
+            .from_select(
+                ['user_id', 'role_id', 'created_at', 'updated_at'],
+                select(pairs_values.c.user_id, pairs_values.c.role_id, literal(now), literal(now))
+                .join(User, User.id == pairs_values.c.user_id)
+                .join(Role, Role.id == pairs_values.c.role_id)
+            )
+            .on_conflict_do_nothing()
+        )
+        return result.rowcount
+
+    async def _delete_user_roles(self, pairs: list[tuple[UUID, UUID]]) -> int:
+        """
+        Detaches roles with a single `DELETE ... USING`.
 
-        await self.db.delete(user_role)
-        await self.db.commit()
+        :param pairs: (user_id, role_id) pairs.
+        :return: The number of detached roles.
+        """
+        if not pairs:
+            return 0
+        pairs_values = self._pairs_values(pairs)
+        result = await self.db.execute(
+            delete(UserRoles)
+            .where(UserRoles.user_id == pairs_values.c.user_id, UserRoles.role_id == pairs_values.c.role_id)
+        )
+        return result.rowcount
 
-    async def get_roles_all(self) -> list[Role]:
+    async def get_roles_all(self) -> list[CachedRole]:
         """
-        Retrieves all roles from the database.
+        Retrieves all roles from the role catalog.
 
-        :return: A list of Role objects.
+        :return: A list of CachedRole objects.
         """
-        result = await self.db.execute(select(Role))
-        roles = result.scalars().all()
-        return roles if roles else []
+        catalog = await self.role_cache.get_catalog(self._load_roles)
+        return list(catalog.by_id.values())
 
-    async def get_role_by_id(self, role_id: UUID) -> Role | None:
+    async def get_role_by_id(self, role_id: UUID) -> CachedRole | None:
         """
         Retrieves a role by its UUID.
 
         :param role_id: The UUID of the role to be retrieved.
-        :return: A Role object if found, otherwise None.
+        :return: A CachedRole object if found, otherwise None.
         """
-        result = await self.db.execute(select(Role).where(Role.id == role_id))
-        return result.scalars().first()
+        catalog = await self.role_cache.get_catalog(self._load_roles)
+        return catalog.by_id.get(role_id)
 
-    async def get_role_by_name(self, role_name: str) -> Role | None:
+    async def get_role_by_name(self, role_name: str) -> CachedRole | None:
         """
         Retrieves a role by its name.
 
         :param role_name: The name of the role to be retrieved.
-        :return: A Role object if found, otherwise None.
+        :return: A CachedRole object if found, otherwise None.
         """
-        result = await self.db.execute(select(Role).where(Role.name == role_name))
-        return result.scalars().first()
+        catalog = await self.role_cache.get_catalog(self._load_roles)
+        return catalog.by_name.get(role_name)
 
-    async def get_roles_by_user_id(self, user_id: UUID, access_token: str) -> list[Role]:
+    async def get_roles_by_user_id(self, user_id: UUID, access_token: str) -> list[CachedRole]:
         """
         Retrieves roles associated with a specific user ID.
 
         :param user_id: The UUID of the user for whom to retrieve roles.
         :param access_token: JWT access token to authenticate the user.
-        :return: A list of Role objects associated with the user.
+        :return: A list of CachedRole objects associated with the user.
         """
         access_token_decoded = self.token_service.decode_jwt(access_token)
-        if access_token_decoded['sub'] != str(user_id) and not await self.is_admin(user_id=access_token_decoded['sub']):
+        if access_token_decoded['sub'] != str(user_id) and not await self.is_admin_by_token(access_token_decoded):
             raise HTTPException(status_code=HTTPStatus.FORBIDDEN,
                                 detail="You do not have permission to perform this action")
         return await self.get_roles_by_user_id_query(user_id)
 
-    async def get_roles_by_access_token(self, access_token: str) -> list[Role]:
+    async def get_roles_by_access_token(self, access_token: str) -> list[CachedRole]:
         """
          Retrieves roles associated with the user identified by the given access token.
 
          :param access_token: JWT access token to identify and authenticate the user.
-         :return: A list of Role objects associated with the user.
+         :return: A list of CachedRole objects associated with the user.
          """
         access_token_decoded = self.token_service.decode_jwt(access_token)
         return await self.get_roles_by_user_id_query(user_id=access_token_decoded['sub'])
 
+    @timed(auth_operation_seconds, 'access_roles')
+    async def get_role_names_by_access_token(self, access_token: str) -> list[str]:
+        """
+        Retrieves role names of the user identified by the given access token, from its claims when they are fresh.
+
+        :param access_token: JWT access token to identify and authenticate the user.
+        :return: A list of role names associated with the user.
+        """
+        return await self.get_role_names_by_token(self.token_service.decode_jwt(access_token))
+
+    async def get_role_names_by_token(self, access_token_decoded: dict) -> list[str]:
+        """
+        Retrieves role names of the token owner. Fresh role claims are used as is, otherwise roles are queried.
+
+        :param access_token_decoded: Decoded JWT access token.
+        :return: A list of role names associated with the user.
+        """
+        role_names = await self.get_role_names_from_claims(access_token_decoded)
+        if role_names is None:
+            roles = await self.get_roles_by_user_id_query(access_token_decoded['sub'])
+            role_names = [role.name for role in roles]
+        return role_names
+
+    async def get_role_names_by_tokens(self, access_tokens_decoded: list[dict]) -> list[list[str]]:
+        """
+        Retrieves role names of the owners of several tokens with one cache call for roles versions
+        and at most one query for role sets missing from the role cache.
+
+        :param access_tokens_decoded: Decoded JWT access tokens.
+        :return: A list of role names for each token.
+        """
+        role_names: list[list[str] | None] = [None] * len(access_tokens_decoded)
+        with_claims = [i for i, claims in enumerate(access_tokens_decoded) if 'roles' in claims and 'rv' in claims]
+        if with_claims:
+            user_ids = list(dict.fromkeys(str(access_tokens_decoded[i]['sub']) for i in with_claims))
+            try:
+                global_version, *user_versions = await self.cache_service.mget(
+                    [ROLES_VERSION_GLOBAL_KEY]
+                    + [ROLES_VERSION_USER_KEY.format(user_id=user_id) for user_id in user_ids]
+                )
+            except RedisError as e:
+                logger.error(f"Can't check roles versions: {e}")
+            else:
+                versions = {user_id: join_roles_version(global_version, user_version)
+                            for user_id, user_version in zip(user_ids, user_versions)}
+                for i in with_claims:
+                    claims = access_tokens_decoded[i]
+                    roles_version = versions[str(claims['sub'])]
+                    if roles_version is not None and claims['rv'] == roles_version:
+                        role_names[i] = claims['roles']
+
+        stale = [i for i, names in enumerate(role_names) if names is None]
+        if stale:
+            roles = await self.get_roles_by_user_ids_query(
+                list(dict.fromkeys(str(access_tokens_decoded[i]['sub']) for i in stale))
+            )
+            for i in stale:
+                role_names[i] = [role.name for role in roles[str(access_tokens_decoded[i]['sub'])]]
+        return role_names
+
+    async def get_role_names_from_claims(self, access_token_decoded: dict) -> list[str] | None:
+        """
+        Returns role names from the token claims if the token roles version is the current one.
+
+        :param access_token_decoded: Decoded JWT access token.
+        :return: A list of role names, or None if the token has no role claims or they are stale.
+        """
+        if 'roles' not in access_token_decoded or 'rv' not in access_token_decoded:
+            return None
+        try:
+            roles_version = await self.get_roles_version(access_token_decoded['sub'])
+        except RedisError as e:
+            logger.error(f"Can't check roles version: {e}")
+            return None
+        if roles_version is None or access_token_decoded['rv'] != roles_version:
+            return None
+        return access_token_decoded['roles']
+
+    async def get_roles_version(self, user_id: UUID | str) -> str | None:
+        """
+        Retrieves the current roles version of the user with a single cache call, shared by concurrent calls.
+
+        :param user_id: The UUID of the user.
+        :return: The roles version, '<global>.<user>', None if it's unknown.
+        """
+        global_version, user_version = await get_single_flight('roles_version').do(
+            str(user_id),
+            lambda: self.cache_service.mget([ROLES_VERSION_GLOBAL_KEY, ROLES_VERSION_USER_KEY.format(user_id=user_id)])
+        )
+        return join_roles_version(global_version, user_version)
+
+    async def create_roles_version(self, user_id: UUID | str) -> str:
+        """
+        Retrieves the current roles version of the user, creating its missing parts. Concurrent workers
+        agree on the created parts, only the first write of a part wins.
+
+        :param user_id: The UUID of the user.
+        :return: The roles version, '<global>.<user>'.
+        """
+        roles_version = await self.get_roles_version(user_id)
+        if roles_version is not None:
+            return roles_version
+        global_version = await self.cache_service.set_if_missing(ROLES_VERSION_GLOBAL_KEY, new_roles_version_part())
+        user_version = await self.cache_service.set_if_missing(ROLES_VERSION_USER_KEY.format(user_id=user_id),
+                                                               new_roles_version_part())
+        return join_roles_version(global_version, user_version)
+
+    async def bump_roles_version(self, user_id: UUID | str | None = None):
+        """
+        Invalidates role claims of issued access tokens. Called after the role change is committed: if Redis
+        fails, the error is raised so the change is retried, issued tokens would keep trusting stale claims.
+
+        :param user_id: The UUID of the user whose roles changed, None to invalidate claims of all users.
+        :raises HTTPException: If the roles version can't be bumped.
+        """
+        key = ROLES_VERSION_GLOBAL_KEY if user_id is None else ROLES_VERSION_USER_KEY.format(user_id=user_id)
+        try:
+            await self.cache_service.set(key, new_roles_version_part(), expire=None)
+        except RedisError as e:
+            logger.error(f"Can't bump roles version {key}: {e}")
+            raise HTTPException(status_code=HTTPStatus.SERVICE_UNAVAILABLE,
+                                detail="Roles are changed, but issued tokens are not updated, retry the request")
+
+    async def get_role_claims(self, user_id: UUID | str) -> dict:
+        """
+        Builds role claims for a new access token. The version is read, or created if it's unknown, before
+        the roles, so a concurrent change of roles leaves the claims stale rather than wrong.
+
+        :param user_id: The UUID of the user.
+        :return: A dict with `roles` and `rv` claims, empty if the roles version is unavailable.
+        """
+        try:
+            roles_version = await self.create_roles_version(user_id)
+        except RedisError as e:
+            logger.error(f"Can't read roles version, issuing token without role claims: {e}")
+            return {}
+        roles = await self.get_roles_by_user_id_query(user_id)
+        return {'roles': [role.name for role in roles], 'rv': roles_version}
+
     async def has_role(self, user_id: UUID, role_name: str) -> bool:
         """
         Checks if a user has a specific role.
@@ -231,18 +590,96 @@ class RoleService:
         """
         return await self.has_role(user_id=user_id, role_name='admin')
 
-    async def get_roles_by_user_id_query(self, user_id: UUID) -> list[Role]:
+    async def is_admin_by_token(self, access_token_decoded: dict) -> bool:
+        """
+        Checks if the token owner is an admin, using fresh role claims of the token when possible.
+
+        :param access_token_decoded: Decoded JWT access token.
+        :return: True if the user is an admin, False otherwise.
         """
-        Helper method to get roles by user ID.
+        return 'admin' in await self.get_role_names_by_token(access_token_decoded)
+
+    async def get_roles_by_user_id_query(self, user_id: UUID) -> list[CachedRole]:
+        """
+        Helper method to get roles by user ID. Role ids of the user are cached, roles are resolved by the catalog.
 
         :param user_id: The UUID of the user for whom to retrieve roles.
-        :return: A list of Role objects associated with the user.
+        :return: A list of CachedRole objects associated with the user.
         """
-        result = await self.db.execute(
-            select(Role).join(UserRoles, Role.id == UserRoles.role_id).where(UserRoles.user_id == user_id)
+        role_ids = await self.role_cache.get_user_role_ids(user_id, lambda: self._load_user_role_ids(user_id))
+        catalog = await self.role_cache.get_catalog(self._load_roles)
+        roles = [catalog.by_id.get(role_id) for role_id in role_ids]
+        if None in roles:
+            # A role created after the catalog was loaded, the invalidation is on its way.
+            self.role_cache.catalog.clear()
+            catalog = await self.role_cache.get_catalog(self._load_roles)
+            roles = [catalog.by_id[role_id] for role_id in role_ids if role_id in catalog.by_id]
+        return roles
+
+    async def get_roles_by_user_ids_query(self, user_ids: list[str]) -> dict[str, list[CachedRole]]:
+        """
+        Batch version of `get_roles_by_user_id_query`, role sets missing from the cache are loaded with one query.
+
+        :param user_ids: UUIDs of the users.
+        :return: A dict of role lists by user id.
+        """
+        role_ids_by_user = await self.role_cache.get_many_user_role_ids(user_ids, self._load_many_user_role_ids)
+        catalog = await self.role_cache.get_catalog(self._load_roles)
+        if any(role_id not in catalog.by_id for role_ids in role_ids_by_user.values() for role_id in role_ids):
+            self.role_cache.catalog.clear()
+            catalog = await self.role_cache.get_catalog(self._load_roles)
+        return {user_id: [catalog.by_id[role_id] for role_id in role_ids if role_id in catalog.by_id]
+                for user_id, role_ids in role_ids_by_user.items()}
+
+    async def _load_roles(self) -> list[CachedRole]:
+        """
+        Loads all roles from the database.
+
+        :return: A list of CachedRole objects.
+        """
+        result = await self._get_read_db().execute(select(Role.id, Role.name, Role.description))
+        return [CachedRole(id=row.id, name=row.name, description=row.description) for row in result]
+
+    async def _load_user_role_ids(self, user_id: UUID | str) -> frozenset[UUID]:
+        """
+        Loads role ids of a user from the database. Concurrent requests of the worker share the load, so it runs
+        on its own session: the session of the request that started it is closed if that request is cancelled.
+
+        :param user_id: The UUID of the user.
+        :return: A set of role ids.
+        """
+        if self.role_cache.invalidated_within(self.replica_max_lag):
+            session_factory = async_session
+        else:
+            session_factory = await get_read_session_factory()
+        async with session_factory() as session:
+            result = await session.execute(select(UserRoles.role_id).where(UserRoles.user_id == user_id))
+            return frozenset(result.scalars().all())
+
+    async def _load_many_user_role_ids(self, user_ids: list[str]) -> dict[str, frozenset[UUID]]:
+        """
+        Loads role ids of several users from the database with a single query.
+
+        :param user_ids: UUIDs of the users.
+        :return: A dict of role id sets by user id, users without roles are missing.
+        """
+        result = await self._get_read_db().execute(
+            select(UserRoles.user_id, UserRoles.role_id).where(UserRoles.user_id.in_(user_ids))
         )
-        roles = result.scalars().all()
-        return roles if roles else []
+        role_ids: dict[str, set[UUID]] = {}
+        for row in result:
+            role_ids.setdefault(str(row.user_id), set()).add(row.role_id)
+        return {user_id: frozenset(ids) for user_id, ids in role_ids.items()}
+
+    def _get_read_db(self) -> AsyncSession:
+        """
+        Picks the session for loading cache misses.
+
+        :return: The primary session right after an invalidation, otherwise the read-only session.
+        """
+        if self.role_cache.invalidated_within(self.replica_max_lag):
+            return self.db
+        return self.read_db
 
     async def _get_admin_user_id(self) -> UUID:
         """
@@ -277,15 +714,25 @@ class RoleService:
 
 @lru_cache()
 def get_role_service(db_session: AsyncSession = Depends(get_session),
+                     read_db_session: AsyncSession = Depends(get_read_session),
+                     cache_service: CacheBackend = Depends(get_cache),
                      token_service: TokenService = Depends(get_token_service),
-                     config: FastApiConf = Depends(get_config)
+                     role_cache: RoleCache = Depends(get_role_cache),
+                     config: FastApiConf = Depends(get_config),
+                     replica_config: DbReplicaConf = Depends(get_db_replica_config)
                      ) -> RoleService:
     """
     Dependency-injection getter for RoleService.
 
     :param db_session: The database session to be used by the RoleService.
+    :param read_db_session: The database session for read-only queries.
+    :param cache_service: The cache backend keeping roles versions.
     :param token_service: The token service for handling JWT tokens.
+    :param role_cache: The per-worker cache of roles and user role sets.
     :param config: The application configuration.
+    :param replica_config: The read replica configuration.
     :return: An instance of RoleService.
     """
-    return RoleService(db_session, token_service, config.admin_login)
+    replica_max_lag = replica_config.max_lag_seconds + replica_config.lag_check_interval if replica_config.host else 0.0
+    return RoleService(db_session, read_db_session, cache_service, token_service, role_cache, config.admin_login,
+                       replica_max_lag)
@@ -0,0 +1,245 @@
+import uuid
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+from fastapi import Depends
+from redis.asyncio import Redis
+from sqlalchemy import delete, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.core.config import SessionStoreConfig, get_session_store_config
+from src.db.cache import get_redis_instance
+from src.db.postgres import get_session
+from src.models.entity import RefreshToken
+
+
+@dataclass
+class RefreshSession:
+    """
+    A refresh session, i.e. an issued refresh token.
+
+    :param id: Session identifier, also the `jti` of access tokens issued with the session.
+    :param user_id: The UUID of the session owner.
+    :param user_agent: User agent the session was opened with.
+    :param expiry_date: Expiry of the refresh token.
+    :param is_valid: False if the refresh token was already used.
+    """
+    id: str
+    user_id: str
+    user_agent: str
+    expiry_date: datetime
+    is_valid: bool = True
+
+
+class SessionStore(ABC):
+    """
+    Base class for refresh session stores.
+
+    Changes of stores backed by the request database session are committed by the caller.
+    """
+
+    @abstractmethod
+    async def create(self, user_id: str, user_agent: str, token_hash: bytes, ttl: int) -> RefreshSession:
+        """
+        Opens a new session.
+
+        :param user_id: The UUID of the session owner.
+        :param user_agent: User agent of the request.
+        :param token_hash: Digest of the refresh token.
+        :param ttl: Lifespan of the refresh token in seconds.
+        :return: The new session.
+        """
+
+    @abstractmethod
+    async def get_by_token(self, token_hash: bytes) -> RefreshSession | None:
+        """
+        Finds a session by its refresh token digest.
+
+        :param token_hash: Digest of the refresh token.
+        :return: The session, or None if it doesn't exist.
+        """
+
+    @abstractmethod
+    async def consume(self, session: RefreshSession) -> bool:
+        """
+        Marks the refresh token of a session as used. Only one of concurrent calls succeeds.
+
+        :param session: The session.
+        :return: True if the token was unused.
+        """
+
+    @abstractmethod
+    async def delete(self, session_id: str):
+        """
+        Closes a session.
+
+        :param session_id: Session identifier.
+        """
+
+    @abstractmethod
+    async def delete_user_sessions(self, user_id: str):
+        """
+        Closes all sessions of a user.
+
+        :param user_id: The UUID of the user.
+        """
+
+
+class PostgresSessionStore(SessionStore):
+    """
+    Keeps sessions in the `refresh_tokens` table. Used refresh tokens stay until `TokenCleaner` removes them.
+
+    :param db: The request database session.
+    """
+    def __init__(self, db: AsyncSession):
+        self.db = db
+
+    async def create(self, user_id: str, user_agent: str, token_hash: bytes, ttl: int) -> RefreshSession:
+        refresh_record = RefreshToken(
+            id=uuid.uuid4(),
+            user_id=user_id,
+            user_agent=user_agent,
+            token_hash=token_hash,
+            expiry_date=datetime.utcnow() + timedelta(seconds=ttl),
+            is_valid=True,
+        )
+        self.db.add(refresh_record)
+        return self._to_session(refresh_record)
+
+    async def get_by_token(self, token_hash: bytes) -> RefreshSession | None:
+        refresh_record = await self.db.scalar(select(RefreshToken).where(RefreshToken.token_hash == token_hash))
+        return self._to_session(refresh_record) if refresh_record else None
+
+    async def consume(self, session: RefreshSession) -> bool:
+        result = await self.db.execute(
+            update(RefreshToken)
+            .where(RefreshToken.id == session.id, RefreshToken.is_valid.is_(True))
+            .values(is_valid=False)
+            .returning(RefreshToken.id)
+        )
+        return result.scalar_one_or_none() is not None
+
+    async def delete(self, session_id: str):
+        await self.db.execute(delete(RefreshToken).where(RefreshToken.id == session_id))
+
+    async def delete_user_sessions(self, user_id: str):
+        await self.db.execute(delete(RefreshToken).where(RefreshToken.user_id == user_id))
+
+    @staticmethod
+    def _to_session(refresh_record: RefreshToken) -> RefreshSession:
+        return RefreshSession(id=str(refresh_record.id),
+                              user_id=str(refresh_record.user_id),
+                              user_agent=refresh_record.user_agent,
+                              expiry_date=refresh_record.expiry_date,
+                              is_valid=refresh_record.is_valid)
+
+
+class RedisSessionStore(SessionStore):
+    """
+    Keeps sessions in Redis, expired sessions are removed by Redis itself.
+
+    A session is a hash `<prefix>:<id>` with a TTL of the refresh token, found by the token digest
+    through `<prefix>:token:<digest>`. Session ids of a user are kept in the set `<prefix>:user:<user_id>`,
+    which expires with the latest session of the user. Used refresh tokens are deleted right away.
+    Postgres keeps only the login history for audit.
+
+    :param redis: Redis client.
+    :param key_prefix: Prefix of the keys.
+    """
+    def __init__(self, redis: Redis, key_prefix: str):
+        self.redis = redis
+        self.key_prefix = key_prefix
+
+    def _session_key(self, session_id: str) -> str:
+        return f'{self.key_prefix}:{session_id}'
+
+    def _token_key(self, token_hash: bytes) -> str:
+        return f'{self.key_prefix}:token:{token_hash.hex()}'
+
+    def _user_key(self, user_id: str) -> str:
+        return f'{self.key_prefix}:user:{user_id}'
+
+    async def create(self, user_id: str, user_agent: str, token_hash: bytes, ttl: int) -> RefreshSession:
+        session = RefreshSession(id=str(uuid.uuid4()),
+                                 user_id=str(user_id),
+                                 user_agent=user_agent,
+                                 expiry_date=datetime.utcnow() + timedelta(seconds=ttl))
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(self._session_key(session.id), mapping={
+                'user_id': session.user_id,
+                'user_agent': session.user_agent,
+                'expiry_date': session.expiry_date.isoformat(),
+                'token_hash': token_hash.hex(),
+            })
+            pipe.expire(self._session_key(session.id), ttl)
+            pipe.set(self._token_key(token_hash), session.id, ex=ttl)
+            pipe.sadd(self._user_key(session.user_id), session.id)
+            pipe.expire(self._user_key(session.user_id), ttl, gt=True)
+            pipe.expire(self._user_key(session.user_id), ttl, nx=True)
+            await pipe.execute()
+        return session
+
+    async def get_by_token(self, token_hash: bytes) -> RefreshSession | None:
+        session_id = await self.redis.get(self._token_key(token_hash))
+        if session_id is None:
+            return None
+        session_id = session_id.decode()
+        fields = await self.redis.hgetall(self._session_key(session_id))
+        if not fields:
+            return None
+        return RefreshSession(id=session_id,
+                              user_id=fields[b'user_id'].decode(),
+                              user_agent=fields[b'user_agent'].decode(),
+                              expiry_date=datetime.fromisoformat(fields[b'expiry_date'].decode()))
+
+    async def consume(self, session: RefreshSession) -> bool:
+        return await self._delete_sessions(session.user_id, [session.id]) > 0
+
+    async def delete(self, session_id: str):
+        user_id = await self.redis.hget(self._session_key(session_id), 'user_id')
+        if user_id is not None:
+            await self._delete_sessions(user_id.decode(), [session_id])
+
+    async def delete_user_sessions(self, user_id: str):
+        session_ids = [session_id.decode() for session_id in await self.redis.smembers(self._user_key(user_id))]
+        if session_ids:
+            await self._delete_sessions(str(user_id), session_ids)
+        await self.redis.delete(self._user_key(user_id))
+
+    async def _delete_sessions(self, user_id: str, session_ids: list[str]) -> int:
+        """
+        Deletes sessions with their token lookup keys.
+
+        :return: The number of deleted sessions.
+        """
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for session_id in session_ids:
+                pipe.hget(self._session_key(session_id), 'token_hash')
+            token_hashes = await pipe.execute()
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.delete(*[self._session_key(session_id) for session_id in session_ids])
+            for token_hash in token_hashes:
+                if token_hash is not None:
+                    pipe.delete(self._token_key(bytes.fromhex(token_hash.decode())))
+            pipe.srem(self._user_key(user_id), *session_ids)
+            deleted, *_ = await pipe.execute()
+        return deleted
+
+
+def get_session_store(db_session: AsyncSession = Depends(get_session),
+                      redis: Redis = Depends(get_redis_instance),
+                      config: SessionStoreConfig = Depends(get_session_store_config)) -> SessionStore:
+    """
+    Dependency-injection getter for the configured SessionStore.
+
+    :param db_session: The database session, used by the 'postgres' store.
+    :param redis: Redis client, used by the 'redis' store.
+    :param config: Session store configuration settings.
+    :return: An instance of SessionStore.
+    """
+    if config.backend == 'redis':
+        return RedisSessionStore(redis, config.key_prefix)
+    if config.backend == 'postgres':
+        return PostgresSessionStore(db_session)
+    raise ValueError(f"Unknown session store backend: {config.backend}")
@@ -0,0 +1,76 @@
+import asyncio
+from functools import partial
+from typing import Awaitable, Callable, Hashable, TypeVar
+
+T = TypeVar('T')
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls of a worker: while a call for a key is in flight, further calls
+    with the same key await its result instead of executing. The result object is shared by all callers,
+    so it must not be modified.
+
+    The call runs in its own task, so a caller that is cancelled doesn't cancel it for the others.
+    Errors are raised to every caller. Nothing is cached: a call made after the previous one finished executes.
+
+    :param name: Name of the call, used in metrics.
+    """
+    def __init__(self, name: str):
+        self.name = name
+        self.tasks: dict[Hashable, asyncio.Task] = {}
+        self.executed = 0
+        self.deduplicated = 0
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[T]]) -> T:
+        """
+        Executes `func`, or joins the call in flight for the key.
+
+        :param key: Key of the call, calls with equal keys must have equal results.
+        :param func: Coroutine function making the call.
+        :return: The result of the call.
+        """
+        task = self.tasks.get(key)
+        if task is None:
+            self.executed += 1
+            task = asyncio.ensure_future(func())
+            self.tasks[key] = task
+            task.add_done_callback(partial(self._done, key))
+        else:
+            self.deduplicated += 1
+        return await asyncio.shield(task)
+
+    def _done(self, key: Hashable, task: asyncio.Task):
+        if self.tasks.get(key) is task:
+            del self.tasks[key]
+        if not task.cancelled():
+            # Marks the error as retrieved if every caller was cancelled.
+            task.exception()
+
+    def stats(self) -> dict:
+        """
+        Returns counters of this worker.
+
+        :return: A dict of counters.
+        """
+        return {
+            'executed': self.executed,
+            'deduplicated': self.deduplicated,
+            'in_flight': len(self.tasks),
+        }
+
+
+flights: dict[str, SingleFlight] = {}
+
+
+def get_single_flight(name: str) -> SingleFlight:
+    """
+    Provides the process-wide SingleFlight of a call.
+
+    :param name: Name of the call.
+    :return: An instance of SingleFlight.
+    """
+    flight = flights.get(name)
+    if flight is None:
+        flight = flights[name] = SingleFlight(name)
+    return flight
@@ -1,3 +1,4 @@
+import hashlib
 from datetime import datetime, timedelta
 from functools import lru_cache
 from http import HTTPStatus
@@ -6,11 +7,36 @@ import jwt
 from fastapi import Depends, HTTPException
 
 from src.core.config import FastApiConf, get_config
+from src.services.keys import KeyStore, get_key_store
+
+# Values of the `typ` claim, telling access tokens from refresh tokens signed by the same key.
+ACCESS_TOKEN_TYPE = 'access'
+REFRESH_TOKEN_TYPE = 'refresh'
+
+
+def token_digest(token: str) -> bytes:
+    """
+    Computes a fixed-size digest of a token, used to store and look up tokens instead of the tokens themselves.
+
+    :param token: JWT token.
+    :return: SHA-256 digest of the token.
+    """
+    return hashlib.sha256(token.encode()).digest()
 
 
 class TokenService:
-    def __init__(self, secret_key: str):
+    """
+    Issues and validates JWT tokens.
+
+    With a key store tokens are signed by its active asymmetric key and carry a `kid` header, so other services
+    can verify them with the public keys from the JWKS endpoint. Without it the shared HS256 secret is used.
+
+    :param secret_key: Shared secret for HS256 tokens.
+    :param key_store: Store of asymmetric signing keys, None for HS256.
+    """
+    def __init__(self, secret_key: str, key_store: KeyStore | None = None):
         self.secret_key = secret_key
+        self.key_store = key_store
 
     def encode_jwt(self, user_id: str, expires_delta: timedelta = timedelta(minutes=5), **kwargs):
 
@@ -24,13 +50,33 @@ class TokenService:
             "exp": expire,
             **kwargs
         }
-        encoded_jwt = jwt.encode(payload, self.secret_key, algorithm="HS256")
-        return encoded_jwt
+        if self.key_store is None:
+            return jwt.encode(payload, self.secret_key, algorithm="HS256")
+        key = self.key_store.get_active_key()
+        return jwt.encode(payload, key.private_key, algorithm=key.algorithm, headers={"kid": key.kid})
+
+    @staticmethod
+    def get_unverified_claims(token: str) -> dict:
+        """
+        Reads token claims without verifying the signature. Only for lookups, the token must be decoded
+        with `decode_jwt` before trusting them.
+
+        :param token: JWT token.
+        :return: Token claims, empty if the token is malformed.
+        """
+        try:
+            return jwt.decode(token, options={"verify_signature": False})
+        except jwt.InvalidTokenError:
+            return {}
 
     def decode_jwt(self, token: str):
         try:
-            decoded_jwt = jwt.decode(token, self.secret_key, algorithms=["HS256"])
-            return decoded_jwt
+            if self.key_store is None:
+                return jwt.decode(token, self.secret_key, algorithms=["HS256"])
+            key = self.key_store.get_key(jwt.get_unverified_header(token).get("kid"))
+            if key is None:
+                raise jwt.InvalidTokenError("Unknown signing key")
+            return jwt.decode(token, key.public_key, algorithms=[key.algorithm])
         except jwt.ExpiredSignatureError:
             raise HTTPException(
                 status_code=HTTPStatus.UNAUTHORIZED,
@@ -44,7 +90,19 @@ class TokenService:
                 headers={"WWW-Authenticate": "Bearer"},
             )
 
+    def decode_jwt_or_none(self, token: str) -> dict | None:
+        """
+        Verifies and decodes a token without raising.
+
+        :param token: JWT token.
+        :return: Claims of the token, None if it's invalid or expired.
+        """
+        try:
+            return self.decode_jwt(token)
+        except HTTPException:
+            return None
+
 
 @lru_cache()
 def get_token_service(config: FastApiConf = Depends(get_config)) -> TokenService:
-    return TokenService(config.secret_key)
+    return TokenService(config.secret_key, get_key_store())
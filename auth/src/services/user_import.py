@@ -0,0 +1,255 @@
+import asyncio
+import csv
+import json
+import re
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Callable, Iterable, Iterator, TextIO
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from src.core.config import UserImportConfig
+from src.core.logger import logger
+from src.services.password import PasswordHasher
+
+STAGING_TABLE = 'user_import_staging'
+STAGING_COLUMNS = ('line', 'id', 'login', 'password', 'first_name', 'last_name', 'email')
+PASSWORD_HASH = re.compile(r'^(pbkdf2:[a-z0-9]+(:\d+)?|scrypt:\d+:\d+:\d+)\$[^$]+\$[0-9a-f]+$')
+MAX_LENGTHS = {'login': 255, 'password_hash': 255, 'first_name': 50, 'last_name': 50, 'email': 255}
+
+CREATE_STAGING_TABLE = f"""
+    CREATE TEMP TABLE IF NOT EXISTS {STAGING_TABLE} (
+        line BIGINT NOT NULL,
+        id UUID NOT NULL,
+        login VARCHAR(255) NOT NULL,
+        password VARCHAR(255) NOT NULL,
+        first_name VARCHAR(50),
+        last_name VARCHAR(50),
+        email VARCHAR(255)
+    )
+"""
+# Duplicates of a login inside a batch keep the first row, conflicts with existing users are skipped.
+# Rows of the batch that were not inserted are returned.
+MERGE_STAGING_TABLE = f"""
+    WITH inserted AS (
+        INSERT INTO content.users (id, login, password, first_name, last_name, email,
+                                   is_oauth2, credentials_updated, created_at, updated_at)
+        SELECT DISTINCT ON (login) id, login, password, first_name, last_name, email, false, true,
+               now() AT TIME ZONE 'utc', now() AT TIME ZONE 'utc'
+        FROM {STAGING_TABLE}
+        ORDER BY login, line
+        ON CONFLICT DO NOTHING
+        RETURNING id
+    )
+    SELECT line, login FROM {STAGING_TABLE}
+    WHERE id NOT IN (SELECT id FROM inserted)
+    ORDER BY line
+"""
+
+
+@dataclass
+class ImportRow:
+    """
+    A validated user row. Exactly one of `password` and `password_hash` is set until the row is hashed.
+    """
+    line: int
+    login: str
+    password: str | None
+    password_hash: str | None
+    first_name: str | None
+    last_name: str | None
+    email: str | None
+    id: uuid.UUID = field(default_factory=uuid.uuid4)
+
+
+@dataclass
+class Rejection:
+    """
+    A row that was not imported.
+
+    :param line: Line number of the row in the input, starting from 1.
+    :param login: Login of the row, if it has one.
+    :param reason: Why the row was rejected.
+    """
+    line: int
+    login: str | None
+    reason: str
+
+
+@dataclass
+class ImportReport:
+    """
+    Totals of an import.
+    """
+    total: int = 0
+    imported: int = 0
+    rejected: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.total / self.elapsed if self.elapsed else 0.0
+
+
+def read_records(file: TextIO, file_format: str) -> Iterator[tuple[int, dict | None]]:
+    """
+    Streams records of a CSV file with a header or of a JSON lines file.
+
+    :param file: The input file.
+    :param file_format: 'csv' or 'jsonl'.
+    :return: An iterator of line numbers and records, None for lines that are not valid JSON objects.
+    """
+    if file_format == 'csv':
+        reader = csv.DictReader(file)
+        for record in reader:
+            yield reader.line_num, record
+    elif file_format == 'jsonl':
+        for line, data in enumerate(file, start=1):
+            if not data.strip():
+                continue
+            try:
+                record = json.loads(data)
+            except json.JSONDecodeError:
+                record = None
+            yield line, record if isinstance(record, dict) else None
+    else:
+        raise ValueError(f"Unknown input format: {file_format}")
+
+
+def validate_record(line: int, record: dict | None) -> ImportRow | Rejection:
+    """
+    Checks a record. Passwords are either plain or werkzeug-format hashes in `password_hash`.
+
+    :param line: Line number of the record.
+    :param record: The record.
+    :return: The row to import, or its rejection.
+    """
+    if record is None:
+        return Rejection(line, None, "Malformed record")
+    values = {key: (str(value).strip() or None) if value is not None else None for key, value in record.items()}
+    login = values.get('login')
+    if login is None:
+        return Rejection(line, None, "Missing login")
+    for key, max_length in MAX_LENGTHS.items():
+        if values.get(key) is not None and len(values[key]) > max_length:
+            return Rejection(line, login, f"Too long {key}")
+    if values.get('password_hash') is not None:
+        if not PASSWORD_HASH.match(values['password_hash']):
+            return Rejection(line, login, "Unsupported password hash format")
+    elif values.get('password') is None:
+        return Rejection(line, login, "Missing password")
+    return ImportRow(line=line,
+                     login=login,
+                     password=None if values.get('password_hash') else values['password'],
+                     password_hash=values.get('password_hash'),
+                     first_name=values.get('first_name'),
+                     last_name=values.get('last_name'),
+                     email=values.get('email'))
+
+
+class UserImporter:
+    """
+    Imports users in batches. Plain passwords of a batch are hashed by the password hasher executor while
+    the previous batch is loaded. A batch is copied into a temporary staging table with `COPY`
+    and merged into `users` with a single statement, all in one transaction.
+
+    :param config: User import configuration settings.
+    :param password_hasher: Password hasher, a process pool one for throughput.
+    :param engine: Database engine.
+    """
+    def __init__(self, config: UserImportConfig, password_hasher: PasswordHasher, engine: AsyncEngine):
+        self.config = config
+        self.password_hasher = password_hasher
+        self.engine = engine
+
+    async def prepare(self, records: list[tuple[int, dict | None]]) -> tuple[list[ImportRow], list[Rejection]]:
+        """
+        Validates records of a batch and hashes plain passwords.
+
+        :param records: Line numbers and records.
+        :return: Rows ready to load and rejections.
+        """
+        rows, rejections = [], []
+        for line, record in records:
+            result = validate_record(line, record)
+            (rows if isinstance(result, ImportRow) else rejections).append(result)
+        to_hash = [row for row in rows if row.password_hash is None]
+        if to_hash:
+            password_hashes = await self.password_hasher.hash_many([row.password for row in to_hash],
+                                                                   self.config.hash_chunk_size)
+            for row, password_hash in zip(to_hash, password_hashes):
+                row.password_hash, row.password = password_hash, None
+        return rows, rejections
+
+    async def load(self, conn: AsyncConnection, rows: list[ImportRow]) -> list[Rejection]:
+        """
+        Copies rows into the staging table and merges them into `users`.
+
+        :param conn: Database connection with the staging table.
+        :param rows: Rows with password hashes.
+        :return: Rejections of rows whose login already exists or repeats an earlier row.
+        """
+        async with conn.begin():
+            # Starts the transaction, so COPY on the driver connection runs inside it.
+            await conn.execute(text(f"TRUNCATE {STAGING_TABLE}"))
+            raw_connection = await conn.get_raw_connection()
+            await raw_connection.driver_connection.copy_records_to_table(
+                STAGING_TABLE,
+                records=[(row.line, row.id, row.login, row.password_hash, row.first_name, row.last_name, row.email)
+                         for row in rows],
+                columns=STAGING_COLUMNS,
+            )
+            result = await conn.execute(text(MERGE_STAGING_TABLE))
+            return [Rejection(line, login, "Login already exists or is repeated") for line, login in result]
+
+    def _batches(self, records: Iterable[tuple[int, dict | None]]) -> Iterator[list[tuple[int, dict | None]]]:
+        batch = []
+        for record in records:
+            batch.append(record)
+            if len(batch) >= self.config.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    async def run(self, records: Iterable[tuple[int, dict | None]],
+                  on_rejected: Callable[[Rejection], None]) -> ImportReport:
+        """
+        Imports records.
+
+        :param records: Line numbers and records, e.g. from `read_records`.
+        :param on_rejected: Called for every rejected row.
+        :return: The import report.
+        """
+        report = ImportReport()
+        started_at = time.perf_counter()
+        batches = self._batches(records)
+        async with self.engine.connect() as conn:
+            async with conn.begin():
+                await conn.execute(text(CREATE_STAGING_TABLE))
+            batch = next(batches, None)
+            prepared = asyncio.create_task(self.prepare(batch)) if batch is not None else None
+            try:
+                while prepared is not None:
+                    rows, rejections = await prepared
+                    report.total += len(batch)
+                    # The next batch is hashed while this one is loaded.
+                    batch = next(batches, None)
+                    prepared = asyncio.create_task(self.prepare(batch)) if batch is not None else None
+                    if rows:
+                        conflicts = await self.load(conn, rows)
+                        report.imported += len(rows) - len(conflicts)
+                        rejections += conflicts
+                    for rejection in rejections:
+                        on_rejected(rejection)
+                    report.rejected += len(rejections)
+                    report.elapsed = time.perf_counter() - started_at
+                    logger.info(f"Users import: {report.total} rows, {report.imported} imported, "
+                                f"{report.rejected} rejected, {report.rows_per_second:.0f} rows/s")
+            finally:
+                if prepared is not None:
+                    prepared.cancel()
+        report.elapsed = time.perf_counter() - started_at
+        return report
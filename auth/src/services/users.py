@@ -1,20 +1,30 @@
+import uuid
 from datetime import datetime, timedelta
 from functools import lru_cache
 from http import HTTPStatus
 from uuid import UUID
 
 from fastapi import Depends, HTTPException
-from sqlalchemy import delete, desc, select
+from sqlalchemy import desc, select, tuple_
 from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 from starlette.requests import Request
 
+from src.api.v1.models.entity import UserCreate, UserUpdateRequest
 from src.core.config import FastApiConf, get_config
-from src.core.logger import logger
+from src.core.logger import logger, sampled_logger
+from src.core.metrics import auth_operation_seconds, timed
 from src.db.cache import CacheBackend, get_cache
-from src.db.postgres import AsyncSession, get_session
-from src.models.entity import LoginHistory, RefreshToken, User
-from src.services.token import TokenService, get_token_service
-from src.services.utils import calculate_ttl, get_ip_address, get_user_agent
+from src.db.postgres import AsyncSession, get_read_session, get_session
+from src.models.entity import LoginHistory, User
+from src.services.denylist import TokenDenylist, get_token_denylist
+from src.services.login_history import (LoginHistoryWriter, decode_cursor,
+                                        encode_cursor, get_login_history_writer)
+from src.services.password import PasswordHasher, get_password_hasher
+from src.services.roles import RoleService, get_role_service
+from src.services.sessions import RefreshSession, SessionStore, get_session_store
+from src.services.token import (ACCESS_TOKEN_TYPE, REFRESH_TOKEN_TYPE,
+                                TokenService, get_token_service, token_digest)
+from src.services.utils import get_ip_address, get_user_agent
 
 
 class UserAlreadyExistsException(HTTPException):
@@ -31,20 +41,39 @@ class UserService:
     Utilizes asynchronous methods for database and cache interactions.
 
     :param db_session: Async database session for queries.
+    :param read_db_session: Async database session for read-only queries, possibly on a read replica.
+        Reads that may lag behind writes by a few seconds, like the login history, go there.
     :param cache_service: Service for caching.
     :param token_service: Service for JWT token generation and validation.
+    :param password_hasher: Service for hashing and verifying passwords off the event loop.
+    :param role_service: Service for roles, provides role claims of access tokens.
+    :param token_denylist: Denylist of revoked access tokens.
+    :param session_store: Store of refresh sessions.
+    :param login_history: Background writer of login history.
     :param access_token_ttl: Lifespan of access tokens in seconds.
     :param refresh_token_ttl: Lifespan of refresh tokens in seconds.
     """
     def __init__(self, db_session: AsyncSession,
+                 read_db_session: AsyncSession,
                  cache_service: CacheBackend,
                  token_service: TokenService,
+                 password_hasher: PasswordHasher,
+                 role_service: RoleService,
+                 token_denylist: TokenDenylist,
+                 session_store: SessionStore,
+                 login_history: LoginHistoryWriter,
                  access_token_ttl: int,
                  refresh_token_ttl: int
                  ):
         self.db = db_session
+        self.read_db = read_db_session
         self.cache_service = cache_service
         self.token_service = token_service
+        self.password_hasher = password_hasher
+        self.role_service = role_service
+        self.token_denylist = token_denylist
+        self.session_store = session_store
+        self.login_history = login_history
         self.access_token_ttl = access_token_ttl
         self.refresh_token_ttl = refresh_token_ttl
 
@@ -59,20 +88,27 @@ class UserService:
 
     async def get_user_by_id(self, user_id: str) -> User:
         """
-        Retrieves a user by user id.
+        Retrieves a user by user id from the primary: the user is loaded to be updated, a lagging replica
+        could return a row the update would overwrite.
 
         :param user_id: The user uuid to search for.
         :return: User object if found.
         """
         return await self.db.scalar(select(User).where(User.id == user_id))
 
-    async def create_user(self, user: User) -> User:
+    @timed(auth_operation_seconds, 'signup')
+    async def create_user(self, user_data: UserCreate) -> User:
         """
         Adds a new user to the database.
 
-        :param user: The User object to add.
+        :param user_data: Registration data of the user.
         :return: The added User object.
         """
+        user = User(login=user_data.login,
+                    first_name=user_data.first_name,
+                    last_name=user_data.last_name,
+                    email=user_data.email,
+                    password_hash=await self.password_hasher.hash(user_data.password))
         self.db.add(user)
         try:
             await self.db.commit()
@@ -81,7 +117,7 @@ class UserService:
             raise UserAlreadyExistsException(status_code=HTTPStatus.CONFLICT, detail="User already exists")
 
         await self.db.refresh(user)
-        logger.info(f'Signup login {user.login}')
+        logger.info('Signup login {}', user.login)
         return user
 
     async def complete_authentication(self, user: User, request: Request) -> tuple[str, str, User]:
@@ -92,23 +128,23 @@ class UserService:
         :param request: Request object for user agent and IP extraction.
         :return: Tuple of access token and refresh token.
         """
-        logger.info(f"User authenticated successfully: {user.id}")
+        sampled_logger.info("User authenticated successfully: {}", user.id)
         user_id, user_agent, ip_address = str(user.id), get_user_agent(request), get_ip_address(request)
-        refresh_token, refresh_record = await self.create_new_refresh_token(user_id, user_agent)
+        refresh_token, session = await self.create_new_refresh_token(user_id, user_agent)
         await self.create_login_history(user_id=user.id, ip_address=ip_address, user_agent=user_agent)
 
         try:
             await self.db.commit()
-            logger.debug(f"Authentication records saved successfully for user: {user.id}")
+            logger.debug("Authentication records saved successfully for user: {}", user.id)
         except IntegrityError:
             logger.error(f"Error saving session for user: {user.id}")
             await self.db.rollback()
             raise HTTPException(status_code=HTTPStatus.INTERNAL_SERVER_ERROR, detail="Error saving session")
 
-        refresh_record_id = str(refresh_record.id)
-        access_token = self.create_access_token(str(user.id), refresh_token_id=refresh_record_id)
+        access_token = await self.create_access_token(str(user.id), refresh_token_id=session.id)
         return access_token, refresh_token, user
 
+    @timed(auth_operation_seconds, 'login')
     async def authenticate(self, username: str, password: str, request: Request) -> tuple[str, str, User]:
         """
         Authenticates a user and generates access and refresh tokens.
@@ -119,8 +155,8 @@ class UserService:
         :return: A tuple of access token and refresh token.
         """
         user = await self.get_user_by_username(username)
-        if not user or not user.check_password(password):
-            logger.warning(f"Authentication failed for user: {user.id}")
+        if not user or not await self.password_hasher.verify(user.password, password):
+            logger.warning(f"Authentication failed for user: {username}")
             raise AuthenticationFailedException(status_code=HTTPStatus.UNAUTHORIZED, detail="Wrong login or password")
 
         return await self.complete_authentication(user, request)
@@ -132,76 +168,72 @@ class UserService:
         :param access_token: The JWT access token to be invalidated.
         """
         access_token_decoded = self.token_service.decode_jwt(access_token)
-        logger.debug(f"Logging out from one session for user: {access_token_decoded['sub']}")
+        logger.debug("Logging out from one session for user: {}", access_token_decoded['sub'])
         jti = access_token_decoded["jti"]
-        ttl = calculate_ttl(access_token_decoded['exp'])
 
         await self.invalidate_refresh_token(jti)
-        await self.cache_service.set(access_token, 'bad', expire=ttl)
+        await self.token_denylist.revoke(jti, access_token_decoded['exp'])
 
     async def logout_all(self, access_token: str):
         """
-        Logs out a user from all sessions by invalidating all refresh tokens associated with the user.
+        Logs out a user from all sessions by invalidating all refresh tokens associated with the user
+        and bumping the user token generation, which revokes all access tokens issued so far.
 
         :param access_token: The JWT access token of the current session, used to identify the user.
         """
         access_token_decoded = self.token_service.decode_jwt(access_token)
-        logger.debug(f"Logging out from all sessions for user: {access_token_decoded['sub']}")
-        ttl = calculate_ttl(access_token_decoded['exp'])
+        logger.debug("Logging out from all sessions for user: {}", access_token_decoded['sub'])
         user_id = access_token_decoded['sub']
 
         await self.invalidate_all_user_refresh_tokens(user_id)
-        await self.cache_service.set(access_token, 'bad', expire=ttl)
+        await self.token_denylist.generations.bump(user_id)
 
-    def create_access_token(self, user_id: str, refresh_token_id: str):
+    async def create_access_token(self, user_id: str, refresh_token_id: str):
         """
-        Generates a new access token for a user.
+        Generates a new access token for a user, embedding the user's role names, roles version
+        and token generation.
 
         :param user_id: The user's unique identifier.
         :param refresh_token_id: The identifier of the associated refresh token.
         :return: A new JWT access token.
         """
-        return self.token_service.encode_jwt(user_id, timedelta(seconds=self.access_token_ttl), jti=refresh_token_id)
+        role_claims = await self.role_service.get_role_claims(user_id)
+        generation = await self.token_denylist.generations.issue(user_id)
+        return self.token_service.encode_jwt(user_id, timedelta(seconds=self.access_token_ttl), typ=ACCESS_TOKEN_TYPE,
+                                             jti=refresh_token_id, gen=generation, **role_claims)
 
     def create_refresh_token(self, user_id: str):
         """
-        Generates a new refresh token for a user.
+        Generates a new refresh token for a user. The random jti keeps tokens issued within the same second unique.
 
         :param user_id: The user's unique identifier.
         :return: A new JWT refresh token.
         """
-        return self.token_service.encode_jwt(user_id, timedelta(seconds=self.refresh_token_ttl))
+        return self.token_service.encode_jwt(user_id, timedelta(seconds=self.refresh_token_ttl), typ=REFRESH_TOKEN_TYPE,
+                                             jti=str(uuid.uuid4()))
 
-    async def create_new_refresh_token(self, user_id: str, user_agent: str) -> tuple[str, RefreshToken]:
+    async def create_new_refresh_token(self, user_id: str, user_agent: str) -> tuple[str, RefreshSession]:
         """
-        Creates and persists a new refresh token record.
+        Creates a new refresh token and opens its session.
 
         :param user_id: The user's unique identifier.
         :param user_agent: The user agent string from the user's request.
-        :return: A tuple of the new refresh token and its database record.
+        :return: A tuple of the new refresh token and its session.
         """
         new_refresh_token = self.create_refresh_token(user_id)
-        refresh_record = RefreshToken(
-            user_id=user_id,
-            user_agent=user_agent,
-            jwt_token=new_refresh_token,
-            expiry_date=datetime.utcnow() + timedelta(seconds=self.refresh_token_ttl),
-            is_valid=True,
-        )
-        self.db.add(refresh_record)
-        return new_refresh_token, refresh_record
+        session = await self.session_store.create(user_id, user_agent, token_digest(new_refresh_token),
+                                                  self.refresh_token_ttl)
+        return new_refresh_token, session
 
-    async def get_valid_refresh_token(self, refresh_token: str, user_agent: str) -> RefreshToken:
+    async def get_valid_refresh_token(self, refresh_token: str, user_agent: str) -> RefreshSession:
         """
-        Retrieves and validates a refresh token.
+        Retrieves and validates a refresh token, looked up by its digest.
 
         :param refresh_token: The refresh token to validate.
         :param user_agent: The user agent to match with the token.
-        :return: A valid RefreshToken instance.
+        :return: A valid RefreshSession instance.
         """
-        query = select(RefreshToken).where(RefreshToken.jwt_token == refresh_token)
-        result = await self.db.execute(query)
-        token = result.scalar_one_or_none()
+        token = await self.session_store.get_by_token(token_digest(refresh_token))
 
         if not token or not token.is_valid or user_agent != token.user_agent or token.expiry_date < datetime.utcnow():
             raise HTTPException(
@@ -211,6 +243,7 @@ class UserService:
             )
         return token
 
+    @timed(auth_operation_seconds, 'refresh')
     async def refresh(self, refresh_token: str, request: Request) -> tuple[str, str]:
         """
         Refreshes the authentication tokens for a user.
@@ -229,33 +262,42 @@ class UserService:
             raise
 
         user_id = str(token.user_id)
-        logger.debug(f"Valid refresh token found for user ID: {user_id}")
+        logger.debug("Valid refresh token found for user ID: {}", user_id)
 
-        refresh_token, refresh_record = await self.create_new_refresh_token(user_id, user_agent)
+        if not await self.session_store.consume(token):
+            logger.warning(f"Refresh token reused for user ID: {user_id}")
+            raise HTTPException(
+                status_code=HTTPStatus.UNAUTHORIZED,
+                detail="Invalid refresh token",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        refresh_token, session = await self.create_new_refresh_token(user_id, user_agent)
 
-        token.is_valid = False
         try:
             await self.db.commit()
-            logger.debug(f"Refresh token invalidated and database committed for user ID: {user_id}")
+            logger.debug("Refresh token invalidated and database committed for user ID: {}", user_id)
         except SQLAlchemyError as e:
             logger.error(f"Failed to commit to database for user ID: {user_id}, Error: {e}")
             raise HTTPException(status_code=HTTPStatus.INTERNAL_SERVER_ERROR,
                                 detail="Error while updating refresh token db")
 
-        refresh_record_id = str(refresh_record.id)
-        access_token = self.create_access_token(str(token.user_id), refresh_token_id=refresh_record_id)
-        logger.debug(f"Access token created and refresh token updated successfully for user ID: {user_id}")
+        access_token = await self.create_access_token(user_id, refresh_token_id=session.id)
+        logger.debug("Access token created and refresh token updated successfully for user ID: {}", user_id)
 
         return access_token, refresh_token
 
     async def create_login_history(self, user_id: UUID, user_agent: str, ip_address: str):
         """
-        Records a user's login history in the database.
+        Records a user's login history, in the background when the login history writer is on,
+        otherwise within the login transaction.
 
         :param user_id: The ID of the user who is logging in.
         :param user_agent: The user agent string from the user's request.
         :param ip_address: The IP address of the user at the time of login.
         """
+        if self.login_history.config.is_on:
+            await self.login_history.record(user_id=user_id, user_agent=user_agent, ip_address=ip_address)
+            return
         history_record = LoginHistory(user_id=user_id, ip_address=ip_address, user_agent=user_agent)
         self.db.add(history_record)
 
@@ -265,10 +307,9 @@ class UserService:
 
         :param jti: The unique identifier of the refresh token to invalidate.
         """
-        logger.debug(f"Invalidating refresh token with uuid: {jti}")
-        query = delete(RefreshToken).where(RefreshToken.id == jti)
+        logger.debug("Invalidating refresh token with uuid: {}", jti)
         try:
-            await self.db.execute(query)
+            await self.session_store.delete(jti)
             await self.db.commit()
         except SQLAlchemyError as e:
             raise HTTPException(status_code=HTTPStatus.INTERNAL_SERVER_ERROR,
@@ -280,12 +321,11 @@ class UserService:
 
         :param user_id: The ID of the user whose refresh tokens need to be invalidated.
         """
-        logger.debug(f"Invalidating all refresh tokens for user ID: {user_id}")
-        query = delete(RefreshToken).where(RefreshToken.user_id == user_id)
+        logger.debug("Invalidating all refresh tokens for user ID: {}", user_id)
         try:
-            await self.db.execute(query)
+            await self.session_store.delete_user_sessions(user_id)
             await self.db.commit()
-            logger.debug(f"All refresh tokens invalidated for user ID: {user_id}")
+            logger.debug("All refresh tokens invalidated for user ID: {}", user_id)
         except SQLAlchemyError as e:
             logger.error(f"Error invalidating all refresh tokens for user ID {user_id}: {e}")
             raise HTTPException(status_code=HTTPStatus.INTERNAL_SERVER_ERROR,
@@ -308,17 +348,72 @@ class UserService:
                  .offset(offset)
                  .limit(page_size))
         try:
-            result = await self.db.execute(query)
+            result = await self.read_db.execute(query)
         except SQLAlchemyError as e:
             raise HTTPException(status_code=HTTPStatus.INTERNAL_SERVER_ERROR, detail=str(e))
         return list(result.scalars().all())
 
-    async def update_user(self, access_token: str, user_update: User):
+    async def get_history_page(self, access_token: str, cursor: str | None,
+                               page_size: int) -> tuple[list[LoginHistory], str | None]:
         """
-        Updates user information based on the provided User object.
+        Retrieves a page of login history records for a user with keyset pagination.
+        Any page is an index range scan, unlike `get_history` with an offset.
+
+        :param access_token: JWT access token of the user.
+        :param cursor: Cursor returned with the previous page, None for the first page.
+        :param page_size: The number of login history records per page.
+        :return: A tuple of LoginHistory records and the cursor of the next page, None if it's the last page.
+        """
+        access_token_decoded = self.token_service.decode_jwt(access_token)
+        query = (select(LoginHistory)
+                 .where(LoginHistory.user_id == access_token_decoded['sub'])
+                 .order_by(desc(LoginHistory.created_at), desc(LoginHistory.id))
+                 .limit(page_size + 1))
+        if cursor is not None:
+            try:
+                created_at, record_id = decode_cursor(cursor)
+            except ValueError:
+                raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail="Invalid cursor")
+            query = query.where(tuple_(LoginHistory.created_at, LoginHistory.id) < tuple_(created_at, record_id))
+        try:
+            result = await self.read_db.execute(query)
+        except SQLAlchemyError as e:
+            raise HTTPException(status_code=HTTPStatus.INTERNAL_SERVER_ERROR, detail=str(e))
+        records = list(result.scalars().all())
+        if len(records) <= page_size:
+            return records, None
+        records = records[:page_size]
+        return records, encode_cursor(records[-1].created_at, records[-1].id)
+
+    @timed(auth_operation_seconds, 'introspect')
+    async def introspect(self, tokens: list[str]) -> list[tuple[dict, list[str]] | None]:
+        """
+        Verifies a batch of access tokens. Revocations of all tokens are checked with one Redis round trip,
+        roles are resolved with one roles versions lookup and at most one query. Refresh tokens are signed
+        by the same key, only tokens with the access `typ` claim are active.
+
+        :param tokens: JWT access tokens.
+        :return: For each token, a tuple of its claims and role names of its owner,
+            None if the token is invalid, expired, revoked or not an access token.
+        """
+        decoded = [self.token_service.decode_jwt_or_none(token) for token in tokens]
+        valid = [i for i, claims in enumerate(decoded)
+                 if claims is not None and 'sub' in claims and claims.get('typ') == ACCESS_TOKEN_TYPE]
+        revoked = await self.token_denylist.are_access_tokens_revoked([decoded[i] for i in valid])
+        active = [i for i, is_revoked in zip(valid, revoked) if not is_revoked]
+        results: list[tuple[dict, list[str]] | None] = [None] * len(tokens)
+        if active:
+            role_names = await self.role_service.get_role_names_by_tokens([decoded[i] for i in active])
+            for i, names in zip(active, role_names):
+                results[i] = (decoded[i], names)
+        return results
+
+    async def update_user(self, access_token: str, user_update: UserUpdateRequest):
+        """
+        Updates user information based on the provided data.
 
         :param access_token: JWT access token of the user.
-        :param user_update: A User object containing the updated user information.
+        :param user_update: The updated user information, None fields are left untouched.
         """
         access_token_decoded = self.token_service.decode_jwt(access_token)
         user_id = access_token_decoded['sub']
@@ -331,7 +426,7 @@ class UserService:
         if user_update.login is not None:
             user.login = user_update.login
         if user_update.password is not None:
-            user.password = user_update.password
+            user.password = await self.password_hasher.hash(user_update.password)
         if user_update.first_name is not None:
             user.first_name = user_update.first_name
         if user_update.last_name is not None:
@@ -351,17 +446,30 @@ class UserService:
 
 @lru_cache()
 def get_user_service(db_session: AsyncSession = Depends(get_session),
+                     read_db_session: AsyncSession = Depends(get_read_session),
                      cache_service: CacheBackend = Depends(get_cache),
                      token_service: TokenService = Depends(get_token_service),
+                     password_hasher: PasswordHasher = Depends(get_password_hasher),
+                     role_service: RoleService = Depends(get_role_service),
+                     token_denylist: TokenDenylist = Depends(get_token_denylist),
+                     session_store: SessionStore = Depends(get_session_store),
+                     login_history: LoginHistoryWriter = Depends(get_login_history_writer),
                      config: FastApiConf = Depends(get_config)
                      ) -> UserService:
     """
     Dependency function to get an instance of UserService.
 
     :param db_session: An asynchronous database session, used for database operations.
+    :param read_db_session: An asynchronous database session for read-only queries.
     :param cache_service: A cache backend instance, used for caching data to improve performance.
     :param token_service: A token service instance, used for managing authentication tokens.
+    :param password_hasher: A password hasher instance, used for off-loop password hashing.
+    :param role_service: A role service instance, used for role claims of access tokens.
+    :param token_denylist: A denylist of revoked access tokens.
+    :param session_store: A store of refresh sessions.
+    :param login_history: A background writer of login history.
     :param config: Configuration settings for the FastAPI application
     :return: An instance of UserService.
     """
-    return UserService(db_session, cache_service, token_service, config.access_token_ttl, config.refresh_token_ttl)
+    return UserService(db_session, read_db_session, cache_service, token_service, password_hasher, role_service,
+                       token_denylist, session_store, login_history, config.access_token_ttl, config.refresh_token_ttl)
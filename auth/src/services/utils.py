@@ -1,13 +1,24 @@
+import asyncio
+import hashlib
+import time
 import uuid
 from datetime import datetime
+from functools import lru_cache
 
-from sqlalchemy import delete, or_
+from redis.asyncio import Redis, RedisError
+from redis.exceptions import LockError
+from sqlalchemy import delete, or_, select
+from sqlalchemy.exc import SQLAlchemyError
 from starlette.requests import Request
 from user_agents import parse
 
+from src.core.config import TokenCleanerConfig
+from src.core.logger import logger
 from src.db.postgres import async_session
 from src.models.entity import RefreshToken
 
+USER_AGENT_CACHE_SIZE = 4096
+
 
 def get_ip_address(request: Request) -> str:
     """
@@ -26,13 +37,51 @@ def get_user_agent(request: Request) -> str:
     :param request: The Request object from FastAPI containing the request information.
     :return: A string representing the client's operating system and browser information.
     """
-    user_agent_string = request.headers.get('User-Agent')
+    return parse_user_agent(request.headers.get('User-Agent'))
+
+
+@lru_cache(maxsize=USER_AGENT_CACHE_SIZE)
+def parse_user_agent(user_agent_string: str | None) -> str:
+    """
+    Normalizes a User-Agent header to the client's operating system and browser. Parsing runs a long regex
+    cascade while clients send few distinct headers, so results are kept in a bounded, thread-safe LRU cache.
+
+    :param user_agent_string: Raw User-Agent header.
+    :return: A string representing the client's operating system and browser information.
+    """
     user_agent = parse(user_agent_string)
     os_info = f'{user_agent.os.family} {user_agent.os.version_string}'
     browser = f'{user_agent.browser.family} {user_agent.browser.version_string}'
     return f'{os_info} {browser}'
 
 
+def get_user_agent_cache_stats() -> dict:
+    """
+    Returns stats of the User-Agent parsing cache of this worker.
+
+    :return: A dict with hits, misses, size, max size and hit ratio.
+    """
+    info = parse_user_agent.cache_info()
+    lookups = info.hits + info.misses
+    return {
+        'hits': info.hits,
+        'misses': info.misses,
+        'size': info.currsize,
+        'max_size': info.maxsize,
+        'hit_ratio': info.hits / lookups if lookups else 0.0,
+    }
+
+
+def get_user_agent_key(request: Request) -> str:
+    """
+    Builds a short key of the raw User-Agent header without parsing it, for keys that only need to tell clients apart.
+
+    :param request: The Request object from FastAPI containing the request information.
+    :return: A hex digest of the header.
+    """
+    return hashlib.blake2b(request.headers.get('User-Agent', '').encode(), digest_size=8).hexdigest()
+
+
 def calculate_ttl(exp: int) -> int:
     """
     Calculates the TTL (Time To Live) for a given expiry time.
@@ -45,42 +94,90 @@ def calculate_ttl(exp: int) -> int:
 
 class TokenCleaner:
     """
-    A class for cleaning expired tokens from the database.
-    """
-    def __init__(self):
-        self.db_session = None
+    Removes expired and used refresh tokens from the database.
 
-    async def init_session(self):
-        """
-        Initializes an asynchronous session with the database if not already initialized.
-        """
-        if self.db_session is None:
-            async with async_session() as session:
-                self.db_session = session
+    Rows are deleted in batches of `batch_size`, each in its own short transaction, skipping rows locked
+    by concurrent requests, with a pause between batches. Batches walk the table in `id` order, each starting
+    after the last id of the previous one, so rows left in place are not scanned again within a run.
+    A run stops after `max_run_seconds`, the rest is left for the next one.
+
+    Every worker schedules the cleaner, the first one taking the Redis lock does the work. After a successful
+    run the lock is kept until shortly before the next scheduled run, so the other workers skip this interval
+    instead of running one after another. A failed run releases the lock for the next worker.
 
-    async def close_session(self):
+    :param config: Token cleaner configuration settings.
+    :param redis: Redis client for the leader lock. Without it every call runs.
+    :param interval: Interval of scheduled runs, in seconds.
+    """
+    def __init__(self, config: TokenCleanerConfig, redis: Redis | None = None, interval: int = 0):
+        self.config = config
+        self.redis = redis
+        # The lock outlives the longest run and expires before the next scheduled run of this worker.
+        self.lock_timeout = max(interval - 60, config.max_run_seconds + 60)
+        self.runs = 0
+        self.total_deleted = 0
+        self.last_run: dict = {}
+
+    async def delete_batch(self, after: uuid.UUID | None = None) -> tuple[int, uuid.UUID | None]:
         """
-        Closes the asynchronous session with the database if it is open.
+        Deletes one batch of expired tokens, the first ones in `id` order after the given id.
+
+        :param after: The last id of the previous batch, None to start from the beginning.
+        :return: The number of deleted rows and the last id of the batch, None if nothing was found.
         """
-        if self.db_session:
-            await self.db_session.close()
+        expired = (select(RefreshToken.id)
+                   .where(or_(RefreshToken.expiry_date < datetime.utcnow(), RefreshToken.is_valid.is_(False)))
+                   .order_by(RefreshToken.id)
+                   .limit(self.config.batch_size)
+                   .with_for_update(skip_locked=True))
+        if after is not None:
+            expired = expired.where(RefreshToken.id > after)
+        async with async_session() as session:
+            async with session.begin():
+                result = await session.execute(delete(RefreshToken)
+                                               .where(RefreshToken.id.in_(expired.scalar_subquery()))
+                                               .returning(RefreshToken.id))
+                deleted_ids = result.scalars().all()
+        return len(deleted_ids), max(deleted_ids, default=None)
 
     async def clear_expired_token(self):
         """
-        Removes all expired tokens from the database. Tokens are considered expired if their
+        Removes expired tokens if this worker is the leader. Tokens are considered expired if their
         expiry date has passed or if they are marked as invalid.
         """
-        if self.db_session is None:
-            await self.init_session()
-
-        query = delete(RefreshToken).where(
-            or_(
-                RefreshToken.expiry_date < datetime.utcnow(),
-                RefreshToken.is_valid.is_(False)
-            )
-        )
-        await self.db_session.execute(query)
-        await self.db_session.commit()
+        lock = None
+        if self.redis is not None:
+            lock = self.redis.lock(self.config.lock_key, timeout=self.lock_timeout)
+            try:
+                if not await lock.acquire(blocking=False):
+                    return
+            except RedisError as e:
+                logger.error(f"Token cleaner can't acquire the leader lock: {e}")
+                return
+
+        started_at = time.monotonic()
+        deleted, batches, last_id = 0, 0, None
+        try:
+            while time.monotonic() - started_at < self.config.max_run_seconds:
+                batch_deleted, last_id = await self.delete_batch(last_id)
+                deleted += batch_deleted
+                batches += 1
+                if batch_deleted < self.config.batch_size:
+                    break
+                await asyncio.sleep(self.config.batch_pause)
+        except SQLAlchemyError as e:
+            logger.error(f"Token cleaner failed after deleting {deleted} tokens: {e}")
+            if lock is not None:
+                try:
+                    await lock.release()
+                except (LockError, RedisError) as e:
+                    logger.warning(f"Token cleaner can't release the leader lock: {e}")
+
+        elapsed = time.monotonic() - started_at
+        self.runs += 1
+        self.total_deleted += deleted
+        self.last_run = {'deleted': deleted, 'batches': batches, 'seconds': elapsed}
+        logger.info(f"Token cleaner deleted {deleted} tokens in {batches} batches, {elapsed:.2f}s")
 
 
 def generate_unique_login():
@@ -89,4 +186,4 @@ def generate_unique_login():
     return unique_login
 
 
-token_cleaner: TokenCleaner() = None
+token_cleaner: TokenCleaner | None = None
@@ -91,6 +91,25 @@ async def make_post_request(http_session: aiohttp.ClientSession):
     return inner
 
 
+@pytest_asyncio.fixture
+async def make_post_request_json_lines(http_session: aiohttp.ClientSession):
+    """
+    Asynchronously make a POST request with a JSON body to an endpoint streaming JSON lines.
+
+    :param http_session: aiohttp client session.
+    :return: A function that takes a URL path, JSON data and headers, performs a POST request,
+             and returns the response object with the parsed lines as its body.
+    """
+    async def inner(path: str, query_data: dict, headers: dict | None = None):
+        headers = {**(headers or {}), 'Content-Type': 'application/json'}
+        headers.setdefault('X-Request-Id', str(uuid.uuid4()))
+        url = f'{test_settings.service_url}{path}'
+        async with http_session.post(url, data=json.dumps(query_data), headers=headers) as response:
+            response.body = [json.loads(line) for line in (await response.text()).splitlines() if line]
+            return response
+    return inner
+
+
 @pytest_asyncio.fixture
 async def make_post_request__form_data(http_session: aiohttp.ClientSession):
     async def inner(path: str, query_data: dict | None = None, headers=None):
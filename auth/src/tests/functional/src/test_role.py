@@ -215,3 +215,53 @@ async def test_detach_role_from_user_success(make_post_request_for_login, make_d
 
     assert detach_response.status == HTTPStatus.OK
     assert not any(roles[1].name == role["name"] for role in detach_response.body)
+
+
+async def test_bulk_assign_roles_user_forbidden(make_post_request_for_login, make_post_request):
+    user_credentials = {"username": users[0][0], "password": users[0][1]}
+    user_login_response = await make_post_request_for_login('/api/v1/user/login', user_credentials)
+    user_access_token = user_login_response.body['access_token']
+
+    response = await make_post_request(
+        '/api/v1/roles/bulk/assign',
+        {"pairs": [{"user_id": str(users[3][2].id), "role_id": str(roles[1].id)}]},
+        headers={"Authorization": f"Bearer {user_access_token}",
+                 "Content-Type": "application/json"}
+    )
+
+    assert response.status == HTTPStatus.FORBIDDEN
+
+
+async def test_bulk_assign_and_detach_roles_success(make_post_request_for_login, make_post_request_json_lines,
+                                                    make_get_request):
+    # Administrator authentication
+    admin_credentials = {"username": test_settings.superuser_login, "password": test_settings.superuser_passwd}
+    admin_login_response = await make_post_request_for_login('/api/v1/user/login', admin_credentials)
+    admin_access_token = admin_login_response.body['access_token']
+    headers = {"Authorization": f"Bearer {admin_access_token}"}
+
+    # users[4] already has the role, so only two pairs change
+    role = roles[4]
+    user_ids = [str(users[1][2].id), str(users[2][2].id), str(users[4][2].id)]
+    pairs = [{"user_id": user_id, "role_id": str(role.id)} for user_id in user_ids]
+
+    assign_response = await make_post_request_json_lines('/api/v1/roles/bulk/assign', {"pairs": pairs},
+                                                         headers=headers)
+    assert assign_response.status == HTTPStatus.OK
+    assert assign_response.body[-1] == {"processed": 3, "changed": 2, "done": True}
+    for user_id in user_ids:
+        roles_response = await make_get_request(f'/api/v1/roles/user/{user_id}', headers=headers)
+        assert roles_response.status == HTTPStatus.OK
+        assert role.name in {user_role['name'] for user_role in roles_response.body}
+
+    # Detaching the role from the first two users only
+    detach_response = await make_post_request_json_lines('/api/v1/roles/bulk/detach', {"pairs": pairs[:2]},
+                                                         headers=headers)
+    assert detach_response.status == HTTPStatus.OK
+    assert detach_response.body[-1] == {"processed": 2, "changed": 2, "done": True}
+    assert [{'name': roles[1].name}] == (
+        await make_get_request(f'/api/v1/roles/user/{user_ids[0]}', headers=headers)).body
+    assert [{'name': roles[2].name}] == (
+        await make_get_request(f'/api/v1/roles/user/{user_ids[1]}', headers=headers)).body
+    assert [{'name': role.name}] == (
+        await make_get_request(f'/api/v1/roles/user/{user_ids[2]}', headers=headers)).body
@@ -1,6 +1,8 @@
+import uuid
 from asyncio import sleep
 from http import HTTPStatus
 
+import jwt
 import pytest
 
 
@@ -152,6 +154,24 @@ async def test_refresh_tokens_success(make_post_request_for_login, make_post_req
     assert refresh_response.body['refresh_token'] != refresh_token
 
 
+async def test_refresh_tokens_idempotent_retry(make_post_request_for_login, make_post_request__form_data):
+    credentials = {"username": "UserAdmin", "password": "Some_Pass1"}
+    login_response = await make_post_request_for_login('/api/v1/user/login', credentials)
+    refresh_token = login_response.body['refresh_token']
+
+    await sleep(2)  # need some delay to get different refresh token
+    headers = {'Idempotency-Key': str(uuid.uuid4())}
+    first = await make_post_request__form_data('/api/v1/user/refresh', {"refresh_token": refresh_token},
+                                               headers=dict(headers))
+    retry = await make_post_request__form_data('/api/v1/user/refresh', {"refresh_token": refresh_token},
+                                               headers=dict(headers))
+
+    assert first.status == HTTPStatus.OK
+    assert retry.status == HTTPStatus.OK
+    assert retry.headers.get('Idempotent-Replayed') == 'true'
+    assert retry.body == first.body
+
+
 async def test_refresh_with_invalid_token(make_post_request__form_data):
     # use invalid refresh token.
     invalid_token = "some_invalid_token"
@@ -187,6 +207,27 @@ async def test_get_login_history_unauthorized(make_get_request):
     assert response.body['detail'] == "Not authenticated"
 
 
+async def test_get_login_history_page_cursor(make_post_request_for_login, make_get_request):
+    credentials = {"username": "UserAdmin", "password": "Some_Pass1"}
+    login_response = await make_post_request_for_login('/api/v1/user/login', credentials)
+    headers = {"Authorization": f"Bearer {login_response.body['access_token']}"}
+
+    first_page = await make_get_request('/api/v1/user/history', {'page_size': 1}, headers=headers)
+    assert first_page.status == HTTPStatus.OK
+    assert len(first_page.body['items']) == 1
+    assert first_page.body['next_cursor'] is not None
+
+    second_page = await make_get_request('/api/v1/user/history',
+                                         {'page_size': 1, 'cursor': first_page.body['next_cursor']},
+                                         headers=headers)
+    assert second_page.status == HTTPStatus.OK
+    assert len(second_page.body['items']) == 1
+    assert second_page.body['items'][0]['login_date'] <= first_page.body['items'][0]['login_date']
+
+    bad_cursor = await make_get_request('/api/v1/user/history', {'cursor': 'bad'}, headers=headers)
+    assert bad_cursor.status == HTTPStatus.BAD_REQUEST
+
+
 async def test_update_user_success(make_post_request_for_login, make_patch_request):
     credentials = {"username": "UserAdmin", "password": "Some_Pass1"}
     login_response = await make_post_request_for_login('/api/v1/user/login', credentials)
@@ -238,3 +279,38 @@ async def test_get_access_roles_unauthorized(make_get_request):
     response = await make_get_request('/api/v1/user/access-roles')
 
     assert response.status == HTTPStatus.FORBIDDEN
+
+
+async def test_jwks_verifies_access_token(make_post_request_for_login, make_get_request):
+    credentials = {"username": "UserAdmin", "password": "Some_Pass1"}
+    login_response = await make_post_request_for_login('/api/v1/user/login', credentials)
+    access_token = login_response.body['access_token']
+
+    jwks_response = await make_get_request('/.well-known/jwks.json')
+
+    assert jwks_response.status == HTTPStatus.OK
+    assert 'max-age' in jwks_response.headers['Cache-Control']
+    keys = {jwk['kid']: jwk for jwk in jwks_response.body['keys']}
+    kid = jwt.get_unverified_header(access_token)['kid']
+    public_key = jwt.PyJWK(keys[kid])
+    decoded = jwt.decode(access_token, public_key.key, algorithms=[public_key.algorithm_name])
+    assert decoded['sub'] == str(login_response.body['id'])
+
+
+async def test_introspect_tokens(make_post_request_for_login, make_post_request):
+    credentials = {"username": "UserAdmin", "password": "Some_Pass1"}
+    login_response = await make_post_request_for_login('/api/v1/user/login', credentials)
+    access_token = login_response.body['access_token']
+    refresh_token = login_response.body['refresh_token']
+
+    response = await make_post_request('/api/v1/user/introspect',
+                                       {'tokens': [access_token, 'not-a-token', refresh_token]})
+
+    assert response.status == HTTPStatus.OK
+    active, invalid, refresh = response.body['results']
+    assert active['active'] is True
+    assert active['sub'] is not None
+    assert isinstance(active['roles'], list)
+    assert invalid['active'] is False
+    assert refresh['active'] is False
+    assert 'max-age=' in response.headers['Cache-Control']
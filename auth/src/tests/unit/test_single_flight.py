@@ -0,0 +1,120 @@
+import asyncio
+
+import pytest
+
+from src.services.single_flight import SingleFlight
+
+
+async def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight('test')
+    started = asyncio.Event()
+    release = asyncio.Event()
+    calls = 0
+
+    async def load():
+        nonlocal calls
+        calls += 1
+        started.set()
+        await release.wait()
+        return {'value': calls}
+
+    first = asyncio.create_task(flight.do('key', load))
+    await started.wait()
+    second = asyncio.create_task(flight.do('key', load))
+    other = asyncio.create_task(flight.do('other', load))
+    await asyncio.sleep(0)
+    release.set()
+
+    first_result, second_result, other_result = await asyncio.gather(first, second, other)
+
+    assert first_result is second_result
+    assert other_result is not first_result
+    assert calls == 2
+    assert flight.stats() == {'executed': 2, 'deduplicated': 1, 'in_flight': 0}
+
+
+async def test_finished_call_is_not_cached():
+    flight = SingleFlight('test')
+    calls = 0
+
+    async def load():
+        nonlocal calls
+        calls += 1
+        return calls
+
+    assert await flight.do('key', load) == 1
+    assert await flight.do('key', load) == 2
+    assert flight.stats()['deduplicated'] == 0
+
+
+async def test_error_is_raised_to_every_caller():
+    flight = SingleFlight('test')
+    release = asyncio.Event()
+
+    async def load():
+        await release.wait()
+        raise ValueError('load failed')
+
+    callers = [asyncio.create_task(flight.do('key', load)) for _ in range(3)]
+    await asyncio.sleep(0)
+    release.set()
+    results = await asyncio.gather(*callers, return_exceptions=True)
+
+    assert all(isinstance(result, ValueError) for result in results)
+    assert results[0] is results[1] is results[2]
+    assert flight.stats() == {'executed': 1, 'deduplicated': 2, 'in_flight': 0}
+
+    async def retry():
+        return 'ok'
+
+    assert await flight.do('key', retry) == 'ok'
+
+
+async def test_cancelled_caller_does_not_cancel_the_call():
+    flight = SingleFlight('test')
+    started = asyncio.Event()
+    release = asyncio.Event()
+    finished = asyncio.Event()
+
+    async def load():
+        started.set()
+        await release.wait()
+        finished.set()
+        return 'result'
+
+    first = asyncio.create_task(flight.do('key', load))
+    await started.wait()
+    second = asyncio.create_task(flight.do('key', load))
+    await asyncio.sleep(0)
+    first.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await first
+
+    release.set()
+
+    assert await second == 'result'
+    assert finished.is_set()
+
+
+async def test_call_completes_when_every_caller_is_cancelled():
+    flight = SingleFlight('test')
+    started = asyncio.Event()
+    release = asyncio.Event()
+
+    async def load():
+        started.set()
+        await release.wait()
+        raise ValueError('load failed')
+
+    caller = asyncio.create_task(flight.do('key', load))
+    await started.wait()
+    caller.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await caller
+    assert flight.stats()['in_flight'] == 1
+
+    release.set()
+    for _ in range(3):
+        await asyncio.sleep(0)
+
+    assert flight.stats()['in_flight'] == 0
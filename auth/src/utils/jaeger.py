@@ -1,23 +1,235 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Sequence
+
 from opentelemetry import trace
+from opentelemetry.context import Context
 from opentelemetry.exporter.jaeger.thrift import JaegerExporter
 from opentelemetry.sdk.resources import SERVICE_NAME, Resource
-from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace import ReadableSpan, TracerProvider
 from opentelemetry.sdk.trace.export import (BatchSpanProcessor,
-                                            ConsoleSpanExporter)
-
-
-def configure_tracer(host, port) -> None:
-    resource = Resource(attributes={
-        SERVICE_NAME: 'auth-api-service'
-    })
-    trace.set_tracer_provider(TracerProvider(resource=resource))
-    trace.get_tracer_provider().add_span_processor(
-        BatchSpanProcessor(
-            JaegerExporter(
-                agent_host_name=host,
-                agent_port=port,
-            )
-        )
+                                            ConsoleSpanExporter, SpanExporter)
+from opentelemetry.sdk.trace.sampling import (ALWAYS_OFF, ALWAYS_ON, Decision,
+                                              ParentBased, Sampler,
+                                              SamplingResult,
+                                              TraceIdRatioBased)
+from opentelemetry.trace import (Link, SpanContext, SpanKind, StatusCode,
+                                 TraceFlags)
+from opentelemetry.trace.span import TraceState
+from opentelemetry.util.types import Attributes
+
+from src.core.config import JaegerConf, TracingConfig
+from src.core.logger import logger
+
+TailRule = Callable[[ReadableSpan, list[ReadableSpan]], bool]
+
+
+class RateLimitedSampler(Sampler):
+    """
+    Samples at most `rate` new traces per second with a token bucket, so tracing cost stays flat under load.
+    Tokens are updated without a lock: samplers run on the event loop thread, a rare race only samples one
+    trace more.
+
+    :param rate: Max sampled traces per second.
+    """
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.capacity = max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def should_sample(self, parent_context: Context | None, trace_id: int, name: str,
+                      kind: SpanKind | None = None, attributes: Attributes = None,
+                      links: Sequence[Link] | None = None, trace_state: TraceState | None = None) -> SamplingResult:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return SamplingResult(Decision.RECORD_AND_SAMPLE, attributes, trace_state)
+        return SamplingResult(Decision.DROP, None, trace_state)
+
+    def get_description(self) -> str:
+        return f'RateLimitedSampler{{{self.rate}}}'
+
+
+class RecordOnlySampler(Sampler):
+    """
+    Records spans the wrapped sampler drops instead of discarding them, so tail sampling can still keep
+    their traces. Recorded spans are not exported unless a tail sampling rule keeps them.
+
+    :param sampler: The head sampler.
+    """
+    def __init__(self, sampler: Sampler):
+        self.sampler = sampler
+
+    def should_sample(self, parent_context: Context | None, trace_id: int, name: str,
+                      kind: SpanKind | None = None, attributes: Attributes = None,
+                      links: Sequence[Link] | None = None, trace_state: TraceState | None = None) -> SamplingResult:
+        result = self.sampler.should_sample(parent_context, trace_id, name, kind, attributes, links, trace_state)
+        if result.decision == Decision.DROP:
+            return SamplingResult(Decision.RECORD_ONLY, attributes, result.trace_state)
+        return result
+
+    def get_description(self) -> str:
+        return f'RecordOnlySampler{{{self.sampler.get_description()}}}'
+
+
+def keep_slow(latency_seconds: float) -> TailRule:
+    """
+    Tail sampling rule keeping traces whose local root span lasted at least `latency_seconds`.
+    """
+    def rule(root: ReadableSpan, spans: list[ReadableSpan]) -> bool:
+        return (root.end_time - root.start_time) / 1e9 >= latency_seconds
+    return rule
+
+
+def keep_errors(root: ReadableSpan, spans: list[ReadableSpan]) -> bool:
+    """
+    Tail sampling rule keeping traces with a span ended with an error status, e.g. a 5xx response.
+    """
+    return any(span.status.status_code == StatusCode.ERROR for span in spans)
+
+
+def promote(span: ReadableSpan) -> ReadableSpan:
+    """
+    Copies a recorded span with the sampled flag set, so the batch processor exports it.
+    """
+    context = span.context
+    return ReadableSpan(
+        name=span.name,
+        context=SpanContext(context.trace_id, context.span_id, context.is_remote,
+                            TraceFlags(TraceFlags.SAMPLED), context.trace_state),
+        parent=span.parent,
+        resource=span.resource,
+        attributes=span.attributes,
+        events=span.events,
+        links=span.links,
+        kind=span.kind,
+        status=span.status,
+        start_time=span.start_time,
+        end_time=span.end_time,
+        instrumentation_scope=span.instrumentation_scope,
     )
-    # Allows to see flights in the console
-    trace.get_tracer_provider().add_span_processor(BatchSpanProcessor(ConsoleSpanExporter()))
+
+
+class TailSamplingSpanProcessor(BatchSpanProcessor):
+    """
+    Batch span processor that also exports traces the head sampler didn't sample, when a rule keeps them.
+
+    Spans of unsampled traces are buffered until the local root span of the trace (the request span) ends,
+    then the trace is either exported as a whole or dropped. Sampled spans are exported as usual.
+
+    :param exporter: The span exporter.
+    :param rules: Tail sampling rules, a trace is kept if any rule returns True for its root span and spans.
+    :param max_traces: Max buffered traces, the oldest ones are dropped.
+    :param options: Arguments of the batch span processor.
+    """
+    def __init__(self, exporter: SpanExporter, rules: Sequence[TailRule], max_traces: int, **options):
+        super().__init__(exporter, **options)
+        self.rules = tuple(rules)
+        self.max_traces = max_traces
+        self.traces: OrderedDict[int, list[ReadableSpan]] = OrderedDict()
+        self.kept = 0
+        self.dropped = 0
+        self._traces_lock = threading.Lock()
+
+    def on_end(self, span: ReadableSpan) -> None:
+        if span.context.trace_flags.sampled:
+            super().on_end(span)
+            return
+        trace_id = span.context.trace_id
+        is_local_root = span.parent is None or span.parent.is_remote
+        with self._traces_lock:
+            spans = self.traces.pop(trace_id, [])
+            spans.append(span)
+            if not is_local_root:
+                self.traces[trace_id] = spans
+                while len(self.traces) > self.max_traces:
+                    self.traces.popitem(last=False)
+                    self.dropped += 1
+                return
+        if any(rule(span, spans) for rule in self.rules):
+            self.kept += 1
+            for buffered in spans:
+                super().on_end(promote(buffered))
+        else:
+            self.dropped += 1
+
+
+def create_sampler(config: TracingConfig) -> Sampler:
+    """
+    Builds the head sampler.
+
+    :param config: Tracing configuration settings.
+    :return: The sampler, wrapped to record dropped spans if tail sampling is on.
+    """
+    if config.sampler == 'always_on':
+        sampler = ALWAYS_ON
+    elif config.sampler == 'always_off':
+        sampler = ALWAYS_OFF
+    elif config.sampler == 'ratio':
+        sampler = TraceIdRatioBased(config.ratio)
+    elif config.sampler == 'rate_limited':
+        sampler = RateLimitedSampler(config.rate_limit)
+    else:
+        raise ValueError(f"Unknown trace sampler: {config.sampler}")
+    if config.parent_based:
+        sampler = ParentBased(sampler)
+    if config.tail_sampling:
+        sampler = RecordOnlySampler(sampler)
+    return sampler
+
+
+def create_exporters(jaeger: JaegerConf, config: TracingConfig) -> list[SpanExporter]:
+    exporters = []
+    for name in filter(None, (name.strip() for name in config.exporters.split(','))):
+        if name == 'jaeger':
+            exporters.append(JaegerExporter(agent_host_name=jaeger.host, agent_port=jaeger.port))
+        elif name == 'console':
+            # Allows to see flights in the console
+            exporters.append(ConsoleSpanExporter())
+        else:
+            raise ValueError(f"Unknown span exporter: {name}")
+    return exporters
+
+
+def create_tracer_provider(jaeger: JaegerConf, config: TracingConfig,
+                           exporters: list[SpanExporter] | None = None) -> TracerProvider:
+    """
+    Builds a tracer provider with the configured sampler and batch span processors.
+
+    :param jaeger: Jaeger configuration settings.
+    :param config: Tracing configuration settings.
+    :param exporters: Span exporters, the configured ones by default.
+    :return: The tracer provider.
+    """
+    provider = TracerProvider(resource=Resource(attributes={SERVICE_NAME: 'auth-api-service'}),
+                              sampler=create_sampler(config))
+    options = {
+        'max_queue_size': config.max_queue_size,
+        'max_export_batch_size': config.max_export_batch_size,
+        'schedule_delay_millis': config.schedule_delay_millis,
+        'export_timeout_millis': config.export_timeout_millis,
+    }
+    for exporter in create_exporters(jaeger, config) if exporters is None else exporters:
+        if config.tail_sampling:
+            rules = [keep_errors, keep_slow(config.tail_latency_ms / 1000)]
+            processor = TailSamplingSpanProcessor(exporter, rules, config.tail_max_traces, **options)
+        else:
+            processor = BatchSpanProcessor(exporter, **options)
+        provider.add_span_processor(processor)
+    return provider
+
+
+def configure_tracer(jaeger: JaegerConf, config: TracingConfig) -> None:
+    """
+    Sets the global tracer provider.
+
+    :param jaeger: Jaeger configuration settings.
+    :param config: Tracing configuration settings.
+    """
+    provider = create_tracer_provider(jaeger, config)
+    trace.set_tracer_provider(provider)
+    logger.info(f"Tracing: sampler {provider.sampler.get_description()}, exporters: {config.exporters or 'none'}")
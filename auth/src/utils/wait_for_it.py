@@ -15,7 +15,6 @@ async def wait_for_postgres(dsn: str, max_retries: int = 50, sleep_interval: flo
     :param sleep_interval: The time to sleep between retries in seconds.
     """
     retry_count = 0
-    print(dsn)
     while retry_count < max_retries:
         try:
             conn = await asyncpg.connect(dsn=dsn)
@@ -24,7 +23,6 @@ async def wait_for_postgres(dsn: str, max_retries: int = 50, sleep_interval: flo
             logger.info("PostgreSQL is ready.")
             return
         except Exception as e:
-            logger.warning(dsn)
             logger.warning(f"An error occurred while connecting to PostgreSQL: {e}. Retrying...")
             retry_count += 1
             await asyncio.sleep(sleep_interval)
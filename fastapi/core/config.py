@@ -7,6 +7,23 @@ env_file = '.env' if os.path.exists('.env') else None
 env_auth_file = '.env_auth' if os.path.exists('.env_auth') else None
 
 
+class LoggingConf(BaseSettings):
+    """
+    Configuration settings for logging.
+
+    :param level: Min level of logged messages.
+    :param serialize: Write records as JSON lines, otherwise as text.
+    :param file: Log file path, empty to log to stderr only.
+    :param rotation: Size of the log file that triggers rotation.
+    """
+    model_config = SettingsConfigDict(env_file=env_file, env_prefix='LOG_')
+
+    level: str = 'INFO'
+    serialize: bool = True
+    file: str = 'server.log'
+    rotation: str = '10 MB'
+
+
 class CacheConfBase(BaseSettings):
     """
     Configuration settings for cache backend.
@@ -161,6 +178,10 @@ class FastApiConf(BaseSettings):
     Configuration settings for the FastAPI application.
 
     :param name: The name of the FastAPI application.
+    :param jwt_verification: How access tokens are checked: 'jwks' - locally with the auth service public keys,
+        'remote' - by a request to the auth service.
+    :param auth_jwks_url: URL of the auth service JWKS endpoint.
+    :param jwks_refresh_seconds: Background refresh interval of the JWKS keys, in seconds.
     """
     model_config = SettingsConfigDict(env_file=env_auth_file, env_prefix='PROJECT_')
 
@@ -172,3 +193,20 @@ class FastApiConf(BaseSettings):
 
     secret_key: str = 'secret'
     is_dev_mode: bool = True
+
+    jwt_verification: str = 'jwks'
+    auth_jwks_url: str = 'http://auth-api:8000/.well-known/jwks.json'
+    jwks_refresh_seconds: int = 300
+
+
+class DenylistConf(BaseSettings):
+    """
+    Redis keys of revoked access tokens kept by the auth service, read to reject them in jwks mode.
+
+    :param key: Redis sorted set of revoked jtis, scored by token expiry.
+    :param generation_key: Redis key of a user token generation, tokens with another generation are revoked.
+    """
+    model_config = SettingsConfigDict(env_file=env_auth_file, env_prefix='DENYLIST_')
+
+    key: str = 'denylist:access_tokens'
+    generation_key: str = 'token_generation:user:{user_id}'
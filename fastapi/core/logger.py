@@ -1,11 +1,24 @@
+"""
+Logging of the movies service. Records carry the request id set by `RequestIdMiddleware` and are written
+by loguru's queue thread to stderr and to a rotating file, as JSON lines when `serialize` is on.
+"""
 import logging
+import sys
 
 from loguru import logger
 
-fmt = "{process.id} - {thread.id} - {time} - {name} - {level} - {message}"
-logger.add('server.log', format=fmt,
-           rotation='10MB', compression='zip',
-           enqueue=True)
+from core.config import LoggingConf
+from core.middleware import request_id_var
+
+fmt = "{process.id} - {thread.id} - {time} - {extra[request_id]} - {name} - {level} - {message}"
+
+logging_config = LoggingConf()
+logger.remove()
+logger.configure(patcher=lambda record: record['extra'].update(request_id=request_id_var.get()))
+logger.add(sys.stderr, level=logging_config.level, format=fmt, serialize=logging_config.serialize, enqueue=True)
+if logging_config.file:
+    logger.add(logging_config.file, level=logging_config.level, format=fmt, serialize=logging_config.serialize,
+               rotation=logging_config.rotation, compression='zip', enqueue=True)
 
 LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 LOG_DEFAULT_HANDLERS = ['console', ]
@@ -0,0 +1,45 @@
+"""
+Pure ASGI middlewares.
+"""
+import uuid
+from contextvars import ContextVar
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+REQUEST_ID_HEADER = b'x-request-id'
+
+request_id_var: ContextVar[str | None] = ContextVar('request_id', default=None)
+
+
+class RequestIdMiddleware:
+    """
+    Keeps the `X-Request-Id` of HTTP requests, set by nginx, in `request_id_var` for logs and calls
+    to the auth service, and echoes it in the response. Requests without one get a generated id.
+
+    :param app: The wrapped ASGI app.
+    """
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        request_id = None
+        for name, value in scope['headers']:
+            if name == REQUEST_ID_HEADER:
+                request_id = value
+                break
+        if not request_id:
+            request_id = str(uuid.uuid4()).encode()
+
+        async def send_with_request_id(message: Message):
+            if message['type'] == 'http.response.start':
+                message['headers'] = [*message.get('headers', ()), (REQUEST_ID_HEADER, request_id)]
+            await send(message)
+
+        token = request_id_var.set(request_id.decode('latin-1'))
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            request_id_var.reset(token)
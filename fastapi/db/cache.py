@@ -73,6 +73,16 @@ class CacheBackend(ABC):
         """
         pass
 
+    @abstractmethod
+    async def mget(self, keys: list[str]) -> list[str | None]:
+        """
+        Asynchronously retrieves values for several keys in one call.
+
+        :param keys: The keys for which to retrieve values.
+        :return: Values in the order of the keys, None for missing keys.
+        """
+        pass
+
 
 class RedisCache(CacheBackend):
     """
@@ -108,6 +118,17 @@ class RedisCache(CacheBackend):
         """
         await self.client.set(name=key, value=value, ex=expire)
 
+    @backoff.on_exception(backoff.expo, ConnectionError, factor=0.5, max_value=5.0,
+                          max_tries=3, logger=LoggerAdapter(logger))
+    async def mget(self, keys: list[str]) -> list[str | None]:
+        """
+        Asynchronously retrieves values for several keys from the Redis cache in one round trip.
+
+        :param keys: The keys for which to retrieve values.
+        :return: Values in the order of the keys, None for missing keys.
+        """
+        return await self.client.mget(keys)
+
 
 class CacheBackendFactory:
     """
@@ -1,9 +1,12 @@
 from api.v1 import films, genres, persons
 from core import config
 from core.logger import logger
+from core.middleware import RequestIdMiddleware
 from db import cache, search_engine
 from db.cache import CacheBackendFactory, CacheClientInitializer
 from db.search_engine import SearchBackendFactory, SearchClientInitializer
+from utils import jwks
+from utils.jwks import JwksClient
 
 from fastapi import FastAPI
 from fastapi.responses import ORJSONResponse
@@ -16,6 +19,7 @@ app = FastAPI(
     openapi_url='/api/openapi-movies.json',
     default_response_class=ORJSONResponse,
 )
+app.add_middleware(RequestIdMiddleware)
 
 
 @app.on_event('startup')
@@ -36,6 +40,9 @@ async def startup():
         search_conf.backend_type,
         **search_conf.get_init_params()
     )
+    if fast_api_conf.jwt_verification == 'jwks':
+        jwks.jwks_client = JwksClient(fast_api_conf.auth_jwks_url, fast_api_conf.jwks_refresh_seconds)
+        jwks.jwks_client.start()
 
 
 @app.on_event('shutdown')
@@ -56,6 +63,8 @@ async def shutdown():
         search_conf.backend_type,
         search_engine.search_engine.client
     )
+    if jwks.jwks_client is not None:
+        await jwks.jwks_client.close()
 
 
 app.include_router(films.router, prefix='/api/v1/films', tags=['films'])
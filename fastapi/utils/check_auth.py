@@ -1,16 +1,27 @@
+import time
+import uuid
 from http import HTTPStatus
 
 import aiohttp
 import jwt
 from core import config
 from core.logger import logger
+from core.middleware import request_id_var
+from db import cache
+from redis.asyncio import RedisError
+from utils import jwks
 
 from fastapi import HTTPException, Security
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 
+ROLES_VERSION_GLOBAL_KEY = 'roles_version:global'
+ROLES_VERSION_USER_KEY = 'roles_version:user:{user_id}'
+ACCESS_TOKEN_TYPE = 'access'
+
 security = HTTPBearer()
 cache_conf = config.CacheConf.read_config()
 fast_api_conf = config.FastApiConf()
+denylist_conf = config.DenylistConf()
 
 
 async def make_get_request(url: str, query_data: dict | None = None, headers: dict | None = None):
@@ -34,12 +45,13 @@ async def get_auth_user_roles(credentials: HTTPAuthorizationCredentials):
     """Retrieves a list of user roles associated with the provided access token."""
     access_token = await extract_token(credentials)
     headers = {"Authorization": f"Bearer {access_token}",
-               "Content-Type": "application/json"}
+               "Content-Type": "application/json",
+               "X-Request-Id": request_id_var.get() or str(uuid.uuid4())}
     roles_response = await make_get_request(
         url='http://auth-api:8000/api/v1/user/access-roles',
         headers=headers
     )
-    logger.info(roles_response)
+    logger.debug("Access roles response: {} {}", roles_response.status, roles_response.body)
     user_roles = [role['name'] for role in roles_response.body]
     if roles_response.status == HTTPStatus.BAD_REQUEST:
         raise HTTPException(status_code=HTTPStatus.BAD_REQUEST, detail="bad auth request")
@@ -48,26 +60,40 @@ async def get_auth_user_roles(credentials: HTTPAuthorizationCredentials):
     return user_roles
 
 
+async def get_token_roles(credentials: HTTPAuthorizationCredentials):
+    """
+    Retrieves user roles from the access token claims, verified locally.
+    The claims are trusted only if their roles version matches the current one kept in Redis by the auth service,
+    otherwise the roles are requested from the auth service.
+    """
+    if fast_api_conf.jwt_verification != 'jwks':
+        return await get_auth_user_roles(credentials)
+    try:
+        decoded_jwt, roles_version = await verify_access_token(credentials)
+    except RedisError as e:
+        logger.error(f"Can't check access token revocation: {e}")
+        return await get_auth_user_roles(credentials)
+    if 'roles' in decoded_jwt and roles_version is not None and decoded_jwt.get('rv') == roles_version:
+        return decoded_jwt['roles']
+    return await get_auth_user_roles(credentials)
+
+
 async def is_admin(credentials: HTTPAuthorizationCredentials = Security(security)):
-    return fast_api_conf.role_admin in await get_auth_user_roles(credentials)
+    return fast_api_conf.role_admin in await get_token_roles(credentials)
 
 
 async def is_authorized(credentials: HTTPAuthorizationCredentials = Security(security)):
-    return fast_api_conf.role_user in await get_auth_user_roles(credentials)
+    return fast_api_conf.role_user in await get_token_roles(credentials)
 
 
 async def is_anonymous(credentials: HTTPAuthorizationCredentials = Security(security)):
-    return fast_api_conf.role_anonym in await get_auth_user_roles(credentials)
+    return fast_api_conf.role_anonym in await get_token_roles(credentials)
 
 
-async def decode_jwt_self(credentials: HTTPAuthorizationCredentials):
-    """
-    To reduce the load on the auth service, we simply check for the presence of a successfully decoded token.
-    """
-    access_token = await extract_token(credentials)
+def decode_jwt(access_token: str, key, algorithms: list[str]) -> dict:
+    """Decodes and verifies the token, converting verification errors into HTTP 401."""
     try:
-        decoded_jwt = jwt.decode(access_token, fast_api_conf.secret_key, algorithms=["HS256"])
-        return decoded_jwt
+        return jwt.decode(access_token, key, algorithms=algorithms)
     except jwt.ExpiredSignatureError:
         raise HTTPException(
             status_code=HTTPStatus.UNAUTHORIZED,
@@ -82,10 +108,87 @@ async def decode_jwt_self(credentials: HTTPAuthorizationCredentials):
         )
 
 
+async def decode_jwt_self(credentials: HTTPAuthorizationCredentials):
+    """
+    To reduce the load on the auth service, we simply check for the presence of a successfully decoded token.
+    """
+    access_token = await extract_token(credentials)
+    return decode_jwt(access_token, fast_api_conf.secret_key, ["HS256"])
+
+
+async def decode_jwt_jwks(credentials: HTTPAuthorizationCredentials):
+    """
+    Verifies the token locally with the auth service public key matching its `kid` header.
+    Tokens without `kid` are HS256 ones, they are verified with the shared secret in dev mode only.
+    """
+    access_token = await extract_token(credentials)
+    invalid_token = HTTPException(status_code=HTTPStatus.UNAUTHORIZED,
+                                  detail="Invalid token",
+                                  headers={"WWW-Authenticate": "Bearer"})
+    try:
+        kid = jwt.get_unverified_header(access_token).get('kid')
+    except jwt.InvalidTokenError:
+        raise invalid_token
+    if kid is None:
+        if fast_api_conf.is_dev_mode:
+            return decode_jwt(access_token, fast_api_conf.secret_key, ["HS256"])
+        raise invalid_token
+    key = await jwks.jwks_client.get_key(kid)
+    if key is None:
+        raise invalid_token
+    return decode_jwt(access_token, key.key, [key.algorithm_name])
+
+
+def decode_value(value: bytes | str | None) -> str | None:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+async def verify_access_token(credentials: HTTPAuthorizationCredentials) -> tuple[dict, str | None]:
+    """
+    Verifies the access token locally and checks it's not revoked by a logout in the Redis shared
+    with the auth service. The token jti, the user token generation and the roles version are read
+    in a single round trip.
+
+    :return: The token claims and the current roles version of the user, None if it's unknown.
+    :raises HTTPException: 401 if the token is invalid, isn't an access token or is revoked.
+    :raises RedisError: If the revocation state can't be read.
+    """
+    decoded_jwt = await decode_jwt_jwks(credentials)
+    revoked_token = HTTPException(status_code=HTTPStatus.UNAUTHORIZED,
+                                  detail="Token has been revoked",
+                                  headers={"WWW-Authenticate": "Bearer"})
+    if decoded_jwt.get('typ') != ACCESS_TOKEN_TYPE or 'sub' not in decoded_jwt:
+        raise HTTPException(status_code=HTTPStatus.UNAUTHORIZED,
+                            detail="Invalid token",
+                            headers={"WWW-Authenticate": "Bearer"})
+    user_id = decoded_jwt['sub']
+    async with cache.cache.client.pipeline(transaction=False) as pipe:
+        pipe.mget([ROLES_VERSION_GLOBAL_KEY,
+                   ROLES_VERSION_USER_KEY.format(user_id=user_id),
+                   denylist_conf.generation_key.format(user_id=user_id)])
+        pipe.zscore(denylist_conf.key, decoded_jwt.get('jti') or '')
+        (global_version, user_version, generation), expires_at = await pipe.execute()
+    # Generations are created when tokens are issued, a missing one was lost by Redis.
+    if generation is None or decoded_jwt.get('gen') != decode_value(generation):
+        raise revoked_token
+    if expires_at is not None and expires_at > time.time():
+        raise revoked_token
+    # A missing part means the auth service lost the version, the claims can't be checked.
+    if global_version is None or user_version is None:
+        return decoded_jwt, None
+    return decoded_jwt, f'{decode_value(global_version)}.{decode_value(user_version)}'
+
+
 async def check_has_token(credentials: HTTPAuthorizationCredentials = Security(security)):
     """
     For tests, we replace requests to the auth service with a simple token verification within the movies-api service
     """
+    if fast_api_conf.jwt_verification == 'jwks':
+        try:
+            return bool(await verify_access_token(credentials))
+        except RedisError as e:
+            logger.error(f"Can't check access token revocation: {e}")
+            return bool(await get_auth_user_roles(credentials))
     if fast_api_conf.is_dev_mode:
         return bool(await decode_jwt_self(credentials))
     return bool(await get_auth_user_roles(credentials))
@@ -0,0 +1,97 @@
+import asyncio
+import time
+import uuid
+
+import aiohttp
+import jwt
+from core.logger import logger
+
+
+class JwksClient:
+    """
+    Keeps the auth service public keys in memory, so access tokens are verified locally.
+
+    Keys are refreshed in the background every `refresh_seconds`. A token signed by an unknown key triggers
+    an immediate refresh, at most once per `min_refresh_seconds`, which picks up rotated keys.
+
+    :param url: URL of the auth service JWKS endpoint.
+    :param refresh_seconds: Background refresh interval, in seconds.
+    :param min_refresh_seconds: Minimal interval between on-demand refreshes, in seconds.
+    """
+    def __init__(self, url: str, refresh_seconds: int, min_refresh_seconds: int = 10):
+        self.url = url
+        self.refresh_seconds = refresh_seconds
+        self.min_refresh_seconds = min_refresh_seconds
+        self.keys: dict[str, jwt.PyJWK] = {}
+        self._fetched_at = 0.0
+        self._lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+
+    async def fetch(self) -> None:
+        """
+        Downloads the key set and replaces the cached keys.
+        """
+        headers = {'X-Request-Id': str(uuid.uuid4())}
+        self._fetched_at = time.monotonic()
+        async with aiohttp.ClientSession() as session:
+            async with session.get(self.url, headers=headers, timeout=aiohttp.ClientTimeout(total=5)) as response:
+                response.raise_for_status()
+                body = await response.json()
+        keys = {}
+        for jwk in body.get('keys', []):
+            try:
+                keys[jwk['kid']] = jwt.PyJWK(jwk)
+            except (KeyError, jwt.PyJWKError) as e:
+                logger.warning(f'Skipping unsupported JWK: {e}')
+        self.keys = keys
+        logger.info(f'JWKS refreshed, keys: {list(keys)}')
+
+    async def _refresh(self, min_age: float = 0.0) -> None:
+        """
+        Fetches the key set unless it was fetched less than `min_age` seconds ago. Errors are logged.
+
+        :param min_age: Minimal age of the cached key set to refetch it, in seconds.
+        """
+        async with self._lock:
+            if self._fetched_at and time.monotonic() - self._fetched_at < min_age:
+                return
+            try:
+                await self.fetch()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.error(f'Failed to fetch JWKS from {self.url}: {e}')
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            await self._refresh()
+            await asyncio.sleep(self.refresh_seconds)
+
+    def start(self) -> None:
+        """
+        Starts background refreshing. The first fetch happens right away, failures are retried on schedule.
+        """
+        if self._task is None:
+            self._task = asyncio.create_task(self._refresh_loop())
+
+    async def close(self) -> None:
+        """
+        Stops background refreshing.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def get_key(self, kid: str) -> jwt.PyJWK | None:
+        """
+        Returns a public key by its kid, refreshing the key set if the kid is unknown.
+
+        :param kid: Key identifier from the token header.
+        :return: The key, or None if the auth service doesn't know it.
+        """
+        key = self.keys.get(kid)
+        if key is None:
+            await self._refresh(min_age=self.min_refresh_seconds)
+            key = self.keys.get(kid)
+        return key
+
+
+jwks_client: JwksClient | None = None
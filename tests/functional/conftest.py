@@ -57,11 +57,15 @@ async def make_get_request(http_session, mock_auth_jwt_token):
 
 
 @pytest_asyncio.fixture(scope='session')
-async def mock_auth_jwt_token():
+async def mock_auth_jwt_token(mock_token_generation):
+    user_id, generation = await mock_token_generation()
     expire = datetime.utcnow() + timedelta(minutes=5)
     payload = {
-        "sub": str(uuid.uuid4()),
+        "sub": user_id,
         "exp": expire,
+        "typ": "access",
+        "jti": str(uuid.uuid4()),
+        "gen": generation,
     }
     encoded_jwt = jwt.encode(payload, test_settings.secret_key, algorithm="HS256")
     return encoded_jwt
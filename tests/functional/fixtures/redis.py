@@ -1,12 +1,33 @@
+import uuid
+
 import pytest_asyncio
 from functional.settings import test_settings
 from redis.asyncio import Redis
 
 
 @pytest_asyncio.fixture(scope='session')
-def redis_cleanup():
-    """Cleanup redis cache."""
+def mock_token_generation():
+    """
+    Stores the token generation of the mock user, as the auth service does when it issues a token.
+
+    :return: A function restoring the generation, returns the user id and the generation.
+    """
+    user_id, generation = str(uuid.uuid4()), uuid.uuid4().hex
+
+    async def inner():
+        redis_client = Redis.from_url(test_settings.redis_host)
+        await redis_client.set(test_settings.generation_key.format(user_id=user_id), generation)
+        await redis_client.close()
+        return user_id, generation
+    return inner
+
+
+@pytest_asyncio.fixture(scope='session')
+def redis_cleanup(mock_token_generation):
+    """Cleanup redis cache, keeping the mock token valid."""
     async def inner():
         redis_client = Redis.from_url(test_settings.redis_host)
         await redis_client.flushall()
+        await redis_client.close()
+        await mock_token_generation()
     return inner
@@ -23,6 +23,7 @@ class TestSettings(BaseSettings):
     es_indexes: list[str] | None = None
     es_id_field: str = 'uuid'
     service_url: str = 'http://fastapi:8000'
+    generation_key: str = 'token_generation:user:{user_id}'
 
     secret_key: str = FastApiConf().secret_key
 